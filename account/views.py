@@ -1,5 +1,6 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
+from dashboard.stats import seller_stats
 from listings.models import Listing
 from .forms import ProfileForm
 
@@ -12,6 +13,7 @@ def profile(request):
     return render(request, 'account/profile.html', {
         'user_obj': request.user,
         'listings': my_listings,
+        'stats': seller_stats(request.user.id),
     })
 
 @login_required
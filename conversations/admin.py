@@ -1,17 +1,31 @@
 from django.contrib import admin
-from .models import Conversation, ConversationMessage
+from .models import ArchivedThread, Conversation, ConversationMember, ConversationMessage
+
+
+class ConversationMemberInline(admin.TabularInline):
+    model = ConversationMember
+    extra = 0
+    raw_id_fields = ('user',)
 
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('id', 'listing', 'modified_at')
-    list_filter = ('modified_at', 'created_at')
+    list_display = ('id', 'listing', 'buyer', 'message_count', 'archived', 'modified_at')
+    list_filter = ('archived', 'modified_at', 'created_at')
     search_fields = ('listing__title', 'members__username')
-    filter_horizontal = ('members',)
+    raw_id_fields = ('listing', 'buyer')
+    inlines = (ConversationMemberInline,)
 
 
 @admin.register(ConversationMessage)
 class ConversationMessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'conversation', 'created_by', 'created_at')
     list_filter = ('created_at',)
-    search_fields = ('content', 'created_by__username')
\ No newline at end of file
+    search_fields = ('content', 'created_by__username')
+
+
+@admin.register(ArchivedThread)
+class ArchivedThreadAdmin(admin.ModelAdmin):
+    list_display = ('conversation', 'message_count', 'archived_at')
+    raw_id_fields = ('conversation',)
+    exclude = ('data',)
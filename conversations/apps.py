@@ -1,5 +1,12 @@
 from django.apps import AppConfig
 
+from listings.fts import install_after_migrate
+
+
 class ConversationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'conversations'
\ No newline at end of file
+    name = 'conversations'
+
+    def ready(self):
+        # Table rebuilds during migrate drop the FTS triggers, put them back
+        install_after_migrate(self, "conversations.search.index")
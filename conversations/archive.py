@@ -0,0 +1,156 @@
+"""
+Archive tier for idle conversations.
+
+Threads nobody has written to for CONVERSATIONS_ARCHIVE_AFTER_DAYS (mostly
+about listings long sold) only make the messages table and its indexes bigger.
+`archive_conversations` moves each one into a single ArchivedThread row: the
+whole thread as zlib-compressed JSON. The conversation keeps its summary
+(preview, count) for the inbox and is flagged `archived`.
+
+Opening an archived thread reads its block instead of the messages table
+(page()), with the same cursors as the live history. Posting to it puts the
+messages back first (restore(), via Conversation.post), so live threads only
+ever live in one place. A post that raced the archiver finds the conversation
+archived when it updates the summary and restores it then
+(ConversationMessage.save). archive_batch() only deletes the messages it packed.
+"""
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from listings.pagination import KeysetPage, decode_cursor, encode_cursor
+from .models import ArchivedThread, Conversation, ConversationMessage
+
+BATCH_SIZE = 100
+# Same ordering as views._message_page
+KEYS = [('created_at', True), ('id', True)]
+
+
+def cutoff():
+    return timezone.now() - timedelta(days=getattr(settings, 'CONVERSATIONS_ARCHIVE_AFTER_DAYS', 365))
+
+
+def candidates(before):
+    return Conversation.objects.filter(archived=False, message_count__gt=0, modified_at__lt=before)
+
+
+def _pack(messages):
+    rows = [[m.id, m.created_by_id, m.created_at.isoformat(), m.content] for m in messages]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 6)
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def archive_batch(conversation_ids, before):
+    """
+    Archive the given conversations (those still idle since `before`) in one
+    short transaction. Returns how many were archived.
+    """
+    with transaction.atomic():
+        # Write first: this takes SQLite's write lock (and row locks elsewhere), so
+        # no post can update these conversations until we commit. update() leaves
+        # modified_at alone.
+        Conversation.objects.filter(pk__in=conversation_ids, archived=False, modified_at__lt=before).update(
+            archived=True
+        )
+        counts = dict(
+            Conversation.objects.filter(pk__in=conversation_ids, archived=True, archived_thread__isnull=True)
+            .values_list('pk', 'message_count')
+        )
+        if not counts:
+            return 0
+
+        threads = {}
+        for message in ConversationMessage.objects.filter(conversation_id__in=counts).order_by('created_at', 'id'):
+            threads.setdefault(message.conversation_id, []).append(message)
+        # A thread that doesn't hold what its summary says got a message since it was picked: leave it live
+        changed = [pk for pk, count in counts.items() if len(threads.get(pk, [])) != count]
+        if changed:
+            Conversation.objects.filter(pk__in=changed).update(archived=False)
+        archived = {pk: messages for pk, messages in threads.items() if pk not in changed}
+        if not archived:
+            return 0
+
+        Conversation.objects.filter(pk__in=archived).update(last_message=None)
+        ArchivedThread.objects.bulk_create([
+            ArchivedThread(conversation_id=pk, data=_pack(messages), message_count=len(messages))
+            for pk, messages in archived.items()
+        ])
+        # Straight DELETE: the ORM would fetch every row to send post_delete, whose
+        # receiver recounts the conversation, which is exactly what this doesn't want.
+        # Only up to the newest message packed, so nothing that missed the block goes.
+        with connection.cursor() as cursor:
+            table = connection.ops.quote_name(ConversationMessage._meta.db_table)
+            condition = ' OR '.join(['(conversation_id = %s AND id <= %s)'] * len(archived))
+            params = [value for pk, messages in archived.items() for value in (pk, max(m.id for m in messages))]
+            cursor.execute(f'DELETE FROM {table} WHERE {condition}', params)
+    return len(archived)
+
+
+def load(conversation):
+    """
+    The archived messages of a conversation, oldest first, authors attached.
+    Messages by since deleted users are dropped, as their live ones would be.
+    """
+    thread = ArchivedThread.objects.filter(conversation=conversation).first()
+    if thread is None:
+        return []
+    rows = _unpack(thread.data)
+    authors = User.objects.in_bulk({row[1] for row in rows})
+    messages = []
+    for pk, author_id, created_at, content in rows:
+        if author_id not in authors:
+            continue
+        messages.append(ConversationMessage(
+            id=pk, conversation=conversation, created_by=authors[author_id],
+            created_at=parse_datetime(created_at), content=content,
+        ))
+    return messages
+
+
+def page(conversation, cursor=None, per_page=30):
+    """
+    Like pagination.paginate over the thread newest first, but from the archive block.
+    Raises InvalidCursor like paginate does.
+    """
+    messages = load(conversation)
+    messages.reverse()
+    if cursor:
+        _, (created_at, pk) = decode_cursor(ConversationMessage, KEYS, cursor)
+        messages = [m for m in messages if (m.created_at, m.id) < (created_at, pk)]
+    rows = messages[:per_page]
+    if not rows:
+        return KeysetPage([])
+    more = len(messages) > per_page
+    return KeysetPage(rows, next_cursor=encode_cursor(KEYS, rows[-1], 'next') if more else None)
+
+
+def restore(conversation):
+    """
+    Move an archived thread back into the messages table, ids and all.
+    Safe to call from two posts at once: the second finds it already done.
+    """
+    with transaction.atomic():
+        # Write first, like archive_batch, so only one restore unpacks the block.
+        # Whoever waited on the lock sees the thread already live and leaves it.
+        if not Conversation.objects.filter(pk=conversation.pk, archived=True).update(archived=True):
+            conversation.refresh_from_db(fields=['archived', 'last_message', 'message_count'])
+            return
+        messages = load(conversation)
+        ConversationMessage.objects.bulk_create(messages)
+        ArchivedThread.objects.filter(conversation=conversation).delete()
+        newest = messages[-1] if messages else None
+        Conversation.objects.filter(pk=conversation.pk).update(
+            archived=False, last_message=newest, message_count=len(messages)
+        )
+    conversation.archived = False
+    conversation.last_message = newest
+    conversation.message_count = len(messages)
@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import unread
+
+
+def unread_messages(request):
+    """
+    `unread_message_count` for the navbar badge. Lazy and cached (unread.py), so
+    a page that doesn't show it costs nothing and one that does usually hits the cache.
+    """
+    def count():
+        user = request.user
+        return unread.total_unread(user) if user.is_authenticated else 0
+    return {'unread_message_count': SimpleLazyObject(count)}
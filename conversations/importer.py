@@ -0,0 +1,112 @@
+"""
+Bulk import of chat history (the import_messages command).
+
+Posting one message at a time (Conversation.post) costs an INSERT and an
+UPDATE each, plus its on-commit notifications. An import instead writes its
+messages with bulk_create, a batch at a time, and then fixes up the summaries
+of the conversations the batch touched with one UPDATE. No per-row signals,
+no pub/sub: nobody is watching old history arrive.
+
+Imported messages count as read for members who were caught up before the
+import, so a history import doesn't light up everyone's unread badge.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Substr
+from django.utils import timezone
+
+from . import archive, unread
+from .models import Conversation, ConversationMember, ConversationMessage
+
+BATCH_SIZE = 1000
+
+
+def import_messages(rows, batch_size=BATCH_SIZE):
+    """
+    Import messages from an iterable of dicts with conversation_id,
+    created_by_id, content and optionally created_at (defaults to now).
+    Rows for a conversation that doesn't exist, or by someone who isn't one of
+    its members, are skipped. Returns (imported, skipped).
+    """
+    imported = skipped = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            done = _import_batch(batch)
+            imported, skipped = imported + done, skipped + len(batch) - done
+            batch = []
+    if batch:
+        done = _import_batch(batch)
+        imported, skipped = imported + done, skipped + len(batch) - done
+    return imported, skipped
+
+
+def _import_batch(rows):
+    conversation_ids = {row['conversation_id'] for row in rows}
+    # History for an archived thread: bring the thread back first, the summary is redone below anyway
+    for conversation in Conversation.objects.filter(pk__in=conversation_ids, archived=True):
+        archive.restore(conversation)
+    members = set(
+        ConversationMember.objects.filter(conversation_id__in=conversation_ids)
+        .values_list('conversation_id', 'user_id')
+    )
+    now = timezone.now()
+    messages = [
+        ConversationMessage(
+            conversation_id=row['conversation_id'],
+            created_by_id=row['created_by_id'],
+            content=row['content'],
+            created_at=row.get('created_at') or now,
+        )
+        for row in rows
+        if (row['conversation_id'], row['created_by_id']) in members
+    ]
+    if not messages:
+        return 0
+    touched = {message.conversation_id for message in messages}
+
+    with transaction.atomic():
+        caught_up = dict(
+            Conversation.objects.filter(pk__in=touched)
+            .annotate(newest_id=Coalesce(Max('messages__id'), 0))
+            .values_list('pk', 'newest_id')
+        )
+        ConversationMessage.objects.bulk_create(messages, batch_size=len(messages))
+        refresh_summaries(touched)
+
+        newest_imported = {}
+        for message in messages:
+            newest_imported[message.conversation_id] = max(message.id, newest_imported.get(message.conversation_id, 0))
+        for conversation_id, newest_id in newest_imported.items():
+            ConversationMember.objects.filter(
+                conversation_id=conversation_id, last_read_message_id__gte=caught_up[conversation_id]
+            ).update(last_read_message_id=newest_id)
+
+        user_ids = set(
+            ConversationMember.objects.filter(conversation_id__in=touched).values_list('user_id', flat=True)
+        )
+        transaction.on_commit(lambda: unread.forget(user_ids))
+    return len(messages)
+
+
+def refresh_summaries(conversation_ids):
+    """
+    Recompute last message and count for several conversations in one UPDATE.
+    The conversation only moves up the inbox if the newest message is newer than it.
+    """
+    newest = ConversationMessage.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+    counts = (
+        ConversationMessage.objects.filter(conversation=OuterRef('pk'))
+        .order_by().values('conversation').annotate(n=Count('id')).values('n')
+    )
+    max_length = Conversation._meta.get_field('last_message_preview').max_length
+    Conversation.objects.filter(pk__in=conversation_ids).update(
+        last_message=Subquery(newest.values('id')[:1]),
+        last_message_by=Subquery(newest.values('created_by')[:1]),
+        last_message_preview=Coalesce(
+            Subquery(newest.annotate(p=Substr('content', 1, max_length)).values('p')[:1]), Value('')
+        ),
+        message_count=Coalesce(Subquery(counts), 0),
+        modified_at=Greatest(F('modified_at'), Coalesce(Subquery(newest.values('created_at')[:1]), F('modified_at'))),
+    )
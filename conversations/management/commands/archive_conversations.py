@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from conversations import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the messages of conversations idle for CONVERSATIONS_ARCHIVE_AFTER_DAYS into "
+        "compressed archive blocks. Safe to stop and run again, it carries on where it left off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None,
+                            help="Archive conversations idle for longer than this (default: the setting).")
+        parser.add_argument("--batch-size", type=int, default=archive.BATCH_SIZE,
+                            help="Conversations archived per transaction.")
+        parser.add_argument("--pause", type=float, default=0,
+                            help="Seconds to wait between batches, to leave the write lock to the site.")
+
+    def handle(self, *args, **options):
+        before = archive.cutoff()
+        if options["days"] is not None:
+            before = timezone.now() - timedelta(days=options["days"])
+        qs = archive.candidates(before).order_by("id").values_list("id", flat=True)
+
+        archived = 0
+        last_id = 0
+        while True:
+            # Keyset batches; every batch commits on its own, so an interrupted run loses at most one
+            batch = list(qs.filter(id__gt=last_id)[:options["batch_size"]])
+            if not batch:
+                break
+            last_id = batch[-1]
+            archived += archive.archive_batch(batch, before)
+            self.stdout.write(f"{archived} conversations archived so far...")
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} conversations."))
@@ -0,0 +1,63 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from conversations import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Import chat history from a JSONL file, one message per line: "
+        '{"conversation": 12, "created_by": 3, "content": "...", "created_at": "2024-05-01T09:30:00Z"}'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSONL file to read, - for stdin.")
+        parser.add_argument("--batch-size", type=int, default=importer.BATCH_SIZE,
+                            help="Messages inserted per batch.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        try:
+            f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        except OSError as e:
+            raise CommandError(f"Can't read {path}: {e}")
+        self.invalid = 0
+        with f:
+            imported, skipped = importer.import_messages(self._rows(f), batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} messages ({skipped} not from a member of an existing conversation, "
+            f"{self.invalid} unreadable lines skipped)."
+        ))
+
+    def _rows(self, f):
+        # A generator, so only one batch of the file is in memory at a time
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                row = {
+                    "conversation_id": int(record["conversation"]),
+                    "created_by_id": int(record["created_by"]),
+                    "content": str(record["content"]),
+                    "created_at": self._timestamp(record.get("created_at")),
+                }
+            except (ValueError, KeyError, TypeError) as e:
+                self.invalid += 1
+                self.stderr.write(f"Line {number}: {e!r}, skipped")
+                continue
+            yield row
+
+    def _timestamp(self, value):
+        if not value:
+            return None
+        created_at = parse_datetime(value)
+        if created_at is None:
+            raise ValueError(f"bad created_at {value!r}")
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        return created_at
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Substr
+
+
+def fill_summaries(apps, schema_editor):
+    Conversation = apps.get_model('conversations', 'Conversation')
+    ConversationMessage = apps.get_model('conversations', 'ConversationMessage')
+    newest = ConversationMessage.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+    counts = (
+        ConversationMessage.objects.filter(conversation=OuterRef('pk'))
+        .order_by().values('conversation').annotate(n=Count('id')).values('n')
+    )
+    Conversation.objects.update(
+        last_message=Subquery(newest.values('id')[:1]),
+        last_message_by=Subquery(newest.values('created_by')[:1]),
+        last_message_preview=Coalesce(Subquery(newest.annotate(p=Substr('content', 1, 255)).values('p')[:1]), models.Value('')),
+        message_count=Coalesce(Subquery(counts), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='conversations.conversationmessage'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def mark_history_read(apps, schema_editor):
+    # Start everyone at "all caught up" rather than every old message being unread
+    Conversation = apps.get_model('conversations', 'Conversation')
+    ConversationMember = apps.get_model('conversations', 'ConversationMember')
+    last = Conversation.objects.filter(pk=OuterRef('conversation')).values('last_message')[:1]
+    ConversationMember.objects.update(last_read_message_id=Coalesce(Subquery(last), 0))
+
+
+class Migration(migrations.Migration):
+    """
+    Give Conversation.members an explicit through model. The table stays as it is
+    (SeparateDatabaseAndState), only the read marker column is added.
+    """
+
+    dependencies = [
+        ('conversations', '0003_message_thread_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ConversationMember',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='conversations.conversation')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'conversations_conversation_members',
+                        'unique_together': {('conversation', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='members',
+                    field=models.ManyToManyField(related_name='conversations', through='conversations.ConversationMember', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='last_read_message_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(mark_history_read, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_buyers(apps, schema_editor):
+    # The buyer is whichever member isn't the seller. If a (listing, buyer) already has
+    # several threads, the oldest one becomes theirs and the rest are left without a buyer.
+    Conversation = apps.get_model('conversations', 'Conversation')
+    ConversationMember = apps.get_model('conversations', 'ConversationMember')
+    members = (
+        ConversationMember.objects.exclude(user_id=F('conversation__listing__seller_id'))
+        .order_by('conversation_id', 'id')
+        .values_list('conversation_id', 'conversation__listing_id', 'user_id')
+    )
+    assigned, taken, updates = set(), set(), []
+    for conversation_id, listing_id, user_id in members.iterator():
+        if conversation_id in assigned or (listing_id, user_id) in taken:
+            continue
+        assigned.add(conversation_id)
+        taken.add((listing_id, user_id))
+        updates.append(Conversation(pk=conversation_id, buyer_id=user_id))
+    Conversation.objects.bulk_update(updates, ['buyer'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0004_conversation_member'),
+        # Listing.seller and the listing FK the constraint uses are both from 0001
+        ('listings', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='buyer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='buying_conversations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(set_buyers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('listing', 'buyer'), name='conversation_listing_buyer_uniq'),
+        ),
+    ]
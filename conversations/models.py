@@ -1,9 +1,13 @@
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
 from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.text import Truncator
 
 from listings.models import Listing
+from . import pubsub
 
 
 class Conversation(models.Model):
@@ -11,20 +15,103 @@ class Conversation(models.Model):
     A conversation thread about a listing
     """
     listing = models.ForeignKey(Listing, related_name='conversations', on_delete=models.CASCADE)
-    members = models.ManyToManyField(User, related_name='conversations')
+    # Whoever messaged the seller. One conversation per (listing, buyer), see start().
+    # Null only for duplicate threads created before that was enforced.
+    buyer = models.ForeignKey(
+        User, related_name='buying_conversations', null=True, blank=True, on_delete=models.CASCADE
+    )
+    members = models.ManyToManyField(User, related_name='conversations', through='ConversationMember')
     created_at = models.DateTimeField(auto_now_add=True)
 
     # Updated whenever a new message is posted
     modified_at = models.DateTimeField(auto_now=True)
 
+    # Copied from the newest message when it is posted (ConversationMessage.save),
+    # so the inbox can show every row without touching the messages table
+    last_message = models.ForeignKey(
+        'ConversationMessage', related_name='+', null=True, blank=True, on_delete=models.SET_NULL
+    )
+    last_message_preview = models.CharField(max_length=255, blank=True)
+    last_message_by = models.ForeignKey(
+        User, related_name='+', null=True, blank=True, on_delete=models.SET_NULL
+    )
+    message_count = models.PositiveIntegerField(default=0)
+    # The messages have been moved to an ArchivedThread (archive.py)
+    archived = models.BooleanField(default=False)
+
     class Meta:
         # Most recent conversation shown first
         ordering = ('-modified_at',)
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'buyer'], name='conversation_listing_buyer_uniq'),
+        ]
 
     def __str__(self):
         member_names = ", ".join(self.members.values_list('username', flat=True)[:3])
         return f"Conversation on '{self.listing.title}' with [{member_names}]"
 
+    @classmethod
+    def start(cls, listing, buyer, content):
+        """
+        Open the buyer's conversation about a listing with a first message.
+        Returns (conversation, created). If one already exists, e.g. a double
+        submit got there first, that one is returned and nothing is posted.
+        """
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    conversation = cls.objects.create(listing=listing, buyer=buyer)
+            except IntegrityError:
+                return cls.objects.get(listing=listing, buyer=buyer), False
+            ConversationMember.objects.bulk_create([
+                ConversationMember(conversation=conversation, user=buyer),
+                ConversationMember(conversation=conversation, user_id=listing.seller_id),
+            ])
+            conversation.post(buyer, content)
+        return conversation, True
+
+    def post(self, user, content):
+        """
+        Add a message: one INSERT plus one UPDATE of this conversation's summary
+        (ConversationMessage.save). For importing many at once see importer.py.
+        """
+        if self.archived:
+            from . import archive
+            archive.restore(self)
+        message = ConversationMessage(conversation=self, content=content, created_by=user)
+        message.save()
+        return message
+
+    def refresh_summary(self):
+        """
+        Recompute the last message fields and count from the messages table.
+        """
+        last = self.messages.order_by('-created_at', '-id').first()
+        Conversation.objects.filter(pk=self.pk).update(
+            last_message=last,
+            last_message_preview=preview(last.content) if last else '',
+            last_message_by=last.created_by_id if last else None,
+            message_count=self.messages.count(),
+        )
+
+
+class ConversationMember(models.Model):
+    """
+    A user's membership of a conversation, plus how far they have read.
+    Uses the table the plain ManyToManyField had, so members.add() etc. still work.
+    """
+    conversation = models.ForeignKey(Conversation, related_name='memberships', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='conversation_memberships', on_delete=models.CASCADE)
+    # Newest message id this member has seen; anything after it from someone else is unread
+    last_read_message_id = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'conversations_conversation_members'
+        unique_together = [('conversation', 'user')]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id} (read up to {self.last_read_message_id})"
+
 
 class ConversationMessage(models.Model):
     """
@@ -32,14 +119,76 @@ class ConversationMessage(models.Model):
     """
     conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so imported history keeps its timestamps (importer.py)
+    created_at = models.DateTimeField(default=timezone.now)
     created_by = models.ForeignKey(User, related_name='conversation_messages', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # A thread's history, newest first, one page at a time (conversations.views.detail/older_messages)
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_thread_idx'),
+        ]
+
     def __str__(self):
         return f"Message by {self.created_by.username} @ {self.created_at:%Y-%m-%d %H:%M}"
-    
-# When a message is created, 'touch' the parent conversation so it floats to the top of the inbox
-@receiver(post_save, sender=ConversationMessage)
-def touch_conversation_modified_at(sender, instance, created, **kwargs):
-    if created:
-        instance.conversation.save(update_fields=['modified_at'])
\ No newline at end of file
+
+    def save(self, *args, **kwargs):
+        # A new message also bumps its conversation (to the top of the inbox) and
+        # becomes its last message, in the same transaction
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            summary = Conversation.objects.filter(pk=self.conversation_id)
+            fields = {
+                'last_message': self,
+                'last_message_preview': preview(self.content),
+                'last_message_by': self.created_by_id,
+                'message_count': F('message_count') + 1,
+                'modified_at': timezone.now(),
+            }
+            if not summary.filter(archived=False).update(**fields):
+                # Archived after post() looked (archive.py): put the thread back, then count this one
+                from . import archive
+                conversation = summary.filter(archived=True).first()
+                if conversation is not None:
+                    archive.restore(conversation)
+                summary.update(**fields)
+            transaction.on_commit(self._announce)
+
+    def _announce(self):
+        from . import unread
+
+        # Wake up anyone streaming this conversation (views.stream), and redo the others' unread counts
+        pubsub.publish_message(self.conversation_id, self.pk)
+        unread.message_posted(self.conversation_id, self.created_by_id)
+
+
+
+class ArchivedThread(models.Model):
+    """
+    All the messages of an idle conversation, as one compressed block (archive.py).
+    """
+    conversation = models.OneToOneField(
+        Conversation, primary_key=True, related_name='archived_thread', on_delete=models.CASCADE
+    )
+    # zlib-compressed JSON: [[id, created_by_id, created_at, content], ...], oldest first
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of conversation {self.conversation_id} ({self.message_count} messages)"
+
+def preview(content):
+    return Truncator(content).chars(Conversation._meta.get_field('last_message_preview').max_length)
+
+
+# Deleting messages (admin) is rare, just recount. Not when the whole conversation is going.
+@receiver(post_delete, sender=ConversationMessage)
+def refresh_conversation_summary(sender, instance, origin=None, **kwargs):
+    if getattr(origin, 'model', type(origin)) is not ConversationMessage:
+        return
+    conversation = Conversation.objects.filter(pk=instance.conversation_id).first()
+    if conversation is not None:
+        conversation.refresh_summary()
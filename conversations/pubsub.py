@@ -0,0 +1,114 @@
+"""
+Publish/subscribe for new-message notifications.
+
+A notification only says "conversation X has a new message (id N)"; the stream
+view (views.stream) reads the messages themselves from the database, so a
+missed or duplicated notification costs a query, never a message.
+
+The default InProcessBroker only reaches streams served by the same process,
+which is fine for a single ASGI worker. For more workers point
+CONVERSATIONS_PUBSUB_BACKEND at a Broker subclass backed by something shared
+(Redis pub/sub, Postgres LISTEN/NOTIFY, ...).
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def channel_name(conversation_id):
+    return f"conversation:{conversation_id}"
+
+
+class Broker:
+    """
+    publish() may be called from any thread (views, on_commit callbacks).
+    subscribe() is used from async code:
+
+        async with broker.subscribe(channel) as subscription:
+            message = await subscription.get(timeout=15)  # None on timeout
+    """
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        raise NotImplementedError
+
+
+class Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = None
+        self.queue = None
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.broker._add(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker._remove(self)
+
+    def deliver(self, message):
+        # Called from the publishing thread, the queue belongs to the subscriber's loop
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+        except RuntimeError:
+            pass  # loop already closed, the stream is gone
+
+    async def get(self, timeout=None):
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        # Several notifications queued up are one reason to look
+        while not self.queue.empty():
+            message = self.queue.get_nowait()
+        return message
+
+
+class InProcessBroker(Broker):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def _add(self, subscription):
+        with self.lock:
+            self.subscriptions.setdefault(subscription.channel, set()).add(subscription)
+
+    def _remove(self, subscription):
+        with self.lock:
+            subscribers = self.subscriptions.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+    def subscribe(self, channel):
+        return Subscription(self, channel)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = getattr(settings, "CONVERSATIONS_PUBSUB_BACKEND", "conversations.pubsub.InProcessBroker")
+            _broker = import_string(path)()
+        return _broker
+
+
+def publish_message(conversation_id, message_id):
+    get_broker().publish(channel_name(conversation_id), message_id)
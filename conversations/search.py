@@ -0,0 +1,39 @@
+"""
+Full-text search over conversation messages ("who offered $40 for the desk?").
+
+Same setup as listings/search.py (both use listings/fts.py): an SQLite FTS5
+table with external content pointing at the messages table, kept in sync by
+triggers, so posts, bulk imports and archiving (which deletes with plain SQL)
+all keep it current without any Python involved. Archived threads (archive.py) are not searchable until they
+are restored. Other database backends fall back to icontains.
+"""
+from listings.fts import FTSIndex, is_supported, match_expression
+from .models import ConversationMember, ConversationMessage
+
+index = FTSIndex(ConversationMessage, "conversations_message_fts", ["content"])
+install, uninstall, rebuild = index.install, index.uninstall, index.rebuild
+
+
+def search(user, query):
+    """
+    Messages in the user's conversations matching `query`, best match first
+    (a `search_rank` annotation on SQLite, for keyset pagination), with their
+    conversation, listing and author.
+    """
+    conversation_ids = ConversationMember.objects.filter(user=user).values('conversation_id')
+    qs = (
+        ConversationMessage.objects.filter(conversation_id__in=conversation_ids)
+        .select_related('conversation__listing', 'created_by')
+    )
+    if not is_supported():
+        return qs.filter(content__icontains=query).order_by("-created_at", "-id")
+    expression = match_expression(query)
+    if not expression:
+        return qs.none()
+
+    # Candidate ids come from the index, membership narrows them down
+    return (
+        qs.filter(id__in=index.matches(expression))
+        .annotate(search_rank=index.rank(expression))
+        .order_by("search_rank", "-created_at", "-id")
+    )
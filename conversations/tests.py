@@ -1,8 +1,28 @@
-from django.test import TestCase, Client
+import base64
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from listings.models import Listing
-from conversations.models import Conversation, ConversationMessage
+from django.utils import timezone
+from listings.models import Category, Listing
+from conversations import archive, pubsub, unread
+from conversations.models import ArchivedThread, Conversation, ConversationMember, ConversationMessage
+
+
+def tampered_cursor(*values):
+    raw = json.dumps({'d': 'next', 'v': list(values)})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
 
 class ConversationModelTests(TestCase):
@@ -25,6 +45,7 @@ class ConversationModelTests(TestCase):
         self.assertGreater(convo.modified_at, old_modified)
 
 
+@override_settings(LISTING_VIEW_FLUSH_THREAD=False)
 class NewConversationTests(TestCase):
     
     def setUp(self):
@@ -54,7 +75,7 @@ class NewConversationTests(TestCase):
         self.assertEqual(convo.messages.count(), 1)
         
     def test_reuses_existing_conversation(self):
-        convo = Conversation.objects.create(listing=self.listing)
+        convo = Conversation.objects.create(listing=self.listing, buyer=self.buyer)
         convo.members.add(self.buyer, self.seller)
         
         self.client.login(username='buyer', password='pass')
@@ -109,4 +130,519 @@ class ConversationDetailTests(TestCase):
         
         msg = self.convo.messages.first()
         self.assertEqual(msg.content, 'New message')
-        self.assertEqual(msg.created_by, self.user)
\ No newline at end of file
+        self.assertEqual(msg.created_by, self.user)
+
+class InboxSummaryTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.category = Category.objects.create(name='Bikes')
+
+    def conversation(self, buyer, messages=2):
+        listing = Listing.objects.create(
+            title=f'Bike for {buyer.username}', price=50, category=self.category, seller=self.seller
+        )
+        convo = Conversation.objects.create(listing=listing)
+        convo.members.add(buyer, self.seller)
+        for i in range(messages):
+            ConversationMessage.objects.create(
+                conversation=convo, content=f'Message {i}', created_by=buyer if i % 2 == 0 else self.seller
+            )
+        return convo
+
+    def test_message_updates_summary(self):
+        buyer = User.objects.create_user(username='buyer', password='pass')
+        convo = self.conversation(buyer, messages=3)
+        convo.refresh_from_db()
+        self.assertEqual(convo.message_count, 3)
+        self.assertEqual(convo.last_message_preview, 'Message 2')
+        self.assertEqual(convo.last_message_by, buyer)
+        self.assertEqual(convo.last_message, convo.messages.order_by('-id').first())
+
+        convo.last_message.delete()
+        convo.refresh_from_db()
+        self.assertEqual(convo.message_count, 2)
+        self.assertEqual(convo.last_message_preview, 'Message 1')
+
+    def inbox_queries(self):
+        self.client.login(username='seller', password='pass')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('conversations:inbox'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_inbox_query_count_is_constant(self):
+        self.conversation(User.objects.create_user(username='buyer0', password='pass'))
+        few, _ = self.inbox_queries()
+
+        for i in range(1, 8):
+            self.conversation(User.objects.create_user(username=f'buyer{i}', password='pass'))
+        many, response = self.inbox_queries()
+
+        self.assertEqual(few, many)
+        self.assertContains(response, '2 messages', count=8)
+        self.assertContains(response, 'You:', count=8)
+
+
+class MessageHistoryTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(name='Bikes')
+        listing = Listing.objects.create(title='Bike', price=50, category=category, seller=self.seller)
+        self.convo = Conversation.objects.create(listing=listing)
+        self.convo.members.add(self.buyer, self.seller)
+        self.client.login(username='buyer', password='pass')
+        self.url = reverse('conversations:detail', kwargs={'pk': self.convo.pk})
+
+    def post_messages(self, count):
+        for i in range(count):
+            ConversationMessage.objects.create(
+                conversation=self.convo, content=f'Offer {i}', created_by=self.buyer if i % 2 else self.seller
+            )
+
+    @mock.patch('conversations.views.MESSAGES_PER_PAGE', 3)
+    def test_detail_shows_newest_page_and_loads_older(self):
+        self.post_messages(7)
+        response = self.client.get(self.url)
+        self.assertEqual([m.content for m in response.context['thread_messages']], ['Offer 4', 'Offer 5', 'Offer 6'])
+
+        seen = []
+        cursor = response.context['older_cursor']
+        while cursor:
+            data = self.client.get(
+                reverse('conversations:older_messages', kwargs={'pk': self.convo.pk}), {'cursor': cursor}
+            ).json()
+            seen.append(data['html'])
+            cursor = data['older_cursor']
+        self.assertEqual(len(seen), 2)
+        self.assertIn('Offer 1', seen[0])
+        self.assertIn('Offer 3', seen[0])
+        self.assertIn('Offer 0', seen[1])
+        self.assertNotIn('Offer 1', seen[1])
+
+    @mock.patch('conversations.views.MESSAGES_PER_PAGE', 3)
+    def test_tampered_cursor_loads_newest_page(self):
+        self.post_messages(4)
+        created_at = timezone.now().isoformat()
+        for bad in ('abc', [1], None):
+            with self.subTest(id=bad):
+                response = self.client.get(
+                    reverse('conversations:older_messages', kwargs={'pk': self.convo.pk}),
+                    {'cursor': tampered_cursor(created_at, bad)},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Offer 3', response.json()['html'])
+
+    def test_detail_query_count_does_not_grow(self):
+        self.post_messages(2)
+        with CaptureQueriesContext(connection) as short:
+            self.client.get(self.url)
+        self.post_messages(60)
+        with CaptureQueriesContext(connection) as long:
+            response = self.client.get(self.url)
+        self.assertEqual(len(short), len(long))
+        self.assertContains(response, 'Load older messages')
+
+    def test_only_members_can_read(self):
+        User.objects.create_user(username='other', password='pass')
+        self.client.login(username='other', password='pass')
+        response = self.client.get(reverse('conversations:older_messages', kwargs={'pk': self.convo.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+class LiveMessageTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(name='Bikes')
+        listing = Listing.objects.create(title='Bike', price=50, category=category, seller=self.seller)
+        self.convo = Conversation.objects.create(listing=listing)
+        self.convo.members.add(self.buyer, self.seller)
+        self.first = ConversationMessage.objects.create(conversation=self.convo, content='Still available?', created_by=self.buyer)
+        self.second = ConversationMessage.objects.create(conversation=self.convo, content='Yes', created_by=self.seller)
+        self.url = reverse('conversations:stream', kwargs={'pk': self.convo.pk})
+
+    def test_wsgi_sends_only_newer_messages(self):
+        self.client.login(username='buyer', password='pass')
+        response = self.client.get(self.url, {'after': self.first.pk})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        self.assertIn('retry:', body)
+        self.assertIn(f'id: {self.second.pk}\n', body)
+        self.assertNotIn(f'id: {self.first.pk}\n', body)
+
+        # Reconnects say where they got to
+        response = self.client.get(self.url, HTTP_LAST_EVENT_ID=str(self.second.pk))
+        self.assertNotIn('event: message', response.content.decode())
+
+    @mock.patch('conversations.views.STREAM_SECONDS', 0.1)
+    async def test_asgi_stream(self):
+        await self.async_client.alogin(username='buyer', password='pass')
+        response = await self.async_client.get(self.url, {'after': self.first.pk})
+        body = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertEqual(body.count('event: message'), 1)
+        self.assertIn('"html"', body)
+
+    async def test_broker_delivers_across_threads(self):
+        broker = pubsub.InProcessBroker()
+        async with broker.subscribe('conversation:1') as subscription:
+            thread = threading.Thread(target=broker.publish, args=('conversation:1', 42))
+            thread.start()
+            self.assertEqual(await subscription.get(timeout=2), 42)
+            thread.join()
+            self.assertIsNone(await subscription.get(timeout=0.01))
+        self.assertEqual(broker.subscriptions, {})
+
+    def test_message_publishes_on_commit_and_json_post(self):
+        self.client.login(username='buyer', password='pass')
+        with mock.patch.object(pubsub, 'publish_message') as publish, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('conversations:detail', kwargs={'pk': self.convo.pk}),
+                {'content': 'Can you do $40?'}, HTTP_ACCEPT='application/json',
+            )
+        self.assertEqual(response.status_code, 201)
+        publish.assert_called_once_with(self.convo.pk, response.json()['id'])
+
+
+@override_settings(LISTING_VIEW_FLUSH_THREAD=False)
+class UnreadTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(name='Bikes')
+        self.listing = Listing.objects.create(title='Bike', price=50, category=category, seller=self.seller)
+        self.convo = Conversation.objects.create(listing=self.listing)
+        self.convo.members.add(self.buyer, self.seller)
+        self.post(self.buyer, 'Still available?')
+        self.post(self.buyer, 'Can pick up today')
+
+    def post(self, user, content, conversation=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ConversationMessage.objects.create(
+                conversation=conversation or self.convo, content=content, created_by=user
+            )
+
+    def test_counts_other_members_messages(self):
+        other = Conversation.objects.create(listing=self.listing)
+        someone = User.objects.create_user(username='other', password='pass')
+        other.members.add(self.seller, someone)
+        self.post(someone, 'Hi', conversation=other)
+
+        self.assertEqual(unread.unread_counts(self.seller), {self.convo.id: 2, other.id: 1})
+        self.assertEqual(unread.total_unread(self.seller), 3)
+        # Your own messages are never unread
+        self.assertEqual(unread.total_unread(self.buyer), 0)
+
+    def test_opening_conversation_marks_it_read(self):
+        self.client.login(username='seller', password='pass')
+        self.client.get(reverse('conversations:detail', kwargs={'pk': self.convo.pk}))
+
+        member = ConversationMember.objects.get(conversation=self.convo, user=self.seller)
+        self.assertEqual(member.last_read_message_id, self.convo.messages.latest('id').id)
+        self.assertEqual(unread.total_unread(self.seller), 0)
+
+        self.post(self.buyer, 'Hello?')
+        self.assertEqual(unread.total_unread(self.seller), 1)
+
+    def test_read_marker_never_moves_back(self):
+        latest = self.convo.messages.latest('id')
+        unread.mark_read(self.convo.id, self.seller, latest.id)
+        unread.mark_read(self.convo.id, self.seller, latest.id - 1)
+        self.assertEqual(ConversationMember.objects.get(conversation=self.convo, user=self.seller).last_read_message_id, latest.id)
+
+    def test_badge_is_cached(self):
+        self.client.login(username='seller', password='pass')
+        url = reverse('account:profile')
+        response = self.client.get(url)
+        self.assertContains(response, 'id="unread-badge"')
+        self.assertEqual(response.context['unread_message_count'], 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(any('last_read_message_id' in q['sql'] for q in queries.captured_queries))
+
+    def test_inbox_shows_unread_per_conversation(self):
+        self.client.login(username='seller', password='pass')
+        response = self.client.get(reverse('conversations:inbox'))
+        self.assertEqual([c.unread_count for c in response.context['conversations']], [2])
+
+    def test_listing_etag_changes_with_unread_count(self):
+        self.client.login(username='seller', password='pass')
+        url = reverse('listings:detail', kwargs={'pk': self.listing.pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.post(self.buyer, 'Hello?')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class StartConversationTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(name='Bikes')
+        self.listing = Listing.objects.create(title='Bike', price=50, category=category, seller=self.seller)
+        self.url = reverse('conversations:new', kwargs={'listing_pk': self.listing.pk})
+
+    def test_creates_conversation_members_and_message(self):
+        self.client.login(username='buyer', password='pass')
+        self.client.post(self.url, {'content': 'Hello'})
+
+        convo = Conversation.objects.get()
+        self.assertEqual(convo.buyer, self.buyer)
+        self.assertEqual(set(convo.members.all()), {self.buyer, self.seller})
+        self.assertEqual(convo.message_count, 1)
+        self.assertEqual(convo.last_message_preview, 'Hello')
+
+    def test_existing_conversation_is_one_query(self):
+        convo, _ = Conversation.start(self.listing, self.buyer, 'Hello')
+        self.client.login(username='buyer', password='pass')
+        self.client.get(reverse('main:index'))  # session and user loaded once
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertRedirects(response, reverse('conversations:detail', kwargs={'pk': convo.pk}), fetch_redirect_response=False)
+        conversation_queries = [q for q in queries.captured_queries if 'conversations_conversation' in q['sql']]
+        self.assertEqual(len(conversation_queries), 1)
+
+    def test_double_submit_returns_the_first_conversation(self):
+        first, created = Conversation.start(self.listing, self.buyer, 'Hello')
+        self.assertTrue(created)
+        second, created = Conversation.start(self.listing, self.buyer, 'Hello')
+
+        self.assertFalse(created)
+        self.assertEqual(second, first)
+        self.assertEqual(Conversation.objects.count(), 1)
+        self.assertEqual(ConversationMessage.objects.count(), 1)
+
+
+class MessageWriteTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(name='Bikes')
+        listing = Listing.objects.create(title='Bike', price=50, category=category, seller=self.seller)
+        self.convo, _ = Conversation.start(listing, self.buyer, 'Still available?')
+
+    def test_post_is_one_insert_and_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.convo.post(self.seller, 'Yes')
+        writes = [q['sql'].split()[0] for q in queries.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(writes, ['INSERT', 'UPDATE'])
+
+    def import_file(self, lines, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write('\n'.join(lines))
+        self.addCleanup(os.remove, f.name)
+        call_command('import_messages', f.name, *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_import_keeps_timestamps_and_updates_summary(self):
+        lines = [
+            json.dumps({'conversation': self.convo.pk, 'created_by': self.seller.pk,
+                        'content': f'Old {i}', 'created_at': f'2020-01-0{i + 1}T12:00:00Z'})
+            for i in range(5)
+        ]
+        lines.append(json.dumps({'conversation': self.convo.pk, 'created_by': 999, 'content': 'Not a member'}))
+        lines.append('not json')
+        self.import_file(lines, '--batch-size', '2')
+
+        self.convo.refresh_from_db()
+        self.assertEqual(self.convo.message_count, 6)
+        # The imported messages are older, the first message is still the last one
+        self.assertEqual(self.convo.last_message_preview, 'Still available?')
+        oldest = self.convo.messages.order_by('created_at').first()
+        self.assertEqual(oldest.content, 'Old 0')
+        self.assertEqual(oldest.created_at, datetime(2020, 1, 1, 12, tzinfo=dt_timezone.utc))
+
+    def test_imported_history_is_read_by_caught_up_members(self):
+        self.convo.refresh_from_db()
+        unread.mark_read(self.convo.pk, self.seller, self.convo.last_message_id)
+        self.import_file([json.dumps({'conversation': self.convo.pk, 'created_by': self.buyer.pk, 'content': 'Old'})])
+        self.assertEqual(unread.total_unread(self.seller), 0)
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(name='Bikes')
+        listing = Listing.objects.create(title='Bike', price=50, category=category, seller=self.seller)
+        self.old, _ = Conversation.start(listing, self.buyer, 'Message 0')
+        for i in range(1, 5):
+            self.old.post(self.seller if i % 2 else self.buyer, f'Message {i}')
+        self.recent, _ = Conversation.start(
+            Listing.objects.create(title='Lamp', price=5, category=category, seller=self.seller), self.buyer, 'Hi'
+        )
+        Conversation.objects.filter(pk=self.old.pk).update(modified_at=timezone.now() - timedelta(days=400))
+        self.url = reverse('conversations:detail', kwargs={'pk': self.old.pk})
+
+    def run_archive(self, *args):
+        call_command('archive_conversations', '--batch-size', '1', *args, stdout=StringIO())
+
+    def test_moves_idle_threads_into_one_block(self):
+        self.run_archive()
+
+        self.old.refresh_from_db()
+        self.assertTrue(self.old.archived)
+        self.assertEqual(self.old.message_count, 5)
+        self.assertFalse(ConversationMessage.objects.filter(conversation=self.old).exists())
+        self.assertEqual(ArchivedThread.objects.get().message_count, 5)
+        # The recent one is left alone, and running it again is a no-op
+        self.assertFalse(Conversation.objects.get(pk=self.recent.pk).archived)
+        self.run_archive()
+        self.assertEqual(ArchivedThread.objects.count(), 1)
+
+    def test_message_racing_the_archiver_is_not_deleted(self):
+        pack = archive._pack
+
+        def post_meanwhile(messages):
+            # A post whose INSERT landed but whose summary UPDATE is still waiting on the lock
+            ConversationMessage.objects.bulk_create([
+                ConversationMessage(conversation=self.old, created_by=self.buyer, content='Still there?'),
+            ])
+            return pack(messages)
+
+        with mock.patch.object(archive, '_pack', side_effect=post_meanwhile):
+            self.assertEqual(archive.archive_batch([self.old.pk], archive.cutoff()), 1)
+        self.assertEqual(
+            list(ConversationMessage.objects.filter(conversation=self.old).values_list('content', flat=True)),
+            ['Still there?'],
+        )
+
+    def test_thread_with_unsummarized_messages_stays_live(self):
+        ConversationMessage.objects.bulk_create([
+            ConversationMessage(conversation=self.old, created_by=self.buyer, content='Imported'),
+        ])
+        self.assertEqual(archive.archive_batch([self.old.pk], archive.cutoff()), 0)
+        self.assertFalse(Conversation.objects.get(pk=self.old.pk).archived)
+        self.assertEqual(ConversationMessage.objects.filter(conversation=self.old).count(), 6)
+
+    def test_post_after_archiving_behind_its_back_restores(self):
+        stale = Conversation.objects.get(pk=self.old.pk)
+        self.run_archive()
+        self.assertFalse(stale.archived)
+
+        stale.post(self.buyer, 'Anyone?')
+        self.old.refresh_from_db()
+        self.assertFalse(self.old.archived)
+        self.assertEqual(self.old.message_count, 6)
+        self.assertEqual(self.old.last_message_preview, 'Anyone?')
+        self.assertEqual(ConversationMessage.objects.filter(conversation=self.old).count(), 6)
+        self.assertFalse(ArchivedThread.objects.exists())
+
+    def test_archived_thread_reads_like_a_live_one(self):
+        self.client.login(username='buyer', password='pass')
+        live = [m.content for m in self.client.get(self.url).context['thread_messages']]
+        self.run_archive()
+
+        with mock.patch('conversations.views.MESSAGES_PER_PAGE', 3):
+            response = self.client.get(self.url)
+            self.assertEqual([m.content for m in response.context['thread_messages']], live[-3:])
+            older = self.client.get(
+                reverse('conversations:older_messages', kwargs={'pk': self.old.pk}),
+                {'cursor': response.context['older_cursor']},
+            ).json()
+        self.assertIn('Message 1', older['html'])
+        self.assertIsNone(older['older_cursor'])
+
+    def test_racing_posts_restore_once(self):
+        self.run_archive()
+        first = Conversation.objects.get(pk=self.old.pk)
+        second = Conversation.objects.get(pk=self.old.pk)
+        first.post(self.buyer, 'Still for sale?')
+        # Loaded while archived, posts after the first one put the thread back
+        self.assertTrue(second.archived)
+        second.post(self.seller, 'Yes')
+
+        self.old.refresh_from_db()
+        self.assertFalse(self.old.archived)
+        self.assertEqual(self.old.message_count, 7)
+        self.assertEqual(self.old.last_message_preview, 'Yes')
+        self.assertEqual(ConversationMessage.objects.filter(conversation=self.old).count(), 7)
+
+    def test_tampered_cursor_on_archived_thread(self):
+        self.run_archive()
+        self.client.login(username='buyer', password='pass')
+        for bad in (['abc', 1], [timezone.now().isoformat(), 'abc'], [timezone.now().isoformat(), None],
+                    ['2024-01-01T00:00:00', 1]):
+            with self.subTest(values=bad):
+                response = self.client.get(
+                    reverse('conversations:older_messages', kwargs={'pk': self.old.pk}),
+                    {'cursor': tampered_cursor(*bad)},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Message 4', response.json()['html'])
+
+    def test_posting_restores_the_thread(self):
+        ids = list(self.old.messages.values_list('id', flat=True))
+        self.run_archive()
+        conversation = Conversation.objects.get(pk=self.old.pk)
+        conversation.post(self.seller, 'Back again')
+
+        conversation.refresh_from_db()
+        self.assertFalse(conversation.archived)
+        self.assertEqual(conversation.message_count, 6)
+        self.assertEqual(conversation.last_message_preview, 'Back again')
+        self.assertEqual(list(conversation.messages.values_list('id', flat=True))[:5], ids)
+        self.assertFalse(ArchivedThread.objects.exists())
+
+
+class MessageSearchTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        category = Category.objects.create(name='Desks')
+        desk = Listing.objects.create(title='Desk', price=60, category=category, seller=self.seller)
+        self.mine, _ = Conversation.start(desk, self.buyer, 'Would you take $40 for the desk?')
+        self.mine.post(self.seller, 'Make it 50 and it is yours')
+        theirs, _ = Conversation.start(
+            Listing.objects.create(title='Chair', price=20, category=category, seller=self.other),
+            self.buyer, 'I can do $40 for the chair'
+        )
+        self.url = reverse('conversations:search')
+
+    def results(self, user, query, **params):
+        self.client.login(username=user.username, password='pass')
+        response = self.client.get(self.url, {'q': query, **params})
+        return response, [m.content for m in response.context['page']]
+
+    def test_only_searches_own_conversations(self):
+        _, found = self.results(self.seller, '40')
+        self.assertEqual(found, ['Would you take $40 for the desk?'])
+        _, found = self.results(self.buyer, '40')
+        self.assertEqual(len(found), 2)
+
+    def test_new_messages_are_indexed(self):
+        self.mine.post(self.buyer, 'Deal, see you Saturday')
+        _, found = self.results(self.seller, 'saturday')
+        self.assertEqual(found, ['Deal, see you Saturday'])
+
+    def test_ranked_and_paginated(self):
+        self.mine.post(self.buyer, 'desk desk desk')
+        with mock.patch('conversations.views.SEARCH_RESULTS_PER_PAGE', 1):
+            response, found = self.results(self.buyer, 'desk')
+            self.assertEqual(found, ['desk desk desk'])
+            _, found = self.results(self.buyer, 'desk', cursor=response.context['page'].next_cursor)
+        self.assertEqual(found, ['Would you take $40 for the desk?'])
+
+    def test_tampered_cursor_shows_first_page(self):
+        for bad in ('abc', [1], None):
+            with self.subTest(rank=bad):
+                response, found = self.results(
+                    self.buyer, 'desk', cursor=tampered_cursor(bad, timezone.now().isoformat(), 1)
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(found, ['Would you take $40 for the desk?'])
+                _, found = self.results(self.buyer, 'desk', cursor=tampered_cursor(0.5, timezone.now().isoformat(), bad))
+                self.assertEqual(found, ['Would you take $40 for the desk?'])
@@ -0,0 +1,68 @@
+"""
+Unread messages: anything in a conversation newer than the member's read
+marker (ConversationMember.last_read_message_id) that someone else wrote.
+
+The navbar total is shown on every page, so it is cached per user and only
+recomputed (one aggregate query) after a message is posted to one of their
+conversations or they read one.
+"""
+from django.core.cache import cache
+from django.db.models import Count, F
+
+from .models import ConversationMember, ConversationMessage
+
+UNREAD_TIMEOUT = 60 * 60 * 24
+
+
+def cache_key(user_id):
+    return f"conversations:unread:{user_id}"
+
+
+def unread_counts(user):
+    """
+    {conversation_id: unread count} for every conversation with something unread, in one query.
+    """
+    rows = (
+        ConversationMessage.objects.filter(
+            conversation__memberships__user=user,
+            id__gt=F('conversation__memberships__last_read_message_id'),
+        )
+        .exclude(created_by=user)
+        .values('conversation')
+        .annotate(unread=Count('id'))
+        .values_list('conversation', 'unread')
+    )
+    counts = dict(rows)
+    # Got the total for free
+    cache.set(cache_key(user.pk), sum(counts.values()), UNREAD_TIMEOUT)
+    return counts
+
+
+def total_unread(user):
+    total = cache.get(cache_key(user.pk))
+    if total is None:
+        total = sum(unread_counts(user).values())
+    return total
+
+
+def forget(user_ids):
+    cache.delete_many([cache_key(user_id) for user_id in user_ids])
+
+
+def mark_read(conversation_id, user, message_id):
+    """
+    Move the user's read marker up to `message_id` (never back).
+    """
+    updated = ConversationMember.objects.filter(
+        conversation_id=conversation_id, user=user, last_read_message_id__lt=message_id
+    ).update(last_read_message_id=message_id)
+    if updated:
+        forget([user.pk])
+
+
+def message_posted(conversation_id, sender_id):
+    """
+    Everyone else in the conversation has a new unread message.
+    """
+    members = ConversationMember.objects.filter(conversation_id=conversation_id).exclude(user_id=sender_id)
+    forget(members.values_list('user_id', flat=True))
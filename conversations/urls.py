@@ -10,6 +10,15 @@ urlpatterns = [
     # Show a single conversation based on id.
     path('<int:pk>/', views.detail, name='detail'),
 
+    # Earlier messages of a conversation ("load older")
+    path('<int:pk>/messages/', views.older_messages, name='older_messages'),
+
+    # New messages as they arrive (Server-Sent Events)
+    path('<int:pk>/stream/', views.stream, name='stream'),
+
+    # Search the messages of all your conversations (?q=...)
+    path('search/', views.search_messages, name='search'),
+
     # Start a new conversation for a listing
     path('new/<int:listing_pk>/', views.new_conversation, name='new'),
 ]
@@ -1,10 +1,29 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_GET
 
 from listings.models import Listing
+from listings.pagination import InvalidCursor, paginate
+from . import archive, pubsub, search, unread
 from .forms import ConversationMessageForm
 from .models import Conversation 
 
+# Newest messages rendered with the thread, older ones come in pages of the same size
+MESSAGES_PER_PAGE = 30
+SEARCH_RESULTS_PER_PAGE = 20
+
+# Server-Sent Events: a stream lasts this long before the browser reconnects (with Last-Event-ID)
+STREAM_SECONDS = 5 * 60
+HEARTBEAT_SECONDS = 15
+RECONNECT_MS = 3000
+
 @login_required
 def new_conversation(request, listing_pk):
     """
@@ -18,24 +37,17 @@ def new_conversation(request, listing_pk):
     if listing.seller == request.user:
         return redirect('listings:detail', pk=listing_pk)
 
-    # Reuse existing conversation, if it exists.
-    conversations = Conversation.objects.filter(listing=listing).filter(members__in=[request.user.id])
-    if conversations:
-        return redirect('conversations:detail', pk=conversations.first().id)
+    # Reuse existing conversation, if it exists (one lookup on the (listing, buyer) unique index)
+    existing = Conversation.objects.filter(listing=listing, buyer=request.user).values_list('id', flat=True).first()
+    if existing is not None:
+        return redirect('conversations:detail', pk=existing)
 
     if request.method == 'POST':
         form = ConversationMessageForm(request.POST)
         if form.is_valid():
-            conversation = Conversation.objects.create(listing=listing)
-            conversation.members.add(request.user)
-            conversation.members.add(listing.seller)
-            conversation.save()
-
-            message = form.save(commit=False)
-            message.conversation = conversation
-            message.created_by = request.user
-            message.save()
-
+            conversation, created = Conversation.start(listing, request.user, form.cleaned_data['content'])
+            if not created:
+                return redirect('conversations:detail', pk=conversation.id)
             return redirect('listings:detail', pk=listing_pk)
     else:
         form = ConversationMessageForm()
@@ -48,28 +60,192 @@ def inbox(request):
     """
     Show user's current conversations, newest first.
     """
-    conversations = Conversation.objects.filter(members__in=[request.user.id]).order_by('-modified_at')
+    # The last message/count live on Conversation, so this stays at a fixed number of queries
+    conversations = list(
+        Conversation.objects.filter(members__in=[request.user.id])
+        .select_related('listing')
+        .prefetch_related('members')
+        .order_by('-modified_at')
+    )
+    unread_counts = unread.unread_counts(request.user)
+    for conversation in conversations:
+        conversation.unread_count = unread_counts.get(conversation.id, 0)
     return render(request, 'conversations/inbox.html', {'conversations': conversations})
 
 
+
+@login_required
+@require_GET
+def search_messages(request):
+    """
+    Messages in the user's conversations matching ?q=..., best match first
+    (full-text index, see search.py). Paginated with ?cursor=...
+    """
+    query = request.GET.get('q', '').strip()
+    page = None
+    next_page_query = ''
+    if query:
+        qs = search.search(request.user, query)
+        try:
+            page = paginate(qs, request.GET.get('cursor'), per_page=SEARCH_RESULTS_PER_PAGE)
+        except InvalidCursor:
+            page = paginate(qs, per_page=SEARCH_RESULTS_PER_PAGE)
+        if page.has_next:
+            params = request.GET.copy()
+            params['cursor'] = page.next_cursor
+            next_page_query = params.urlencode()
+    return render(request, 'conversations/search.html', {
+        'query': query,
+        'page': page,
+        'next_page_query': next_page_query,
+    })
+
+def _member_conversation(request, pk):
+    return get_object_or_404(
+        Conversation.objects.filter(members__in=[request.user.id]).select_related('listing'), pk=pk
+    )
+
+
+def _message_page(conversation, cursor=None):
+    """
+    One page of a thread going back in time (keyset on created_at, id, see listings/pagination.py),
+    authors included. The messages come back oldest first, ready to display.
+    Archived threads are read from their archive block (archive.py) instead.
+    """
+    if conversation.archived:
+        def get_page(cursor=None):
+            return archive.page(conversation, cursor, per_page=MESSAGES_PER_PAGE)
+    else:
+        qs = conversation.messages.select_related('created_by').order_by('-created_at', '-id')
+
+        def get_page(cursor=None):
+            return paginate(qs, cursor, per_page=MESSAGES_PER_PAGE)
+    try:
+        page = get_page(cursor)
+    except InvalidCursor:
+        page = get_page()
+    page.object_list.reverse()
+    return page
+
+
 @login_required
 def detail(request, pk):
     """
     Show selected conversation (allowing message posting)
+    Only the newest messages are rendered, older_messages pages back from there.
     """
-    conversation = Conversation.objects.filter(members__in=[request.user.id]).get(pk=pk)
+    conversation = _member_conversation(request, pk)
 
     if request.method == 'POST':
         form = ConversationMessageForm(request.POST)
         if form.is_valid():
-            message = form.save(commit=False)
-            message.conversation = conversation
-            message.created_by = request.user
-            message.save()
+            # Also moves the conversation to the top of the inbox (ConversationMessage.save)
+            message = conversation.post(request.user, form.cleaned_data['content'])
 
-            conversation.save()
+            # Sent from the page's script: the message comes back over the stream, no reload
+            if _wants_json(request):
+                return JsonResponse({'id': message.id}, status=201)
             return redirect('conversations:detail', pk=pk)
+        if _wants_json(request):
+            return JsonResponse({'errors': form.errors}, status=400)
     else:
         form = ConversationMessageForm()
 
-    return render(request, 'conversations/detail.html', {'conversation': conversation, 'form': form})
+    page = _message_page(conversation)
+    if page.object_list:
+        unread.mark_read(conversation.id, request.user, page.object_list[-1].id)
+    return render(request, 'conversations/detail.html', {
+        'conversation': conversation,
+        'thread_messages': page.object_list,
+        'older_cursor': page.next_cursor,
+        'last_message_id': page.object_list[-1].id if page.object_list else 0,
+        'form': form,
+    })
+
+
+def _wants_json(request):
+    return request.headers.get('Accept', '').startswith('application/json')
+
+
+@login_required
+@require_GET
+def older_messages(request, pk):
+    """
+    The page of messages before ?cursor=..., as rendered HTML plus the cursor for the page before that.
+    """
+    conversation = _member_conversation(request, pk)
+    page = _message_page(conversation, request.GET.get('cursor'))
+    html = render_to_string('conversations/_messages.html', {'thread_messages': page.object_list}, request=request)
+    return JsonResponse({'html': html, 'older_cursor': page.next_cursor})
+
+
+def _last_seen(request):
+    # EventSource sends Last-Event-ID when it reconnects, ?after= is the page's starting point
+    value = request.headers.get('Last-Event-ID') or request.GET.get('after') or '0'
+    return int(value) if value.isdigit() else 0
+
+
+def _new_message_events(request, user, conversation, after):
+    """
+    SSE events for the messages after id `after`, oldest first, and the last id sent.
+    What's sent counts as read.
+    """
+    messages = list(
+        conversation.messages.filter(id__gt=after).select_related('created_by').order_by('id')[:MESSAGES_PER_PAGE]
+    )
+    events = []
+    for message in messages:
+        html = render_to_string('conversations/_messages.html', {'thread_messages': [message]}, request=request)
+        data = json.dumps({'id': message.id, 'html': html})
+        events.append(f'id: {message.id}\nevent: message\ndata: {data}\n\n')
+    if messages:
+        unread.mark_read(conversation.id, user, messages[-1].id)
+    return ''.join(events), (messages[-1].id if messages else after), len(messages)
+
+
+async def _event_stream(request, user, conversation, after):
+    new_message_events = sync_to_async(_new_message_events)
+    # Subscribe before reading the backlog, so nothing posted in between is missed
+    async with pubsub.get_broker().subscribe(pubsub.channel_name(conversation.pk)) as subscription:
+        yield f'retry: {RECONNECT_MS}\n\n'
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STREAM_SECONDS
+        while True:
+            while True:
+                events, after, count = await new_message_events(request, user, conversation, after)
+                if events:
+                    yield events
+                if count < MESSAGES_PER_PAGE:
+                    break
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            if await subscription.get(timeout=min(HEARTBEAT_SECONDS, remaining)) is None:
+                # Comment line: keeps proxies from timing out an idle connection
+                yield ': keepalive\n\n'
+
+
+@login_required
+@require_GET
+async def stream(request, pk):
+    """
+    New messages in a conversation as Server-Sent Events, starting after the
+    client's last seen id. Under ASGI the response stays open and each message is
+    pushed as it's posted (pubsub.py). Under WSGI it holds no connection: it sends
+    what's new and ends, and the browser reconnects after RECONNECT_MS.
+    """
+    user = await request.auser()
+    conversation = await Conversation.objects.filter(members__in=[user.id]).filter(pk=pk).afirst()
+    if conversation is None:
+        raise Http404('No such conversation')
+    after = _last_seen(request)
+
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(_event_stream(request, user, conversation, after), content_type='text/event-stream')
+    else:
+        events, _, _ = await sync_to_async(_new_message_events)(request, user, conversation, after)
+        response = HttpResponse(f'retry: {RECONNECT_MS}\n\n{events}', content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
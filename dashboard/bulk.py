@@ -0,0 +1,87 @@
+"""
+Bulk actions on a seller's listings (the dashboard's "selected listings" bar).
+
+Each action is one QuerySet.update() (or delete()) inside one transaction,
+instead of a form save per listing. Whatever the model signals would have done
+per row is done here once per action, after the transaction commits (so nobody
+re-caches what it is about to change): one listings generation bump (cache.py),
+one seller stats invalidation (stats.py), and for deletes one release() of the
+images. update() skips the signals anyway and sets updated_at explicitly (detail
+page ETags); delete() still sends them, so it runs inside bulk_change().
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from listings.autocomplete import suggestions
+from listings.cache import bump_generation
+from listings.models import Listing, bulk_change
+from listings.storage import release
+from . import stats
+
+PRICE_FIELD = Listing._meta.get_field('price')
+# A percentage to two places (BulkActionForm) as a multiplier, e.g. -33.33 -> 0.6667
+FACTOR_FIELD = DecimalField(max_digits=12, decimal_places=4)
+
+
+def _changed(seller_id):
+    bump_generation()
+    stats.forget(seller_id)
+
+
+def _update(seller, ids, **fields):
+    with transaction.atomic():
+        updated = Listing.objects.filter(seller=seller, pk__in=ids).update(updated_at=timezone.now(), **fields)
+        if updated:
+            transaction.on_commit(lambda: _changed(seller.pk))
+    return updated
+
+
+def mark_sold(seller, ids):
+    with transaction.atomic():
+        ids = list(Listing.objects.filter(seller=seller, pk__in=ids, is_sold=False).values_list('pk', flat=True))
+        updated = _update(seller, ids, is_sold=True)
+
+        # Sold listings leave the search box suggestions (autocomplete.py)
+        def forget_suggestions():
+            for pk in ids:
+                suggestions.listing_deleted(pk)
+        transaction.on_commit(forget_suggestions)
+    return updated
+
+
+def reprice(seller, ids, amount=None, percent=None):
+    """
+    Add `amount` to each price, or change it by `percent` (-10 is 10% off).
+    Prices never go below zero.
+    """
+    if percent is not None:
+        price = F('price') * Value(1 + Decimal(percent) / 100, output_field=FACTOR_FIELD)
+    else:
+        price = F('price') + Value(Decimal(amount), output_field=PRICE_FIELD)
+    # Rounded to cents in SQL either way: SQLite does the arithmetic in floats
+    price = Round(price, PRICE_FIELD.decimal_places, output_field=PRICE_FIELD)
+    zero = Value(Decimal('0.00'), output_field=PRICE_FIELD)
+    return _update(seller, ids, price=Greatest(price, zero, output_field=PRICE_FIELD))
+
+
+def move_to_category(seller, ids, category):
+    return _update(seller, ids, category=category)
+
+
+def delete(seller, ids):
+    with transaction.atomic(), bulk_change():
+        rows = list(Listing.objects.filter(seller=seller, pk__in=ids).values_list('pk', 'image'))
+        pks = [pk for pk, _ in rows]
+        _, deleted = Listing.objects.filter(pk__in=pks).delete()
+
+        def cleanup():
+            _changed(seller.pk)
+            for pk in pks:
+                suggestions.listing_deleted(pk)
+            release(*(image for _, image in rows))
+        transaction.on_commit(cleanup)
+    return deleted.get(Listing._meta.label, 0)
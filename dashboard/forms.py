@@ -0,0 +1,39 @@
+from django import forms
+
+from listings.models import Category, Listing
+
+
+class BulkActionForm(forms.Form):
+    """
+    An action for several of the seller's listings at once (bulk.py).
+    """
+    ACTIONS = [
+        ('sold', 'Mark as sold'),
+        ('reprice', 'Change price'),
+        ('category', 'Move to category'),
+        ('delete', 'Delete'),
+    ]
+    PRICE_MODES = [('amount', '$'), ('percent', '%')]
+
+    listings = forms.ModelMultipleChoiceField(queryset=Listing.objects.none())
+    action = forms.ChoiceField(choices=ACTIONS)
+    change = forms.DecimalField(required=False, max_digits=10, decimal_places=2)
+    mode = forms.ChoiceField(choices=PRICE_MODES, required=False, initial='amount')
+    category = forms.ModelChoiceField(queryset=Category.objects.all(), required=False)
+
+    def __init__(self, *args, seller, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only ever the seller's own listings, just their ids
+        self.fields['listings'].queryset = Listing.objects.filter(seller=seller).only('id')
+
+    def clean(self):
+        cleaned = super().clean()
+        action = cleaned.get('action')
+        if action == 'reprice':
+            if cleaned.get('change') is None:
+                self.add_error('change', 'Enter how much to change the price by.')
+            elif cleaned.get('mode') == 'percent' and cleaned['change'] <= -100:
+                self.add_error('change', 'A discount has to be less than 100%.')
+        if action == 'category' and cleaned.get('category') is None:
+            self.add_error('category', 'Choose a category.')
+        return cleaned
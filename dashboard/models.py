@@ -1,3 +1,29 @@
-from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
-# Create your models here.
+from conversations.models import Conversation
+from listings.models import Listing, in_bulk_change
+from . import stats
+
+
+# Seller stats (stats.py) are cached until one of the seller's listings changes...
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def listing_changed(sender, instance, **kwargs):
+    if in_bulk_change():
+        return
+    stats.forget(instance.seller_id)
+
+
+# ...or a conversation about one starts or goes away
+@receiver(post_save, sender=Conversation)
+@receiver(post_delete, sender=Conversation)
+def conversation_changed(sender, instance, created=True, **kwargs):
+    if not created or in_bulk_change():
+        return
+    if Conversation.listing.is_cached(instance):
+        seller_id = instance.listing.seller_id
+    else:
+        seller_id = Listing.objects.filter(pk=instance.listing_id).values_list('seller_id', flat=True).first()
+    if seller_id is not None:
+        stats.forget(seller_id)
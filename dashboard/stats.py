@@ -0,0 +1,58 @@
+"""
+Seller stats for the dashboard and profile pages: active and sold listings,
+what the active ones are listed for in total, and how many conversations are
+open about them.
+
+One aggregate query per seller, cached until one of their listings or a
+conversation about one changes (receivers in models.py). Code that changes
+listings with QuerySet.update() has to call forget() itself.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from conversations.models import Conversation
+from listings.models import Listing
+
+STATS_TIMEOUT = 60 * 60 * 24
+
+
+def cache_key(seller_id):
+    return f"dashboard:seller-stats:{seller_id}"
+
+
+def compute(seller_id):
+    conversations = (
+        Conversation.objects.filter(listing=OuterRef('pk'))
+        .order_by().values('listing').annotate(n=Count('id')).values('n')
+    )
+    active = Q(is_sold=False)
+    stats = (
+        Listing.objects.filter(seller_id=seller_id)
+        .annotate(conversation_count=Coalesce(Subquery(conversations), 0))
+        .aggregate(
+            active=Count('id', filter=active),
+            sold=Count('id', filter=Q(is_sold=True)),
+            asking_total=Coalesce(
+                Sum('price', filter=active), Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            open_conversations=Coalesce(Sum('conversation_count', filter=active), 0),
+        )
+    )
+    stats['total'] = stats['active'] + stats['sold']
+    return stats
+
+
+def seller_stats(seller_id):
+    stats = cache.get(cache_key(seller_id))
+    if stats is None:
+        stats = compute(seller_id)
+        cache.set(cache_key(seller_id), stats, STATS_TIMEOUT)
+    return stats
+
+
+def forget(*seller_ids):
+    cache.delete_many([cache_key(seller_id) for seller_id in seller_ids])
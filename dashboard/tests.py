@@ -1,7 +1,16 @@
+from decimal import Decimal
+from unittest import mock
+
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from listings.models import Listing
+from conversations.models import Conversation
+from dashboard import stats
+from listings import cache as listing_cache
+from listings.models import Category, Listing
 
 
 class DashboardTests(TestCase):
@@ -30,4 +39,142 @@ class DashboardTests(TestCase):
         
         self.assertEqual(response.status_code, 200)
         self.assertIn(my_listing, response.context['listings'])
-        self.assertNotIn(other_listing, response.context['listings'])
\ No newline at end of file
+        self.assertNotIn(other_listing, response.context['listings'])
+
+
+class SellerStatsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(name='Furniture')
+        self.desk = Listing.objects.create(title='Desk', price=Decimal('60.00'), category=category, seller=self.seller)
+        self.chair = Listing.objects.create(title='Chair', price=Decimal('25.50'), category=category, seller=self.seller)
+        Listing.objects.create(title='Lamp', price=10, category=category, seller=self.seller, is_sold=True)
+        Listing.objects.create(title='Sofa', price=300, category=category, seller=self.buyer)
+        Conversation.start(self.desk, self.buyer, 'Would you take $40?')
+
+    def test_one_aggregate_query(self):
+        with self.assertNumQueries(1):
+            result = stats.seller_stats(self.seller.id)
+        self.assertEqual(result, {
+            'active': 2, 'sold': 1, 'total': 3,
+            'asking_total': Decimal('85.50'), 'open_conversations': 1,
+        })
+        with self.assertNumQueries(0):
+            stats.seller_stats(self.seller.id)
+
+    def test_invalidated_by_listing_and_conversation_changes(self):
+        stats.seller_stats(self.seller.id)
+        self.chair.is_sold = True
+        self.chair.save()
+        self.assertEqual(stats.seller_stats(self.seller.id)['active'], 1)
+
+        Conversation.start(self.desk, User.objects.create_user(username='other', password='pass'), 'Hi')
+        self.assertEqual(stats.seller_stats(self.seller.id)['open_conversations'], 2)
+
+    def test_dashboard_and_profile_show_stats(self):
+        self.client.login(username='seller', password='pass')
+        response = self.client.get(reverse('dashboard:index'))
+        self.assertEqual(response.context['stats']['active'], 2)
+        self.assertContains(response, '$86')
+        response = self.client.get(reverse('account:profile'))
+        self.assertContains(response, '3 listings, 2 active')
+
+
+class BulkActionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        other = User.objects.create_user(username='other', password='pass')
+        self.furniture = Category.objects.create(name='Furniture')
+        self.lighting = Category.objects.create(name='Lighting')
+        self.mine = [
+            Listing.objects.create(title=f'Item {i}', price=Decimal('20.00'), category=self.furniture, seller=self.seller)
+            for i in range(3)
+        ]
+        self.theirs = Listing.objects.create(title='Theirs', price=Decimal('20.00'), category=self.furniture, seller=other)
+        self.url = reverse('dashboard:bulk')
+        self.client.login(username='seller', password='pass')
+
+    def post(self, action, listings, **data):
+        return self.client.post(self.url, {'action': action, 'listings': [l.pk for l in listings], **data})
+
+    def prices(self):
+        return [l.price for l in Listing.objects.filter(pk__in=[l.pk for l in self.mine]).order_by('pk')]
+
+    def test_mark_sold_is_one_update_and_one_bump(self):
+        stats.seller_stats(self.seller.id)
+        generation = listing_cache.generation()
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.post('sold', self.mine[:2])
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertRedirects(response, reverse('dashboard:index'))
+        self.assertEqual(listing_cache.generation(), generation + 1)
+        self.assertEqual(Listing.objects.filter(seller=self.seller, is_sold=True).count(), 2)
+        self.assertEqual(stats.seller_stats(self.seller.id)['sold'], 2)
+
+    def test_reprice_by_amount_and_percent(self):
+        self.post('reprice', self.mine[:2], change='-5', mode='amount')
+        self.assertEqual(self.prices(), [Decimal('15.00'), Decimal('15.00'), Decimal('20.00')])
+        self.post('reprice', self.mine, change='-10', mode='percent')
+        self.assertEqual(self.prices(), [Decimal('13.50'), Decimal('13.50'), Decimal('18.00')])
+        self.post('reprice', self.mine[:1], change='-100', mode='amount')
+        self.assertEqual(self.prices()[0], Decimal('0.00'))
+
+    def test_reprice_stores_whole_cents(self):
+        Listing.objects.filter(pk=self.mine[0].pk).update(price=Decimal('19.99'))
+        self.post('reprice', self.mine[:1], change='-6.90', mode='amount')
+        self.post('reprice', self.mine[1:2], change='-33.33', mode='percent')
+        # Compared in SQL, so a float left over from the arithmetic (13.089999...) wouldn't match
+        self.assertEqual(
+            list(Listing.objects.filter(price__in=[Decimal('13.09'), Decimal('13.33')]).order_by('pk')),
+            self.mine[:2],
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT price FROM listings_listing WHERE id = %s', [self.mine[0].pk])
+            self.assertEqual(cursor.fetchone()[0], 13.09)
+        self.assertEqual(stats.compute(self.seller.pk)['asking_total'], Decimal('46.42'))
+
+    def test_move_to_category_updates_etag_timestamp(self):
+        before = self.mine[0].updated_at
+        self.post('category', self.mine, category=self.lighting.pk)
+        self.assertEqual(Listing.objects.filter(category=self.lighting).count(), 3)
+        self.mine[0].refresh_from_db()
+        self.assertGreater(self.mine[0].updated_at, before)
+
+    def test_invalidates_after_commit(self):
+        generation = listing_cache.generation()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.post('category', self.mine, category=self.lighting.pk)
+        # Nothing is invalidated while the transaction could still be read stale
+        self.assertEqual(listing_cache.generation(), generation)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(listing_cache.generation(), generation + 1)
+
+    def test_delete_bumps_generation_once(self):
+        Conversation.start(self.mine[0], User.objects.get(username='other'), 'Still available?')
+        generation = listing_cache.generation()
+        with mock.patch.object(stats, 'forget', wraps=stats.forget) as forget, \
+                mock.patch('dashboard.bulk.release') as release, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.post('delete', self.mine)
+        self.assertFalse(Listing.objects.filter(seller=self.seller).exists())
+        self.assertEqual(listing_cache.generation(), generation + 1)
+        # Not once per listing and conversation from the receivers
+        forget.assert_called_once_with(self.seller.pk)
+        release.assert_called_once()
+
+    def test_only_own_listings(self):
+        response = self.post('sold', [self.mine[0], self.theirs])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['bulk_form'].errors)
+        self.assertFalse(Listing.objects.filter(is_sold=True).exists())
+
+    def test_reprice_needs_an_amount(self):
+        response = self.post('reprice', self.mine)
+        self.assertIn('change', response.context['bulk_form'].errors)
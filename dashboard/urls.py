@@ -4,6 +4,9 @@ from . import views
 app_name = 'dashboard'
 
 urlpatterns = [
-    # Only route is for dashboard home, where user sees their own listings.
-    path('', views.index, name='index')
+    # Dashboard home, where user sees their own listings.
+    path('', views.index, name='index'),
+
+    # Mark sold / reprice / recategorize / delete the selected listings at once
+    path('bulk/', views.bulk_action, name='bulk'),
 ]
@@ -1,12 +1,56 @@
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import render
+from django.shortcuts import redirect, render
+from django.views.decorators.http import require_POST
 
+from listings import counters
 from listings.models import Listing
+from . import bulk
+from .forms import BulkActionForm
+from .stats import seller_stats
+
+
+def _render_index(request, bulk_form):
+    my_listings = list(Listing.objects.filter(seller=request.user).order_by('-created_at'))
+    # Plus the views not written to the database yet
+    for listing in my_listings:
+        listing.view_count += counters.pending(listing.pk)
+    return render(request, 'dashboard/index.html', {
+        'listings': my_listings,
+        'stats': seller_stats(request.user.id),
+        'bulk_form': bulk_form,
+    })
+
 
 @login_required
 def index(request):
     """
-    Dashboard home: shows the current user's listings.
+    Dashboard home: shows the current user's listings and their stats.
     """
-    my_listings = Listing.objects.filter(seller=request.user).order_by('-created_at')
-    return render(request, 'dashboard/index.html', {'listings': my_listings})
\ No newline at end of file
+    return _render_index(request, BulkActionForm(seller=request.user))
+
+
+@login_required
+@require_POST
+def bulk_action(request):
+    """
+    Apply one action to all the selected listings at once (see bulk.py).
+    """
+    form = BulkActionForm(request.POST, seller=request.user)
+    if not form.is_valid():
+        return _render_index(request, form)
+
+    ids = [listing.pk for listing in form.cleaned_data['listings']]
+    action = form.cleaned_data['action']
+    if action == 'sold':
+        bulk.mark_sold(request.user, ids)
+    elif action == 'reprice':
+        change = form.cleaned_data['change']
+        if form.cleaned_data['mode'] == 'percent':
+            bulk.reprice(request.user, ids, percent=change)
+        else:
+            bulk.reprice(request.user, ids, amount=change)
+    elif action == 'category':
+        bulk.move_to_category(request.user, ids, form.cleaned_data['category'])
+    elif action == 'delete':
+        bulk.delete(request.user, ids)
+    return redirect('dashboard:index')
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
 
+from .fts import install_after_migrate
+
 
 class ListingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'listings'
+
+    def ready(self):
+        # Table rebuilds during migrate drop the FTS triggers, put them back
+        install_after_migrate(self, "listings.search.index")
@@ -0,0 +1,282 @@
+"""
+Search-as-you-type suggestions served from memory.
+
+Each process keeps a trie of unsold listing titles and category names. Every
+node caches its best completions, so a lookup is a walk down the prefix and a
+list copy, with no database query per keystroke. The index is loaded on first
+use and then kept current from the Listing/Category signals in models.py. It is
+also reloaded after AUTOCOMPLETE_MAX_AGE seconds to pick up writes made by
+other worker processes, by the one request that notices while the others keep
+using the old copy (Suggestions).
+"""
+import heapq
+import re
+import threading
+import time
+
+from .models import Category, Listing
+
+WORD_RE = re.compile(r"\w+")
+
+SUGGESTION_LIMIT = 8
+AUTOCOMPLETE_MAX_AGE = 60 * 5
+
+
+def normalize(text):
+    return " ".join(WORD_RE.findall(text.lower()))
+
+
+class Completion:
+    __slots__ = ("key", "text", "weight")
+
+    def __init__(self, key, text):
+        self.key = key
+        self.text = text
+        self.weight = 0
+
+    def sort_key(self):
+        # Heaviest first, then alphabetical
+        return (-self.weight, self.key)
+
+
+class _Node:
+    __slots__ = ("children", "completions", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.completions = set()  # completions whose indexed string ends here
+        self.top = None           # cached best completions in this subtree, None = unknown
+
+
+class PrefixIndex:
+    """
+    Trie from normalized strings to weighted completions.
+
+    A completion is reachable from the start of every word in it, so "lamp" finds
+    "Desk lamp". Raising a weight updates the cached top lists on its paths in
+    place; lowering or removing one only clears the caches that contained it,
+    and they get rebuilt on the next lookup.
+    """
+    def __init__(self, limit=SUGGESTION_LIMIT):
+        self.limit = limit
+        self.root = _Node()
+        self.completions = {}
+
+    def _paths(self, completion):
+        words = completion.key.split(" ")
+        for i in range(len(words)):
+            yield " ".join(words[i:])
+
+    def _walk(self, text, create=False):
+        node = self.root
+        nodes = [node]
+        for char in text:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _Node()
+            node = child
+            nodes.append(node)
+        return nodes
+
+    def _raised(self, completion):
+        for path in self._paths(completion):
+            nodes = self._walk(path, create=True)
+            nodes[-1].completions.add(completion)
+            for node in nodes:
+                if node.top is None:
+                    continue
+                if completion not in node.top:
+                    node.top.append(completion)
+                node.top.sort(key=Completion.sort_key)
+                del node.top[self.limit:]
+
+    def _lowered(self, completion, removed=False):
+        for path in self._paths(completion):
+            nodes = self._walk(path) or []
+            if removed and nodes:
+                nodes[-1].completions.discard(completion)
+            for node in nodes:
+                if node.top is not None and completion in node.top:
+                    node.top = None
+
+    def add(self, key, text, weight=1):
+        completion = self.completions.get(key)
+        if completion is None:
+            completion = self.completions[key] = Completion(key, text)
+        completion.weight += weight
+        self._raised(completion)
+
+    def remove(self, key, weight=1):
+        completion = self.completions.get(key)
+        if completion is None:
+            return
+        completion.weight -= weight
+        if completion.weight <= 0:
+            del self.completions[key]
+            self._lowered(completion, removed=True)
+        else:
+            self._lowered(completion)
+
+    def _top(self, node):
+        if node.top is None:
+            found = set()
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                found |= current.completions
+                stack.extend(current.children.values())
+            node.top = heapq.nsmallest(self.limit, found, key=Completion.sort_key)
+        return node.top
+
+    def lookup(self, prefix, limit=None):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        nodes = self._walk(prefix)
+        if nodes is None:
+            return []
+        return self._top(nodes[-1])[:limit or self.limit]
+
+
+class _Titles:
+    """
+    One loaded copy of the titles and categories, plus which title each listing
+    contributed so edits and sales can take it back out.
+    """
+    def __init__(self):
+        self.titles = PrefixIndex()
+        self.categories = PrefixIndex()
+        self.listing_titles = {}
+        self.category_keys = {}
+        self.category_ids = {}
+
+    @classmethod
+    def load(cls):
+        loaded = cls()
+        for pk, title in Listing.objects.filter(is_sold=False).values_list("id", "title"):
+            loaded.add_listing(pk, title)
+        for pk, name in Category.objects.values_list("id", "name"):
+            loaded.add_category(pk, name)
+        return loaded
+
+    def add_listing(self, pk, title):
+        key = normalize(title)
+        if key:
+            self.listing_titles[pk] = key
+            self.titles.add(key, title)
+
+    def remove_listing(self, pk):
+        key = self.listing_titles.pop(pk, None)
+        if key is not None:
+            self.titles.remove(key)
+
+    def listing_changed(self, pk, title, is_sold):
+        self.remove_listing(pk)
+        if not is_sold:
+            self.add_listing(pk, title)
+
+    def add_category(self, pk, name):
+        key = normalize(name)
+        if key:
+            self.category_keys[pk] = key
+            self.category_ids[key] = pk
+            self.categories.add(key, name)
+
+    def remove_category(self, pk):
+        key = self.category_keys.pop(pk, None)
+        if key is not None:
+            self.category_ids.pop(key, None)
+            self.categories.remove(key)
+
+    def category_changed(self, pk, name):
+        self.remove_category(pk)
+        self.add_category(pk, name)
+
+
+class Suggestions:
+    """
+    The process's current _Titles. Lookups and signal receivers share `lock`,
+    which is only ever held for in-memory work.
+
+    Loading reads every unsold title, so it happens outside the lock, one load
+    at a time (`load_lock`). Changes that arrive meanwhile are kept in `pending`
+    and replayed onto the new copy before it replaces the old one. When the copy
+    is merely old, the request that notices reloads it and everyone else keeps
+    using the old one; only the very first load makes others wait.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.load_lock = threading.Lock()
+        self.current = None
+        self.loaded_at = None
+        self.pending = None
+
+    def _current(self):
+        with self.lock:
+            current, loaded_at = self.current, self.loaded_at
+        if current is not None and time.monotonic() - loaded_at <= AUTOCOMPLETE_MAX_AGE:
+            return current
+        if not self.load_lock.acquire(blocking=current is None):
+            return current
+        try:
+            with self.lock:
+                if self.current is not current:
+                    # Loaded by whoever we waited for
+                    return self.current
+                self.pending = []
+            try:
+                loaded = _Titles.load()
+                with self.lock:
+                    for change in self.pending:
+                        change(loaded)
+                    self.current, self.loaded_at = loaded, time.monotonic()
+            finally:
+                with self.lock:
+                    self.pending = None
+            return loaded
+        finally:
+            self.load_lock.release()
+
+    def lookup(self, prefix, limit=SUGGESTION_LIMIT):
+        """
+        Returns (titles, [(category_id, name), ...]) completing `prefix`.
+        """
+        current = self._current()
+        with self.lock:
+            titles = [c.text for c in current.titles.lookup(prefix, limit)]
+            categories = [
+                (current.category_ids[c.key], c.text) for c in current.categories.lookup(prefix, limit)
+            ]
+            return titles, categories
+
+    # The signal receivers call these. Nothing to do until something has been loaded.
+
+    def _apply(self, change):
+        with self.lock:
+            if self.current is not None:
+                change(self.current)
+            if self.pending is not None:
+                self.pending.append(change)
+
+    def listing_changed(self, listing):
+        pk, title, is_sold = listing.pk, listing.title, listing.is_sold
+        self._apply(lambda titles: titles.listing_changed(pk, title, is_sold))
+
+    def listing_deleted(self, pk):
+        self._apply(lambda titles: titles.remove_listing(pk))
+
+    def category_changed(self, category):
+        pk, name = category.pk, category.name
+        self._apply(lambda titles: titles.category_changed(pk, name))
+
+    def category_deleted(self, pk):
+        self._apply(lambda titles: titles.remove_category(pk))
+
+    def reset(self):
+        with self.lock:
+            self.current = self.loaded_at = None
+
+
+suggestions = Suggestions()
@@ -0,0 +1,114 @@
+"""
+Cache helpers for listing reads.
+
+Everything we cache about listings is keyed on a global "listings generation"
+number. Saving or deleting any Listing bumps it (see the receivers in models.py),
+which makes every older entry unreachable in one cache write; the old entries
+simply expire. Use a shared cache backend (CACHES in settings) once there is more
+than one worker process, otherwise each process only sees its own bumps.
+"""
+import datetime
+import hashlib
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+GENERATION_KEY = "listings:generation"
+CHANGED_AT_KEY = "listings:changed_at"
+
+
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # Seed from the clock rather than 1, so a generation that got evicted can
+        # never come back with a number some old entry was stored under.
+        cache.add(GENERATION_KEY, time.time_ns() // 1000, timeout=None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # Key was missing, seeding it is as good as a bump.
+        generation()
+    cache.set(CHANGED_AT_KEY, time.time(), timeout=None)
+
+
+def last_changed():
+    """
+    When listings last changed, as an aware datetime (for Last-Modified).
+    If the cache has forgotten, say "now" so nobody is told a stale page is fresh.
+    """
+    value = cache.get(CHANGED_AT_KEY)
+    if value is None:
+        value = time.time()
+        if not cache.add(CHANGED_AT_KEY, value, timeout=None):
+            value = cache.get(CHANGED_AT_KEY, value)
+    return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+def make_key(prefix, *parts):
+    """
+    Cache key for `parts` under the current generation. Parts are hashed so
+    free-text search queries are safe to use with any backend.
+    """
+    digest = hashlib.md5("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f"listings:{prefix}:{generation()}:{digest}"
+
+
+# Browse/search results: ordered listing ids per (query, category, cursor).
+RESULTS_TIMEOUT = 60 * 5
+HITS_KEY = "listings:results:hits"
+MISSES_KEY = "listings:results:misses"
+
+
+def results_key(query, category_id, cursor):
+    # Build the key *before* running the query: if a listing changes meanwhile,
+    # what we store lands under the old generation and is never read.
+    return make_key("results", normalize_query(query), category_id or "", cursor or "")
+
+
+def record_lookup(hit):
+    key = HITS_KEY if hit else MISSES_KEY
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def is_shared():
+    """
+    Whether other processes see the same cache. The default LocMemCache is per
+    process, so its counters only exist inside the process serving requests.
+    """
+    backend = caches["default"]
+    return not isinstance(backend, (LocMemCache, DummyCache))
+
+
+def stats():
+    """
+    Hit/miss counters for the results cache, for sizing it. They live in the
+    cache, so with a per-process backend this only counts this process's
+    lookups (the staff-only listings:cache_stats view shows the server's).
+    """
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
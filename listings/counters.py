@@ -0,0 +1,156 @@
+"""
+Write-behind view counters for listings.
+
+An UPDATE per detail page hit would queue every page view behind SQLite's
+single writer. Instead record_view() only bumps a number in memory, and once
+every LISTING_VIEW_FLUSH_SECONDS the accumulated deltas are written as one
+UPDATE (per FLUSH_BATCH listings) in one transaction, by a background thread
+(or whichever request comes along first). Whatever is still buffered is written
+when the process exits. A crash loses at most one interval of views, fine for a
+counter. LISTING_VIEW_FLUSH_THREAD = False turns the thread and exit hook off (tests).
+
+@counts_views records the view before @condition can answer 304, so a browser
+revalidating the page counts too, at no extra query.
+
+Repeat views from the same visitor (session, or address and user agent if there
+is no session) within LISTING_VIEW_DEDUPE_SECONDS count once. That check lives
+in the cache too, so counting a view never writes to the database, sessions
+included.
+
+update() skips the signals and leaves updated_at alone, so views don't
+invalidate cached pages or ETags.
+"""
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Case, F, Value, When
+
+from .freshness import listing_seller
+from .models import Listing
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = getattr(settings, "LISTING_VIEW_FLUSH_SECONDS", 30)
+DEDUPE_SECONDS = getattr(settings, "LISTING_VIEW_DEDUPE_SECONDS", 30 * 60)
+FLUSH_BATCH = 500
+
+_pending = {}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_flusher = None
+
+
+def _visitor(request):
+    if request.session.session_key:
+        return request.session.session_key
+    raw = f"{request.META.get('REMOTE_ADDR', '')}|{request.headers.get('User-Agent', '')}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def record_view(request, pk, seller_id):
+    """
+    Count a view of listing `pk`, unless it's the seller's own or a repeat from the same visitor.
+    Returns whether it was counted.
+    """
+    if request.user.is_authenticated and request.user.pk == seller_id:
+        return False
+    key = f"listings:viewed:{pk}:{_visitor(request)}"
+    # add() is a no-op returning False if the key is already there
+    if not cache.add(key, 1, DEDUPE_SECONDS):
+        return False
+    with _lock:
+        _pending[pk] = _pending.get(pk, 0) + 1
+        due = time.monotonic() - _last_flush >= FLUSH_SECONDS
+        # Checked here, not at import, so tests can turn it off with override_settings
+        if _flusher is None and getattr(settings, "LISTING_VIEW_FLUSH_THREAD", True):
+            _start_flusher()
+    if due:
+        try:
+            flush()
+        except DatabaseError:
+            logger.exception("Flushing listing view counts failed")
+    return True
+
+
+def counts_views(view):
+    """
+    For a detail view taking `pk`: count GETs of existing listings, 304s included.
+    Goes outside @condition, whose lookup of the listing (freshness.py) it shares.
+    """
+    @wraps(view)
+    def wrapper(request, pk, *args, **kwargs):
+        if request.method == "GET":
+            seller_id = listing_seller(request, pk)
+            if seller_id is not None:
+                record_view(request, pk, seller_id)
+        return view(request, pk, *args, **kwargs)
+    return wrapper
+
+
+def pending(pk):
+    """
+    Views of a listing not written to the database yet.
+    """
+    with _lock:
+        return _pending.get(pk, 0)
+
+
+def flush():
+    """
+    Write the buffered view counts. Returns the number of listings updated.
+    """
+    global _pending, _last_flush
+    with _lock:
+        deltas, _pending = _pending, {}
+        _last_flush = time.monotonic()
+    if not deltas:
+        return 0
+    items = sorted(deltas.items())
+    try:
+        with transaction.atomic():
+            for start in range(0, len(items), FLUSH_BATCH):
+                batch = items[start:start + FLUSH_BATCH]
+                delta = Case(*[When(pk=pk, then=Value(count)) for pk, count in batch], default=Value(0))
+                Listing.objects.filter(pk__in=[pk for pk, _ in batch]).update(view_count=F("view_count") + delta)
+    except Exception:
+        # Put them back for the next attempt rather than lose them
+        with _lock:
+            for pk, count in deltas.items():
+                _pending[pk] = _pending.get(pk, 0) + count
+        raise
+    return len(items)
+
+
+def _start_flusher():
+    # Called with _lock held, on the first view this process counts
+    global _flusher
+    _flusher = threading.Thread(target=_flush_periodically, name="listing-view-counts", daemon=True)
+    _flusher.start()
+    atexit.register(_flush_on_exit)
+
+
+def _flush_periodically():
+    # Also on quiet sites, where no request would come along to do it
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        close_old_connections()
+        try:
+            flush()
+        except DatabaseError:
+            logger.exception("Flushing listing view counts failed")
+        finally:
+            close_old_connections()
+
+
+def _flush_on_exit():
+    try:
+        flush()
+    except DatabaseError as e:
+        logger.warning("Could not write buffered listing view counts at exit: %s", e)
@@ -0,0 +1,30 @@
+"""
+Per-category counts of unsold listings for the browse sidebar.
+"""
+from django.core.cache import cache
+from django.db.models import Count
+
+from . import search
+from .cache import make_key, normalize_query
+from .models import Listing
+
+FACETS_TIMEOUT = 60 * 10
+
+
+def category_counts(query=""):
+    """
+    Returns {category_id: unsold listing count}, only counting listings that match
+    `query` if one is given. One GROUP BY query, cached until a listing changes.
+    """
+    query = normalize_query(query)
+    key = make_key("facets", query)
+    counts = cache.get(key)
+    if counts is None:
+        qs = Listing.objects.filter(is_sold=False)
+        if query:
+            qs = search.filter_matches(qs, query)
+        counts = dict(
+            qs.order_by().values("category_id").annotate(n=Count("id")).values_list("category_id", "n")
+        )
+        cache.set(key, counts, FACETS_TIMEOUT)
+    return counts
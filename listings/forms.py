@@ -1,15 +1,59 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from PIL import Image, UnidentifiedImageError
+
 from .models import Listing
 
 INPUT_CLASSES = 'w-full py-4 px-6 rounded-xl border'
 
-class NewListingForm(forms.ModelForm):
+# Anything bigger than this is almost certainly not a phone photo (or is a decompression bomb)
+MAX_IMAGE_PIXELS = 40_000_000
+IMAGE_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+
+
+class ListingImageField(forms.ImageField):
+    """
+    Checks an upload is an image by reading its header only. Django's ImageField
+    would load and verify() the whole file before we even know its size.
+    """
+    def to_python(self, data):
+        f = forms.FileField.to_python(self, data)
+        if f is None:
+            return None
+        try:
+            image = Image.open(f)  # lazy: parses the header, no pixel data
+            fmt, size = image.format, image.size
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image')
+        if fmt not in IMAGE_FORMATS:
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image')
+        if size[0] * size[1] > MAX_IMAGE_PIXELS:
+            raise ValidationError('This image is too large.', code='image_too_large')
+        f.image = image
+        f.content_type = Image.MIME.get(fmt)
+        if hasattr(f, 'seek') and callable(f.seek):
+            f.seek(0)
+        return f
+
+
+class ListingImageMixin:
+    """
+    A new upload makes the old resized variants useless, see thumbnails.py.
+    """
+    def save(self, commit=True):
+        if "image" in self.changed_data:
+            self.instance.image_variants = []
+        return super().save(commit)
+
+
+class NewListingForm(ListingImageMixin, forms.ModelForm):
     """
     Form used when creating a new listing.
     """
     class Meta:
         model = Listing
         fields = ('category', 'title', 'description', 'price', 'image')
+        field_classes = {'image': ListingImageField}
         widgets = {
             'category': forms.Select(attrs={'class': INPUT_CLASSES}),
             'title': forms.TextInput(attrs={'class': INPUT_CLASSES, 'placeholder': 'What are you selling?'}),
@@ -18,13 +62,14 @@ class NewListingForm(forms.ModelForm):
             'image': forms.FileInput(attrs={'class': INPUT_CLASSES})
         }
 
-class EditListingForm(forms.ModelForm):
+class EditListingForm(ListingImageMixin, forms.ModelForm):
     """
     Form used when editing an existing listing.
     """
     class Meta:
         model = Listing
         fields = ('title', 'description', 'price', 'image', 'is_sold')
+        field_classes = {'image': ListingImageField}
         widgets = {
             'title': forms.TextInput(attrs={'class': INPUT_CLASSES}),
             'description': forms.Textarea(attrs={'class': INPUT_CLASSES, 'rows': 4}),
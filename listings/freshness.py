@@ -0,0 +1,77 @@
+"""
+ETag / Last-Modified for the listing pages, for use with @condition.
+
+Revalidating a page the browser already has should be cheaper than rendering
+it. Browse and home pages are validated against the listings generation (see
+cache.py) without touching the database at all; a detail page costs a single
+primary-key lookup. Pages look different per user (navbar, seller links), so
+the viewer is part of every ETag, along with their unread message count (the
+navbar badge; cached, see conversations/unread.py).
+"""
+import hashlib
+
+from conversations import unread
+
+from .cache import generation, last_changed
+from .models import Listing
+
+
+def _viewer(request):
+    user = request.user
+    if not user.is_authenticated:
+        return "anon"
+    return f"{user.pk}:{user.get_username()}:{unread.total_unread(user)}"
+
+
+def _etag(*parts):
+    return hashlib.md5("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def listings_etag(request, *args, **kwargs):
+    """
+    For pages built only from listings/categories and the querystring (browse, home).
+    """
+    params = sorted(request.GET.lists())
+    return _etag(request.path, generation(), params, _viewer(request))
+
+
+def listings_last_modified(request, *args, **kwargs):
+    return last_changed()
+
+
+def _listing(request, pk):
+    # Both functions (and counters.counts_views) run for one request, only look it up once
+    cached = getattr(request, "_listing_stamp", None)
+    if cached is None or cached[0] != pk:
+        row = Listing.objects.filter(pk=pk).values_list("updated_at", "seller_id").first()
+        cached = request._listing_stamp = (pk, row or (None, None))
+    return cached[1]
+
+
+def _updated_at(request, pk):
+    return _listing(request, pk)[0]
+
+
+def listing_seller(request, pk):
+    """
+    The seller of listing `pk`, None if there is no such listing.
+    """
+    return _listing(request, pk)[1]
+
+
+def detail_etag(request, pk, *args, **kwargs):
+    """
+    None for a missing listing, so the view itself gets to 404.
+    The generation covers the related listings shown under it.
+    """
+    updated_at = _updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return _etag(pk, updated_at.isoformat(), generation(), _viewer(request))
+
+
+def detail_last_modified(request, pk, *args, **kwargs):
+    updated_at = _updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return max(updated_at, last_changed())
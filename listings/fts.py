@@ -0,0 +1,153 @@
+"""
+SQLite FTS5 indexes over a model's text columns, for listings/search.py and
+conversations/search.py.
+
+Each index is an FTS5 table with external content pointing back at the model's
+table, so the text is only stored once. Triggers on that table keep it in sync
+on insert/update/delete, which also covers QuerySet.update(), bulk_create() and
+raw SQL, where model signals would not fire. Other database backends have no
+index; callers fall back to icontains.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_migrate
+from django.utils.module_loading import import_string
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def is_supported(conn=connection):
+    return conn.vendor == "sqlite"
+
+
+def match_expression(query):
+    """
+    Turn whatever was typed in the search box into a safe FTS5 MATCH expression.
+    Each word becomes a quoted prefix term and all of them must match, so
+    'lap desk' finds 'Laptop desk'. Returns '' if there is nothing to search for.
+    """
+    return " ".join(f'"{token}"*' for token in TOKEN_RE.findall(query.lower()))
+
+
+class FTSIndex:
+    """
+    An FTS5 table `name` over `columns` of `model`, keyed on its id.
+    """
+    def __init__(self, model, name, columns):
+        self.model = model
+        self.name = name
+        self.columns = list(columns)
+        self.content_table = model._meta.db_table
+
+    def _values(self, prefix):
+        return ", ".join(f"{prefix}.{column}" for column in self.columns)
+
+    @property
+    def create_statements(self):
+        name, content, columns = self.name, self.content_table, ", ".join(self.columns)
+        return [
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+                {columns},
+                content='{content}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {content} BEGIN
+                INSERT INTO {name}(rowid, {columns}) VALUES (new.id, {self._values("new")});
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {content} BEGIN
+                INSERT INTO {name}({name}, rowid, {columns}) VALUES ('delete', old.id, {self._values("old")});
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {columns} ON {content} BEGIN
+                INSERT INTO {name}({name}, rowid, {columns}) VALUES ('delete', old.id, {self._values("old")});
+                INSERT INTO {name}(rowid, {columns}) VALUES (new.id, {self._values("new")});
+            END
+            """,
+        ]
+
+    @property
+    def drop_statements(self):
+        return [
+            f"DROP TRIGGER IF EXISTS {self.name}_ai",
+            f"DROP TRIGGER IF EXISTS {self.name}_ad",
+            f"DROP TRIGGER IF EXISTS {self.name}_au",
+            f"DROP TABLE IF EXISTS {self.name}",
+        ]
+
+    def _trigger_count(self, cursor):
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s AND name LIKE %s",
+            [self.content_table, f"{self.name}_%"],
+        )
+        return cursor.fetchone()[0]
+
+    def install(self, conn=connection):
+        """
+        Create the FTS table and its triggers if they are missing.
+
+        Django's SQLite schema editor rebuilds a table (and silently drops its
+        triggers) for most ALTERs, so this runs after every migrate as well
+        (install_after_migrate). If any trigger had gone missing the index may
+        have drifted, so it gets rebuilt.
+        """
+        if not is_supported(conn):
+            return
+        with conn.cursor() as cursor:
+            missing_triggers = self._trigger_count(cursor) < 3
+            for statement in self.create_statements:
+                cursor.execute(statement)
+            if missing_triggers:
+                cursor.execute(f"INSERT INTO {self.name}({self.name}) VALUES ('rebuild')")
+
+    def uninstall(self, conn=connection):
+        if not is_supported(conn):
+            return
+        with conn.cursor() as cursor:
+            for statement in self.drop_statements:
+                cursor.execute(statement)
+
+    def rebuild(self, conn=connection):
+        """
+        Re-create the whole index from the model's table.
+        """
+        if not is_supported(conn):
+            return
+        self.install(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.name}({self.name}) VALUES ('rebuild')")
+
+    def matches(self, expression):
+        """
+        Ids matching an FTS5 expression, for filter(id__in=...).
+        """
+        return RawSQL(f"SELECT rowid FROM {self.name} WHERE {self.name} MATCH %s", (expression,))
+
+    def rank(self, expression, weights=()):
+        """
+        bm25 score of each row (lower is better), for annotate(). `weights` are per column.
+        """
+        arguments = "".join(f", {weight}" for weight in weights)
+        return RawSQL(
+            f'SELECT bm25({self.name}{arguments}) FROM {self.name} '
+            f'WHERE {self.name} MATCH %s AND rowid = "{self.content_table}"."id"',
+            (expression,),
+        )
+
+
+def install_after_migrate(app_config, index_path):
+    """
+    Put the index at `index_path` (dotted path to an FTSIndex) back after every
+    migrate of the app, in case a table rebuild dropped its triggers.
+    """
+    def ensure_index(sender, using, **kwargs):
+        import_string(index_path).install(connections[using])
+
+    post_migrate.connect(ensure_index, sender=app_config, weak=False, dispatch_uid=index_path)
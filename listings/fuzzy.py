@@ -0,0 +1,109 @@
+"""
+Typo-tolerant title search ("calculater" -> "calculator").
+
+Titles are split into words and each word into trigrams, padded like pg_trgm
+("  c", " ca", "cal", ...), stored in TitleTrigram. A search first pulls a short
+candidate list from the trigram index (listings sharing enough trigrams with
+the query), then scores only those candidates in Python.
+"""
+import re
+
+from django.db.models import Count
+
+from .models import Listing, TitleTrigram
+
+WORD_RE = re.compile(r"\w+")
+
+# Listings pulled from the index before scoring
+CANDIDATES = 100
+# Fraction of the query's trigrams a candidate must share
+MIN_SHARED = 0.3
+# Minimum similarity (0..1) to show a result at all
+THRESHOLD = 0.4
+
+
+def word_trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigrams(text):
+    grams = set()
+    for word in WORD_RE.findall(text.lower()):
+        grams |= word_trigrams(word)
+    return grams
+
+
+def similarity(query, title):
+    """
+    For every word in the query take its best trigram (Jaccard) match among the
+    title's words, then average. A long title isn't punished for extra words.
+    """
+    query_words = [word_trigrams(w) for w in WORD_RE.findall(query.lower())]
+    title_words = [word_trigrams(w) for w in WORD_RE.findall(title.lower())]
+    if not query_words or not title_words:
+        return 0.0
+    total = 0.0
+    for q in query_words:
+        total += max(len(q & t) / len(q | t) for t in title_words)
+    return total / len(query_words)
+
+
+def index_listing(listing):
+    """
+    Bring one listing's trigram rows in line with its title (only writes the difference).
+    """
+    wanted = trigrams(listing.title)
+    existing = set(TitleTrigram.objects.filter(listing=listing).values_list("trigram", flat=True))
+    stale = existing - wanted
+    if stale:
+        TitleTrigram.objects.filter(listing=listing, trigram__in=stale).delete()
+    TitleTrigram.objects.bulk_create(
+        [TitleTrigram(listing=listing, trigram=gram) for gram in wanted - existing],
+        ignore_conflicts=True,
+    )
+
+
+def rebuild(batch_size=1000):
+    """
+    Re-create the whole trigram index from listing titles. Returns the number of listings indexed.
+    """
+    TitleTrigram.objects.all().delete()
+    count = 0
+    rows = []
+    for pk, title in Listing.objects.order_by().values_list("id", "title").iterator(chunk_size=batch_size):
+        rows.extend(TitleTrigram(listing_id=pk, trigram=gram) for gram in trigrams(title))
+        count += 1
+        if len(rows) >= batch_size:
+            TitleTrigram.objects.bulk_create(rows)
+            rows = []
+    TitleTrigram.objects.bulk_create(rows)
+    return count
+
+
+def fuzzy_ids(query, category_id=None, limit=24):
+    """
+    Ids of unsold listings whose titles look like `query`, most similar first.
+    """
+    grams = trigrams(query)
+    if not grams:
+        return []
+
+    candidates = TitleTrigram.objects.filter(trigram__in=grams, listing__is_sold=False)
+    if category_id:
+        candidates = candidates.filter(listing__category_id=category_id)
+    candidate_ids = list(
+        candidates.values("listing_id")
+        .annotate(shared=Count("id"))
+        .filter(shared__gte=max(1, int(len(grams) * MIN_SHARED)))
+        .order_by("-shared", "-listing_id")
+        .values_list("listing_id", flat=True)[:CANDIDATES]
+    )
+
+    scored = []
+    for pk, title in Listing.objects.filter(pk__in=candidate_ids).values_list("id", "title"):
+        score = similarity(query, title)
+        if score >= THRESHOLD:
+            scored.append((score, pk))
+    scored.sort(reverse=True)
+    return [pk for _, pk in scored[:limit]]
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from listings import thumbnails
+from listings.cache import bump_generation
+from listings.models import Listing
+
+FIELDS = ["image_width", "image_height", "image_color", "updated_at"]
+
+
+class Command(BaseCommand):
+    help = "Fill in image width/height and placeholder colour for listings that are missing them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200,
+                            help="Listings read and written per batch.")
+
+    def handle(self, *args, **options):
+        qs = (
+            Listing.objects.exclude(Q(image="") | Q(image__isnull=True))
+            .filter(Q(image_width__isnull=True) | Q(image_color=""))
+            .only("id", "image", *FIELDS)
+            .order_by("id")
+        )
+        filled = skipped = 0
+        last_id = 0
+        while True:
+            # Keyset batches: each one is a fresh indexed query, memory stays bounded
+            batch = list(qs.filter(id__gt=last_id)[:options["batch_size"]])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            changed = []
+            for listing in batch:
+                metadata = thumbnails.image_metadata(listing.image.storage, listing.image.name)
+                if metadata is None:
+                    skipped += 1
+                    continue
+                listing.image_width, listing.image_height, listing.image_color = metadata
+                listing.updated_at = timezone.now()
+                changed.append(listing)
+
+            if changed:
+                with transaction.atomic():
+                    Listing.objects.bulk_update(changed, FIELDS)
+                # bulk_update skips the signals
+                bump_generation()
+            filled += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f"Filled {filled} listings ({skipped} unreadable images skipped)."))
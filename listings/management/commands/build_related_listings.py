@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from listings import related
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute related listings for every listing (TF-IDF over titles and descriptions). "
+        "With --changed, only score listings added or edited since the last run (run that every few minutes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=related.CHUNK_SIZE,
+                            help="Listings scored per matrix product.")
+        parser.add_argument("--changed", action="store_true",
+                            help="Update the saved model instead of rebuilding it (rebuilds if there is none).")
+
+    def handle(self, *args, **options):
+        if options["changed"]:
+            count = related.update(chunk_size=options["chunk_size"])
+        else:
+            count = related.build(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Scored {count} listings."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from listings import cache as listing_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Show hit/miss counters for the listings results cache. Needs a cache backend shared "
+        "with the web processes; with the per-process default use the listings:cache_stats view."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Zero the counters after printing them.")
+
+    def handle(self, *args, **options):
+        # This process has its own LocMemCache, which no request ever counted into
+        if not listing_cache.is_shared():
+            raise CommandError(
+                "The default cache is per process, so this command can't see the server's counters. "
+                "Configure a shared backend in CACHES, or open /listings/cache-stats/ as staff."
+            )
+        stats = listing_cache.stats()
+        self.stdout.write(
+            f"hits={stats['hits']} misses={stats['misses']} hit_rate={stats['hit_rate']:.1%}"
+        )
+        if options["reset"]:
+            listing_cache.reset_stats()
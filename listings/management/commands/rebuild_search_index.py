@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from listings import fuzzy, search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the listing search indexes (full-text and fuzzy title trigrams) from scratch."
+
+    def handle(self, *args, **options):
+        if search.is_supported():
+            search.rebuild()
+        else:
+            self.stdout.write("Full-text search needs SQLite, skipping the FTS index.")
+        count = fuzzy.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} listings."))
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0003_listing_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_sold', False)), fields=['-created_at', '-id'], name='listing_unsold_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_sold', False)), fields=['category', '-created_at', '-id'], name='listing_unsold_cat_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_sold', False)), fields=['-id'], name='listing_unsold_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['seller', '-created_at', '-id'], name='listing_seller_newest_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_existing_titles(apps, schema_editor):
+    from listings.fuzzy import trigrams
+    Listing = apps.get_model('listings', 'Listing')
+    TitleTrigram = apps.get_model('listings', 'TitleTrigram')
+    rows = [
+        TitleTrigram(listing_id=pk, trigram=gram)
+        for pk, title in Listing.objects.values_list('id', 'title')
+        for gram in trigrams(title)
+    ]
+    TitleTrigram.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0004_listing_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TitleTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='title_trigrams', to='listings.listing')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('trigram', 'listing'), name='title_trigram_unique')],
+            },
+        ),
+        migrations.RunPython(index_existing_titles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0005_title_trigram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedListing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='listings.listing')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='listings.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing', '-score'], name='related_listing_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('listing', 'related'), name='related_listing_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:11
+
+import listings.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0008_listing_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listing',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=listings.storage.get_listing_image_storage, upload_to='item_images/'),
+        ),
+    ]
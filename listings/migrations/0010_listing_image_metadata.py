@@ -0,0 +1,35 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:16
+
+import listings.models
+import listings.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_listing_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='image_color',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='listing',
+            name='image',
+            field=listings.models.StoredImageField(blank=True, height_field='image_height', null=True, storage=listings.storage.get_listing_image_storage, upload_to='item_images/', width_field='image_width'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0010_listing_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='view_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:21
+
+import listings.models
+import listings.storage
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0011_listing_view_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listing',
+            name='image',
+            field=listings.models.StoredImageField(blank=True, db_index=True, height_field='image_height', null=True, storage=listings.storage.get_listing_image_storage, upload_to='item_images/', width_field='image_width'),
+        ),
+    ]
@@ -1,7 +1,15 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.text import slugify
 
+from .cache import bump_generation
+from .storage import get_listing_image_storage, image_lock
+
 class Category(models.Model):
     """
     Item category for the marketplace.
@@ -38,6 +46,25 @@ class Category(models.Model):
         return super().save(*args, **kwargs)
 
 
+class StoredImageField(models.ImageField):
+    """
+    ImageField that only measures an image when a new file is assigned.
+
+    Django also runs the dimension hook from post_init for every row loaded and
+    opens the file whenever the width/height columns are empty (rows from before
+    they existed, missing files), so rendering a page of listings could hit the
+    disk once per row. Those rows are filled by `backfill_image_metadata` instead.
+    """
+    def update_dimension_fields(self, instance, force=False, *args, **kwargs):
+        if not force or self.attname not in instance.__dict__:
+            return
+        file = getattr(instance, self.attname)
+        # Same stored file assigned again (e.g. an edit form without a new upload)
+        if file and file._committed and getattr(instance, self.width_field) is not None:
+            return
+        super().update_dimension_fields(instance, force, *args, **kwargs)
+
+
 class Listing(models.Model):
     """
     A single marketplace listing posted by a user.
@@ -47,15 +74,202 @@ class Listing(models.Model):
     # Allow empty descriptions
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    image = models.ImageField(upload_to="item_images/", blank=True, null=True)
+    # Stored once per distinct content and shared between listings, see storage.py
+    # Indexed for release(), which looks up whether any other listing still uses a file
+    image = StoredImageField(
+        upload_to="item_images/", storage=get_listing_image_storage, blank=True, null=True,
+        width_field="image_width", height_field="image_height", db_index=True,
+    )
+    # Filled when the image is assigned, so templates can reserve the space without opening the file
+    image_width = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    image_height = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    # Average colour ("#rrggbb") shown while the image loads, set along with the variants
+    image_color = models.CharField(max_length=7, blank=True, editable=False)
+    # Widths of the resized copies of `image` that exist (thumbnails.py), [] until they are made
+    image_variants = models.JSONField(default=list, blank=True, editable=False)
     is_sold = models.BooleanField(default=False)
+    # Detail page views, written in batches (counters.py), so a little behind
+    view_count = models.PositiveIntegerField(default=0, editable=False)
     seller = models.ForeignKey(User, related_name="listings", on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every save, drives Last-Modified/ETag on the detail page
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         # Newest listings first.
         ordering = ("-created_at",)
+        # One index per hot read path. The browse/related/home queries only ever look
+        # at unsold rows, so those indexes are partial and skip sold listings entirely.
+        indexes = [
+            # Browse page, no category (listings.views.index)
+            models.Index(fields=["-created_at", "-id"], condition=models.Q(is_sold=False),
+                         name="listing_unsold_newest_idx"),
+            # Browse by category + related items (listings.views.index/detail)
+            models.Index(fields=["category", "-created_at", "-id"], condition=models.Q(is_sold=False),
+                         name="listing_unsold_cat_newest_idx"),
+            # Homepage latest items (main.views.index)
+            models.Index(fields=["-id"], condition=models.Q(is_sold=False),
+                         name="listing_unsold_id_idx"),
+            # Seller's own listings (dashboard.views.index, account.views.profile)
+            models.Index(fields=["seller", "-created_at", "-id"], name="listing_seller_newest_idx"),
+        ]
 
     def __str__(self):
         # Keep concise representation for logs.
         return f"{self.title}"
+
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            # The file may be one already stored for another listing; keep release()
+            # from deleting it until this row, which uses it, has committed (storage.py)
+            with image_lock():
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which file we started with, so a replaced image can be released (storage.py)
+        instance._loaded_image = instance.__dict__.get("image")
+        return instance
+
+
+class TitleTrigram(models.Model):
+    """
+    One row per (trigram, listing) for typo-tolerant title search, see fuzzy.py.
+    """
+    trigram = models.CharField(max_length=3)
+    listing = models.ForeignKey(Listing, related_name="title_trigrams", on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            # Doubles as the lookup index: trigram -> listings
+            models.UniqueConstraint(fields=["trigram", "listing"], name="title_trigram_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.trigram!r} -> {self.listing_id}"
+
+
+class RelatedListing(models.Model):
+    """
+    Precomputed "you might also like" neighbour of a listing, see related.py.
+    """
+    listing = models.ForeignKey(Listing, related_name="related_entries", on_delete=models.CASCADE)
+    related = models.ForeignKey(Listing, related_name="related_to", on_delete=models.CASCADE)
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["listing", "related"], name="related_listing_unique"),
+        ]
+        indexes = [
+            # Detail page: best neighbours of one listing, already in order
+            models.Index(fields=["listing", "-score"], name="related_listing_score_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.listing_id} -> {self.related_id} ({self.score:.2f})"
+
+
+_bulk = threading.local()
+
+
+@contextmanager
+def bulk_change():
+    """
+    For bulk actions that do the receivers' work themselves, once for all the
+    rows (dashboard/bulk.py): inside the block the per-listing receivers below
+    and in dashboard/models.py do nothing. Per thread.
+    """
+    _bulk.depth = getattr(_bulk, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _bulk.depth -= 1
+
+
+def in_bulk_change():
+    return getattr(_bulk, "depth", 0) > 0
+
+
+# Any change to a listing invalidates everything cached about listings (facets, results, ...), see cache.py
+# Category names show up on the same pages, so they count too.
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_listings_generation(sender, instance, **kwargs):
+    if in_bulk_change():
+        return
+    bump_generation()
+
+
+# Keep the fuzzy title index up to date (rows go away with the listing via CASCADE)
+@receiver(post_save, sender=Listing)
+def index_listing_trigrams(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "title" not in update_fields:
+        return
+    from .fuzzy import index_listing
+    index_listing(instance)
+
+
+# Keep the in-memory autocomplete index (autocomplete.py) current, once the write has committed
+@receiver(post_save, sender=Listing)
+def autocomplete_listing_saved(sender, instance, **kwargs):
+    from .autocomplete import suggestions
+    transaction.on_commit(lambda: suggestions.listing_changed(instance))
+
+
+@receiver(post_delete, sender=Listing)
+def autocomplete_listing_deleted(sender, instance, **kwargs):
+    if in_bulk_change():
+        return
+    from .autocomplete import suggestions
+    pk = instance.pk
+    transaction.on_commit(lambda: suggestions.listing_deleted(pk))
+
+
+@receiver(post_save, sender=Category)
+def autocomplete_category_saved(sender, instance, **kwargs):
+    from .autocomplete import suggestions
+    transaction.on_commit(lambda: suggestions.category_changed(instance))
+
+
+@receiver(post_delete, sender=Category)
+def autocomplete_category_deleted(sender, instance, **kwargs):
+    from .autocomplete import suggestions
+    pk = instance.pk
+    transaction.on_commit(lambda: suggestions.category_deleted(pk))
+
+
+# Resize new uploads off the request path. The forms reset image_variants when the image changes.
+@receiver(post_save, sender=Listing)
+def thumbnail_listing_image(sender, instance, update_fields=None, **kwargs):
+    if not instance.image or instance.image_variants:
+        return
+    if update_fields is not None and "image" not in update_fields:
+        return
+    from . import thumbnails
+    pk = instance.pk
+    transaction.on_commit(lambda: thumbnails.schedule(pk))
+
+
+# Images are shared between listings (storage.py): drop a file once the last listing lets go of it
+@receiver(post_save, sender=Listing)
+def release_replaced_image(sender, instance, **kwargs):
+    old = getattr(instance, "_loaded_image", None)
+    new = instance.image.name if instance.image else ""
+    instance._loaded_image = new
+    if old and old != new:
+        from .storage import release
+        transaction.on_commit(lambda: release(old))
+
+
+@receiver(post_delete, sender=Listing)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.image and not in_bulk_change():
+        from .storage import release
+        name = instance.image.name
+        transaction.on_commit(lambda: release(name))
@@ -0,0 +1,212 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, each page remembers the sort key of its first/last row and the
+next query starts right after it with a WHERE on the ordering columns. With an
+index on those columns every page costs the same as the first one, and rows
+inserted while someone is paging don't shift what they see.
+
+That needs a sort key that stays put. A relevance score doesn't: bm25 moves
+whenever the index changes. Such results are ranked once and the id list is kept
+(paginate_snapshot); the cursor is then a position in that list.
+"""
+import base64
+import binascii
+import datetime
+import json
+import math
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils import timezone
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """
+    One page of results plus the cursors to move either way from it.
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _ordering(qs):
+    ordering = list(qs.query.order_by or qs.model._meta.ordering)
+    if not ordering or ordering[-1].lstrip("-") not in ("id", "pk"):
+        raise ValueError("Keyset pagination needs the ordering to end with a unique id.")
+    return [(key.lstrip("-"), key.startswith("-")) for key in ordering]
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _decode_value(model, name, value):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # Annotations (e.g. search_rank) are plain numbers
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise InvalidCursor(name)
+        return value
+    value = field.to_python(value)
+    if value is None:
+        raise InvalidCursor(name)
+    if isinstance(value, datetime.datetime) and settings.USE_TZ and timezone.is_naive(value):
+        # We only ever write aware datetimes, and a naive one can't be compared with them
+        raise InvalidCursor(name)
+    return value
+
+
+def _pack(data):
+    raw = json.dumps(data, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _unpack(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def encode_cursor(keys, obj, direction):
+    values = [_encode_value(getattr(obj, name)) for name, _ in keys]
+    return _pack({"d": direction, "v": values})
+
+
+def decode_cursor(model, keys, cursor):
+    """
+    Returns (direction, values). Raises InvalidCursor for anything we didn't issue.
+    """
+    data = _unpack(cursor)
+    try:
+        direction, values = data["d"], data["v"]
+    except (KeyError, TypeError):
+        raise InvalidCursor(cursor)
+    if direction not in ("next", "prev") or not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor(cursor)
+    try:
+        return direction, [_decode_value(model, name, value) for (name, _), value in zip(keys, values)]
+    except (ArithmeticError, ValidationError, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def encode_position(snapshot, offset):
+    return _pack({"s": snapshot, "o": offset})
+
+
+def decode_position(cursor):
+    """
+    Returns (snapshot, offset) from a cursor made by encode_position. Raises
+    InvalidCursor for anything we didn't issue.
+    """
+    data = _unpack(cursor)
+    try:
+        snapshot, offset = data["s"], data["o"]
+    except (KeyError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(snapshot, str) or isinstance(offset, bool) or not isinstance(offset, int) or offset < 0:
+        raise InvalidCursor(cursor)
+    return snapshot, offset
+
+
+def _seek(keys, values, forward):
+    """
+    WHERE clause for "rows strictly after `values`" in the given ordering
+    (or strictly before it if not `forward`).
+
+    The leading <=/>= on the first key is redundant with the OR chain but lets
+    SQLite turn it into an index range instead of checking every row.
+    """
+    def after(descending):
+        return "lt" if descending == forward else "gt"
+
+    first, first_desc = keys[0]
+    bound = Q(**{f"{first}__{after(first_desc)}e": values[0]})
+
+    chain, equal = Q(), Q()
+    for (name, descending), value in zip(keys, values):
+        chain |= equal & Q(**{f"{name}__{after(descending)}": value})
+        equal &= Q(**{name: value})
+    return bound & chain
+
+
+def paginate(qs, cursor=None, per_page=24):
+    """
+    Fetch one page of `qs` (which must be ordered, ending with id) starting from
+    `cursor`. Only ever reads per_page + 1 rows.
+    """
+    keys = _ordering(qs)
+    direction, values = ("next", None)
+    if cursor:
+        direction, values = decode_cursor(qs.model, keys, cursor)
+
+    forward = direction == "next"
+    page_qs = qs
+    if values is not None:
+        page_qs = page_qs.filter(_seek(keys, values, forward))
+    if not forward:
+        page_qs = page_qs.reverse()
+
+    rows = list(page_qs[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage([])
+
+    # Coming from a cursor means there is something on the other side of it.
+    more_after = has_more if forward else values is not None
+    more_before = values is not None if forward else has_more
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(keys, rows[-1], "next") if more_after else None,
+        previous_cursor=encode_cursor(keys, rows[0], "prev") if more_before else None,
+    )
+
+
+def paginate_snapshot(qs, ids, snapshot, offset=0, per_page=24):
+    """
+    One page of `ids`, a result list fixed in advance (e.g. ranked search
+    results), read from `qs` in that order. Cursors are positions in the list,
+    named `snapshot` so the caller can find the list again. Rows that have
+    dropped out of `qs` since are skipped, nothing else moves.
+    """
+    page_ids = ids[offset:offset + per_page]
+    by_id = qs.in_bulk(page_ids)
+    rows = [by_id[pk] for pk in page_ids if pk in by_id]
+    more_after = offset + per_page < len(ids)
+    return KeysetPage(
+        rows,
+        next_cursor=encode_position(snapshot, offset + per_page) if more_after else None,
+        previous_cursor=encode_position(snapshot, max(offset - per_page, 0)) if offset else None,
+    )
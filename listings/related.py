@@ -0,0 +1,311 @@
+"""
+Content-based "related listings".
+
+Titles and descriptions are turned into TF-IDF vectors with NumPy and
+L2-normalized, so a dot product is the cosine similarity. `build()` scores every
+listing against every other one in row chunks (a chunk x n matrix product at a
+time, so memory stays bounded) and stores each listing's top neighbours in
+RelatedListing, which the detail page reads with one indexed query.
+
+The vocabulary, idf weights and vectors are saved next to the database
+(RELATED_LISTINGS_MODEL_PATH). Saving a listing does nothing here: scoring is
+O(listings x vocabulary), too slow for a request. Instead `update()` (run
+`build_related_listings --changed` every few minutes) loads the saved model,
+scores the listings added or edited since it was written, drops deleted ones
+and writes it back, so there is one copy of the model and it survives restarts.
+A periodic full `build_related_listings` refreshes the vocabulary.
+"""
+import math
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Listing, RelatedListing
+
+WORD_RE = re.compile(r"[^\W\d_]{2,}")
+
+# Neighbours stored per listing (the page shows fewer, sold ones are skipped at read time)
+TOP_K = 8
+MAX_FEATURES = 2048
+# Ignore words that appear in more than this share of listings ("the", "for", "good", ...)
+MAX_DOC_FREQUENCY = 0.5
+CHUNK_SIZE = 512
+# Title words count this many times over description words
+TITLE_BOOST = 3
+# update() looks back this much further than the last run, for saves that committed late
+CHANGED_OVERLAP = timedelta(minutes=1)
+
+
+def tokenize(title, description):
+    words = WORD_RE.findall(title.lower()) * TITLE_BOOST
+    words += WORD_RE.findall((description or "").lower())
+    return words
+
+
+class Model:
+    """
+    Vocabulary, idf weights and one normalized row per listing id.
+
+    Rows live in a preallocated matrix that doubles when full, so adding a
+    listing doesn't copy every vector; rows of deleted listings (id -1) are
+    reused. Only the first `size` rows are in use.
+    """
+    def __init__(self, vocabulary, idf, ids, matrix, built_at=None):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.ids = ids
+        self.matrix = matrix
+        self.size = len(ids)
+        # Listings changed since this time aren't in the model yet (see update())
+        self.built_at = built_at
+        self.rows = {int(pk): i for i, pk in enumerate(ids) if pk >= 0}
+        self.free = [i for i, pk in enumerate(ids) if pk < 0]
+
+    @classmethod
+    def fit(cls, rows):
+        """
+        Build a model from (id, title, description) rows.
+        """
+        ids = np.array([pk for pk, _, _ in rows], dtype=np.int64)
+        docs = [Counter(tokenize(title, description)) for _, title, description in rows]
+
+        df = Counter()
+        for doc in docs:
+            df.update(doc.keys())
+        limit = max(1, int(len(docs) * MAX_DOC_FREQUENCY)) if len(docs) > 2 else len(docs)
+        terms = [term for term, n in df.most_common() if n <= limit][:MAX_FEATURES]
+        vocabulary = {term: i for i, term in enumerate(sorted(terms))}
+
+        idf = np.zeros(len(vocabulary), dtype=np.float32)
+        for term, col in vocabulary.items():
+            idf[col] = math.log((1 + len(docs)) / (1 + df[term])) + 1
+
+        model = cls(vocabulary, idf, ids, np.zeros((len(docs), len(vocabulary)), dtype=np.float32))
+        for i, doc in enumerate(docs):
+            model.matrix[i] = model.vectorize_counts(doc)
+        return model
+
+    @property
+    def vectors(self):
+        """
+        The rows in use (a view, not a copy).
+        """
+        return self.matrix[:self.size]
+
+    def vectorize_counts(self, counts):
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for term, n in counts.items():
+            col = self.vocabulary.get(term)
+            if col is not None:
+                vector[col] = 1 + math.log(n)
+        vector *= self.idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def vectorize(self, title, description):
+        return self.vectorize_counts(Counter(tokenize(title, description)))
+
+    def _grow(self):
+        capacity = max(16, len(self.matrix) * 2)
+        matrix = np.zeros((capacity, self.matrix.shape[1]), dtype=np.float32)
+        matrix[:self.size] = self.vectors
+        ids = np.full(capacity, -1, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        self.matrix, self.ids = matrix, ids
+
+    def set_row(self, pk, vector):
+        row = self.rows.get(pk)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                if self.size == len(self.matrix):
+                    self._grow()
+                row = self.size
+                self.size += 1
+            self.rows[pk] = row
+            self.ids[row] = pk
+        self.matrix[row] = vector
+
+    def forget(self, pk):
+        row = self.rows.pop(pk, None)
+        if row is not None:
+            self.matrix[row] = 0
+            self.ids[row] = -1
+            self.free.append(row)
+
+    def neighbours(self, start, stop, k=TOP_K):
+        """
+        Top-k (row, [(other_row, score), ...]) for rows start..stop, one matrix product for the chunk.
+        """
+        scores = self.matrix[start:stop] @ self.vectors.T
+        chunk_rows = np.arange(start, stop)
+        scores[chunk_rows - start, chunk_rows] = -1  # never your own neighbour
+        k = min(k, scores.shape[1] - 1)
+        if k <= 0:
+            return
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for offset, cols in enumerate(best):
+            row_scores = scores[offset, cols]
+            order = np.argsort(-row_scores)
+            yield start + offset, [(int(cols[j]), float(row_scores[j])) for j in order if row_scores[j] > 0]
+
+    def save(self, path):
+        """
+        Write the model to `path`, replacing the old file in one step so a
+        reader never sees half of it.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        terms = np.array(sorted(self.vocabulary, key=self.vocabulary.get), dtype=str)
+        built_at = self.built_at.timestamp() if self.built_at else 0.0
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, terms=terms, idf=self.idf, ids=self.ids[:self.size], matrix=self.vectors,
+                         built_at=np.float64(built_at))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            vocabulary = {str(term): i for i, term in enumerate(data["terms"])}
+            built_at = float(data["built_at"]) if "built_at" in data else 0.0
+            return cls(
+                vocabulary, data["idf"], data["ids"], data["matrix"],
+                built_at=datetime.fromtimestamp(built_at, tz=dt_timezone.utc) if built_at else None,
+            )
+
+
+def _model_path():
+    return settings.RELATED_LISTINGS_MODEL_PATH
+
+
+def load_model():
+    """
+    The saved model, or None before the first build().
+    """
+    path = Path(_model_path())
+    return Model.load(path) if path.exists() else None
+
+
+def build(chunk_size=CHUNK_SIZE):
+    """
+    Recompute every listing's neighbours from scratch. Returns the number of listings scored.
+    """
+    started = timezone.now()
+    rows = list(Listing.objects.order_by("id").values_list("id", "title", "description"))
+    model = Model.fit(rows)
+    model.built_at = started
+
+    entries = []
+    for start in range(0, len(rows), chunk_size):
+        for row, neighbours in model.neighbours(start, min(start + chunk_size, len(rows))):
+            entries.extend(
+                RelatedListing(listing_id=int(model.ids[row]), related_id=int(model.ids[other]), score=score)
+                for other, score in neighbours
+            )
+
+    with transaction.atomic():
+        RelatedListing.objects.all().delete()
+        RelatedListing.objects.bulk_create(entries, batch_size=1000)
+
+    model.save(_model_path())
+    return len(rows)
+
+
+def update(chunk_size=CHUNK_SIZE):
+    """
+    Bring the saved model and RelatedListing up to date with the listings
+    added, edited or deleted since the model was written, and save it again.
+    Runs build() if there is no model yet. Returns the number of listings scored.
+    """
+    model = load_model()
+    if model is None:
+        return build(chunk_size)
+    started = timezone.now()
+
+    # Their RelatedListing rows went with them (CASCADE), only the vectors are left
+    alive = set(Listing.objects.values_list("pk", flat=True))
+    for pk in [pk for pk in model.rows if pk not in alive]:
+        model.forget(pk)
+
+    qs = Listing.objects.order_by("id")
+    if model.built_at:
+        qs = qs.filter(updated_at__gte=model.built_at - CHANGED_OVERLAP)
+    changed = []
+    for pk, title, description in qs.values_list("id", "title", "description").iterator():
+        vector = model.vectorize(title, description)
+        row = model.rows.get(pk)
+        # Price changes, sales etc. bump updated_at too; only new text needs scoring
+        if row is not None and np.array_equal(model.matrix[row], vector):
+            continue
+        model.set_row(pk, vector)
+        changed.append(pk)
+
+    # Chunk x n matrix products, as in build()
+    for start in range(0, len(changed), chunk_size):
+        chunk = changed[start:start + chunk_size]
+        scores = model.matrix[[model.rows[pk] for pk in chunk]] @ model.vectors.T
+        for pk, row_scores in zip(chunk, scores):
+            row_scores[model.rows[pk]] = -1
+            _rescore(model, pk, row_scores)
+
+    model.built_at = started
+    model.save(_model_path())
+    return len(changed)
+
+
+def _rescore(model, pk, scores):
+    """
+    Replace one listing's neighbours and slot it into other listings' lists
+    where it now belongs. `scores` are its similarities to every model row.
+    """
+    # Best candidates in both directions: its neighbours, and listings it may now neighbour
+    count = min(len(scores) - 1, TOP_K * 4)
+    if count <= 0:
+        return
+    best = np.argpartition(-scores, count - 1)[:count]
+    scored = {int(model.ids[i]): float(scores[i]) for i in best if scores[i] > 0}
+    alive = set(Listing.objects.filter(pk__in=[pk, *scored]).values_list("pk", flat=True))
+    if pk not in alive:
+        return
+    scored = {other: score for other, score in scored.items() if other in alive}
+
+    current = {}
+    for owner, related, score in RelatedListing.objects.filter(listing_id__in=scored).exclude(
+        related_id=pk
+    ).values_list("listing_id", "related_id", "score"):
+        current.setdefault(owner, []).append((score, related))
+
+    entries = [
+        RelatedListing(listing_id=pk, related_id=other, score=score)
+        for other, score in sorted(scored.items(), key=lambda item: -item[1])[:TOP_K]
+    ]
+    dropped = []
+    for owner, score in scored.items():
+        theirs = sorted(current.get(owner, []), reverse=True)
+        if len(theirs) < TOP_K:
+            entries.append(RelatedListing(listing_id=owner, related_id=pk, score=score))
+        elif score > theirs[-1][0]:
+            entries.append(RelatedListing(listing_id=owner, related_id=pk, score=score))
+            dropped.append((owner, theirs[-1][1]))
+
+    with transaction.atomic():
+        # Its old scores (in both directions) are stale now that the text changed
+        RelatedListing.objects.filter(listing_id=pk).delete()
+        RelatedListing.objects.filter(related_id=pk).delete()
+        for owner, related in dropped:
+            RelatedListing.objects.filter(listing_id=owner, related_id=related).delete()
+        RelatedListing.objects.bulk_create(entries)
@@ -0,0 +1,99 @@
+"""
+Full-text search for listings.
+
+Titles and descriptions are indexed in an SQLite FTS5 table that points back at
+listings_listing (external content), so the text is only stored once. Triggers on
+listings_listing keep it in sync on insert/update/delete, which also covers
+QuerySet.update() and bulk_create() where model signals would not fire (fts.py).
+Other database backends fall back to the old icontains filter.
+"""
+import re
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import cache as listing_cache
+from .fts import FTSIndex, is_supported, match_expression
+from .models import Listing
+from .pagination import InvalidCursor, decode_position, paginate, paginate_snapshot
+
+# Title hits count for a lot more than a word buried in the description.
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+index = FTSIndex(Listing, "listings_listing_fts", ["title", "description"])
+FTS_TABLE = index.name
+install, uninstall, rebuild = index.install, index.uninstall, index.rebuild
+
+# Ranked ids per (query, category, listings generation), see search_page().
+# Long enough to outlive the cached first page that links to it (cache.RESULTS_TIMEOUT).
+SNAPSHOT_TIMEOUT = 60 * 30
+# Nobody pages past this many results (40 pages), refine the search instead
+SNAPSHOT_SIZE = 1000
+SNAPSHOT_PREFIX = "listings:search:"
+SNAPSHOT_RE = re.compile(r"\d+:[0-9a-f]{32}")
+
+
+def filter_matches(qs, query):
+    """
+    Narrow a Listing queryset down to the matches for `query` without ranking
+    them, e.g. for counts and aggregates.
+    """
+    if not is_supported():
+        return qs.filter(Q(title__icontains=query) | Q(description__icontains=query))
+    expression = match_expression(query)
+    if not expression:
+        return qs.none()
+    return qs.filter(id__in=index.matches(expression))
+
+
+def search(qs, query):
+    """
+    Narrow a Listing queryset down to the matches for `query`, best match first.
+
+    On SQLite the rows get a `search_rank` annotation (bm25, lower is better) and
+    the candidate ids come straight from the FTS index instead of a table scan.
+    Any filters already on `qs` (is_sold, category, ...) still apply.
+    """
+    if not is_supported():
+        return filter_matches(qs, query).order_by("-created_at", "-id")
+
+    expression = match_expression(query)
+    if not expression:
+        return qs.none()
+
+    return (
+        qs.filter(id__in=index.matches(expression))
+        .annotate(search_rank=index.rank(expression, (TITLE_WEIGHT, DESCRIPTION_WEIGHT)))
+        .order_by("search_rank", "-created_at", "-id")
+    )
+
+
+def search_page(qs, query, category_id, cursor=None, per_page=24):
+    """
+    One page of search results for `query` within `qs`, best match first.
+
+    bm25 scores shift every time a listing is added or edited, so a cursor that
+    seeks on the rank would repeat or skip rows. Instead the first page ranks all
+    the matches once and caches the ids under the current listings generation;
+    cursors are positions in that list, so paging carries on through the same
+    results however the index changes meanwhile. New matches show up on a fresh
+    search. Raises InvalidCursor if the cursor is bad or its list has expired.
+    """
+    if not is_supported():
+        return paginate(search(qs, query), cursor, per_page=per_page)
+
+    if cursor:
+        snapshot, offset = decode_position(cursor)
+        ids = cache.get(SNAPSHOT_PREFIX + snapshot) if SNAPSHOT_RE.fullmatch(snapshot) else None
+        if ids is None:
+            raise InvalidCursor(cursor)
+    else:
+        # Key first, like cache.results_key: a change meanwhile files this under the old generation
+        key = listing_cache.make_key("search", listing_cache.normalize_query(query), category_id or "")
+        snapshot, offset = key[len(SNAPSHOT_PREFIX):], 0
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(search(qs, query).values_list("id", flat=True)[:SNAPSHOT_SIZE])
+            cache.set(key, ids, SNAPSHOT_TIMEOUT)
+    return paginate_snapshot(qs, ids, snapshot, offset, per_page=per_page)
@@ -0,0 +1,106 @@
+"""
+Content-addressed storage for listing images.
+
+Each upload is stored under the SHA-256 of its bytes,
+
+    item_images/3f/3fa4...c2.jpg
+
+so the same photo uploaded twice (re-saving it on the edit form, or one photo on
+several listings) is written once and shared. The hash is normally computed
+while the upload streams in (uploads.py), otherwise from the file here.
+
+Files are shared, so they are only deleted once no Listing points at them any
+more: the receivers in models.py call release() after a listing's image changes
+or the listing is deleted. save() may hand out an existing file that release()
+is about to delete, so both run under image_lock(): release() checks and deletes
+in one go, and Listing.save() stores a new image and commits the row in one go.
+"""
+import hashlib
+import posixpath
+from contextlib import contextmanager
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def file_digest(content):
+    digest = getattr(content, "sha256", None)
+    if digest:
+        return digest
+    sha = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def content_name(self, name, digest):
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], f"{digest}{extension}")
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.content_name(name, file_digest(content))
+        if self.exists(name):
+            # Already have these exact bytes
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def save_derived(self, name, content):
+        """
+        Write a file under exactly `name`, replacing what was there. For files
+        derived from a stored image (e.g. thumbnails), which are keyed on its name.
+        """
+        if self.exists(name):
+            self.delete(name)
+        return super().save(name, content)
+
+
+listing_image_storage = ContentAddressedStorage()
+
+
+def get_listing_image_storage():
+    return listing_image_storage
+
+
+@contextmanager
+def image_lock():
+    """
+    A transaction that holds the database write lock from the start, so only
+    one release() or image save runs at a time.
+    """
+    from .models import Listing
+
+    with transaction.atomic():
+        # SQLite's BEGIN is deferred; any UPDATE, even one matching no rows, takes the write lock
+        Listing.objects.filter(pk=0).update(image="")
+        yield
+
+
+def release(*names):
+    """
+    Delete images (and their resized variants) no listing uses any more.
+    """
+    from . import thumbnails
+    from .models import Listing
+
+    names = {name for name in names if name}
+    if not names:
+        return
+    with image_lock():
+        # Indexed (Listing.image)
+        names -= set(Listing.objects.filter(image__in=names).values_list("image", flat=True))
+        storage = listing_image_storage
+        for name in names:
+            thumbnails.delete_variants(storage, name)
+            if storage.exists(name):
+                storage.delete(name)
@@ -0,0 +1,52 @@
+from django import template
+from django.utils.html import format_html
+
+from listings.thumbnails import variant_name
+
+register = template.Library()
+
+# Width used for the plain src when the browser ignores srcset
+FALLBACK_WIDTH = 640
+
+
+def _srcset(storage, name, widths, fmt):
+    return ", ".join(f"{storage.url(variant_name(name, w, fmt))} {w}w" for w in widths)
+
+
+@register.simple_tag
+def listing_image(listing, sizes="100vw", css_class="", loading="lazy"):
+    """
+    <img> for a listing's image, using its resized WebP/JPEG variants when they exist:
+
+        {% listing_image l sizes="(min-width: 1024px) 25vw, 100vw" css_class="w-full h-full object-cover" %}
+
+    Only uses what is stored on the listing (variants, dimensions, colour), so it
+    never touches the filesystem.
+    """
+    image = listing.image
+    if not image:
+        return ""
+    # Stored dimensions and colour let the browser reserve the box before the bytes arrive
+    attrs = format_html(
+        'alt="{}" class="{}" loading="{}" decoding="async"', listing.title, css_class, loading
+    )
+    if listing.image_width and listing.image_height:
+        attrs += format_html(' width="{}" height="{}"', listing.image_width, listing.image_height)
+    if listing.image_color:
+        attrs += format_html(' style="background-color: {}"', listing.image_color)
+
+    widths = sorted(listing.image_variants or [])
+    if not widths:
+        return format_html('<img src="{}" {}>', image.url, attrs)
+
+    storage, name = image.storage, image.name
+    fallback = next((w for w in widths if w >= FALLBACK_WIDTH), widths[-1])
+    return format_html(
+        '<picture class="contents">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" {}>'
+        '</picture>',
+        _srcset(storage, name, widths, "webp"), sizes,
+        storage.url(variant_name(name, fallback, "jpeg")), _srcset(storage, name, widths, "jpeg"), sizes,
+        attrs,
+    )
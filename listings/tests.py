@@ -1,7 +1,34 @@
-from django.test import TestCase, Client
+import base64
+import contextlib
+import hashlib
+import json
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs
+
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
-from listings.models import Category, Listing
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.signals import post_migrate
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from listings.models import Category, Listing, RelatedListing, TitleTrigram
+from listings import cache as listing_cache
+from listings import autocomplete, counters, fuzzy, related, search, thumbnails
+from listings.autocomplete import PrefixIndex, suggestions
+from listings.facets import category_counts
+from listings.pagination import InvalidCursor, decode_cursor, paginate
+from listings import storage as storage_module
+from listings.storage import ContentAddressedStorage, file_digest
+from listings.templatetags.listing_images import listing_image
 
 
 class CategoryTests(TestCase):
@@ -61,6 +88,588 @@ class IndexViewTests(TestCase):
         self.assertNotIn(book, response.context['listings'])
 
 
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Furniture')
+
+    def make(self, title, description='', **kwargs):
+        kwargs.setdefault('category', self.category)
+        return Listing.objects.create(
+            title=title, description=description, price=10, seller=self.user, **kwargs
+        )
+
+    def results(self, query, qs=None):
+        return list(search.search(qs if qs is not None else Listing.objects.all(), query))
+
+    def test_title_match_ranks_above_description_match(self):
+        mention = self.make('Bookshelf', 'Fits next to a desk nicely')
+        desk = self.make('Standing desk', 'Adjustable height')
+        self.assertEqual(self.results('desk'), [desk, mention])
+
+    def test_prefix_and_multiple_words(self):
+        lamp = self.make('Desk lamp', 'LED')
+        self.make('Desk', 'Oak')
+        self.assertEqual(self.results('des lam'), [lamp])
+
+    def test_punctuation_does_not_break_query(self):
+        chair = self.make('Chair', 'Comfy')
+        self.assertEqual(self.results('"chair" ('), [chair])
+        self.assertEqual(self.results('!!!'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        listing = self.make('Futon', 'Blue')
+        listing.title = 'Sofa bed'
+        listing.save()
+        self.assertEqual(self.results('futon'), [])
+        self.assertEqual(self.results('sofa'), [listing])
+
+        listing.delete()
+        self.assertEqual(self.results('sofa'), [])
+
+    def test_combines_with_other_filters(self):
+        books = Category.objects.create(name='Books')
+        self.make('Lamp', is_sold=True)
+        wanted = self.make('Lamp')
+        self.make('Lamp', category=books)
+        qs = Listing.objects.filter(is_sold=False, category=self.category)
+        self.assertEqual(self.results('lamp', qs), [wanted])
+
+    def test_rebuild_command(self):
+        listing = self.make('Mini fridge')
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) VALUES ('delete-all')")
+        self.assertEqual(self.results('fridge'), [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.results('fridge'), [listing])
+
+    def test_migrate_puts_dropped_triggers_back(self):
+        # What a table rebuild during migrate does to the triggers (fts.py)
+        with connection.cursor() as cursor:
+            for statement in search.index.drop_statements[:-1]:
+                cursor.execute(statement)
+        listing = self.make('Mini fridge')
+        self.assertEqual(self.results('fridge'), [])
+
+        app_config = django_apps.get_app_config('listings')
+        post_migrate.send(
+            sender=app_config, app_config=app_config, verbosity=0, interactive=False, using='default',
+            apps=django_apps, plan=[],
+        )
+        self.assertEqual(self.results('fridge'), [listing])
+
+
+def tampered_cursor(*values):
+    raw = json.dumps({'d': 'next', 'v': list(values)})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+@mock.patch('listings.views.LISTINGS_PER_PAGE', 2)
+class PaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Furniture')
+        self.listings = [
+            Listing.objects.create(title=f'Chair {i}', price=10, category=self.category, seller=self.user)
+            for i in range(5)
+        ]
+        # Same timestamp everywhere so only the id tie-breaker decides the order
+        Listing.objects.update(created_at=timezone.now())
+        self.newest_first = sorted(self.listings, key=lambda l: -l.pk)
+
+    def get(self, **params):
+        return self.client.get(reverse('listings:index'), params)
+
+    def follow(self, page_query):
+        return self.get(**{k: v[0] for k, v in parse_qs(page_query).items()})
+
+    def test_walks_all_pages_in_order(self):
+        seen = []
+        response = self.get()
+        while True:
+            seen.extend(response.context['listings'])
+            if not response.context['page'].has_next:
+                break
+            response = self.follow(response.context['next_page_query'])
+        self.assertEqual(seen, self.newest_first)
+
+    def test_new_listings_do_not_shift_later_pages(self):
+        first = self.get()
+        Listing.objects.create(title='Chair new', price=10, category=self.category, seller=self.user)
+        second = self.follow(first.context['next_page_query'])
+        self.assertEqual(list(second.context['listings']), self.newest_first[2:4])
+
+    def test_previous_page(self):
+        second = self.follow(self.get().context['next_page_query'])
+        back = self.follow(second.context['previous_page_query'])
+        self.assertEqual(list(back.context['listings']), self.newest_first[:2])
+        self.assertFalse(back.context['page'].has_previous)
+
+    def test_keeps_search_and_category(self):
+        response = self.get(q='chair', category=self.category.id)
+        params = parse_qs(response.context['next_page_query'])
+        self.assertEqual(params['q'], ['chair'])
+        self.assertEqual(params['category'], [str(self.category.id)])
+
+        second = self.follow(response.context['next_page_query'])
+        self.assertEqual(len(second.context['listings']), 2)
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        response = self.get(cursor='not-a-cursor')
+        self.assertEqual(list(response.context['listings']), self.newest_first[:2])
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        created_at = self.listings[0].created_at.isoformat()
+        for bad in ('abc', [1], None):
+            with self.subTest(id=bad):
+                response = self.get(cursor=tampered_cursor(created_at, bad))
+                self.assertEqual(list(response.context['listings']), self.newest_first[:2])
+                # Search pages also carry the rank
+                response = self.get(q='chair', cursor=tampered_cursor(bad, created_at, self.listings[0].pk))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['listings']), 2)
+        response = self.get(cursor=tampered_cursor('2024-01-01T00:00:00', self.listings[0].pk))
+        self.assertEqual(list(response.context['listings']), self.newest_first[:2])
+
+    def test_decode_rejects_non_numeric_rank(self):
+        keys = [('search_rank', False), ('id', True)]
+        for bad in ('abc', True, None, float('nan')):
+            with self.subTest(rank=bad):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(Listing, keys, tampered_cursor(bad, 1))
+        self.assertEqual(decode_cursor(Listing, keys, tampered_cursor(-1.5, '7')), ('next', [-1.5, 7]))
+
+    def test_search_pages_stable_under_inserts(self):
+        for i in range(5):
+            Listing.objects.create(
+                title=f'Chair {"chair " * i}', description='chair', price=10, category=self.category, seller=self.user
+            )
+        expected = list(search.search(Listing.objects.filter(is_sold=False), 'chair').values_list('id', flat=True))
+        seen = []
+        response = self.get(q='chair')
+        while True:
+            seen.extend(l.pk for l in response.context['listings'])
+            # New matches shift every bm25 score, and would outrank some of what is left
+            for i in range(8):
+                Listing.objects.create(
+                    title='Chair chair chair chair chair', price=10, category=self.category, seller=self.user
+                )
+            if not response.context['page'].has_next:
+                break
+            response = self.follow(response.context['next_page_query'])
+        self.assertEqual(seen, expected)
+
+        back = self.follow(response.context['previous_page_query'])
+        self.assertEqual([l.pk for l in back.context['listings']], expected[6:8])
+
+    def test_expired_search_cursor_starts_over(self):
+        first = self.get(q='chair')
+        cache.clear()
+        second = self.follow(first.context['next_page_query'])
+        self.assertFalse(second.context['page'].has_previous)
+        self.assertEqual(len(second.context['listings']), 2)
+
+    def test_ranked_search_pages(self):
+        qs = search.search(Listing.objects.all(), 'chair')
+        first = paginate(qs, per_page=3)
+        second = paginate(qs, first.next_cursor, per_page=3)
+        self.assertEqual(len(first) + len(second), 5)
+        self.assertFalse(set(first) & set(second))
+        self.assertFalse(second.has_next)
+
+
+class FacetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.furniture = Category.objects.create(name='Furniture')
+        self.books = Category.objects.create(name='Books')
+        for title in ('Desk', 'Desk lamp', 'Chair'):
+            Listing.objects.create(title=title, price=10, category=self.furniture, seller=self.user)
+        Listing.objects.create(title='Desk manual', price=5, category=self.books, seller=self.user)
+        Listing.objects.create(title='Old desk', price=5, category=self.books, seller=self.user, is_sold=True)
+
+    def test_counts_unsold_per_category(self):
+        self.assertEqual(category_counts(), {self.furniture.id: 3, self.books.id: 1})
+
+    def test_restricted_to_query(self):
+        self.assertEqual(category_counts('desk'), {self.furniture.id: 2, self.books.id: 1})
+
+    def test_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            category_counts('desk')
+        with self.assertNumQueries(0):
+            category_counts('  DESK ')
+
+    def test_invalidated_by_save_and_delete(self):
+        category_counts()
+        chair = Listing.objects.get(title='Chair')
+        chair.is_sold = True
+        chair.save()
+        self.assertEqual(category_counts()[self.furniture.id], 2)
+
+        Listing.objects.get(title='Desk manual').delete()
+        self.assertNotIn(self.books.id, category_counts())
+
+    def test_sidebar_shows_counts(self):
+        response = self.client.get(reverse('listings:index'))
+        self.assertContains(response, '(3)')
+        categories = {c.id: c.listing_count for c in response.context['categories']}
+        self.assertEqual(categories[self.books.id], 1)
+
+
+class ResultCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Furniture')
+        self.desk = Listing.objects.create(title='Desk', price=10, category=self.category, seller=self.user)
+
+    def browse(self, **params):
+        return self.client.get(reverse('listings:index'), params)
+
+    def test_repeat_query_is_a_hit(self):
+        self.browse(q='desk', category=self.category.id)
+        response = self.browse(q=' Desk', category=self.category.id)
+        self.assertEqual(list(response.context['listings']), [self.desk])
+        self.assertEqual(listing_cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_sold_listing_is_never_served(self):
+        self.browse(q='desk')
+        self.desk.is_sold = True
+        self.desk.save()
+        self.assertEqual(list(self.browse(q='desk').context['listings']), [])
+        self.assertEqual(listing_cache.stats()['hits'], 0)
+
+    def test_sale_via_update_is_filtered_on_hit(self):
+        self.browse()
+        Listing.objects.filter(pk=self.desk.pk).update(is_sold=True)
+        self.assertEqual(list(self.browse().context['listings']), [])
+        self.assertEqual(listing_cache.stats()['hits'], 1)
+
+    def test_new_listing_invalidates(self):
+        self.browse()
+        chair = Listing.objects.create(title='Chair', price=10, category=self.category, seller=self.user)
+        self.assertIn(chair, self.browse().context['listings'])
+
+    def test_stats_command(self):
+        # The command only reads counters from a cache other processes share
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }):
+            self.browse()
+            out = StringIO()
+            call_command('listing_cache_stats', '--reset', stdout=out)
+            self.assertIn('misses=1', out.getvalue())
+            self.assertEqual(listing_cache.stats()['misses'], 0)
+
+    def test_stats_command_refuses_per_process_cache(self):
+        with self.assertRaises(CommandError):
+            call_command('listing_cache_stats', stdout=StringIO())
+
+    def test_stats_view_is_staff_only(self):
+        self.browse()
+        self.client.login(username='user', password='pass')
+        self.assertEqual(self.client.get(reverse('listings:cache_stats')).status_code, 302)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get(reverse('listings:cache_stats'))
+        self.assertEqual(response.json(), {'hits': 0, 'misses': 1, 'hit_rate': 0.0})
+
+
+class FuzzySearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Electronics')
+        self.calculator = Listing.objects.create(
+            title='TI-84 graphing calculator', price=60, category=self.category, seller=self.user
+        )
+        self.mattress = Listing.objects.create(
+            title='Twin XL mattress', price=40, category=self.category, seller=self.user
+        )
+
+    def test_similarity(self):
+        self.assertGreater(fuzzy.similarity('calculater', 'TI-84 graphing calculator'), 0.5)
+        self.assertLess(fuzzy.similarity('calculater', 'Twin XL mattress'), fuzzy.THRESHOLD)
+
+    def test_finds_misspelled_titles(self):
+        self.assertEqual(fuzzy.fuzzy_ids('calculater'), [self.calculator.pk])
+        self.assertEqual(fuzzy.fuzzy_ids('mattres'), [self.mattress.pk])
+
+    def test_only_unsold_in_category(self):
+        self.mattress.is_sold = True
+        self.mattress.save()
+        self.assertEqual(fuzzy.fuzzy_ids('mattres'), [])
+        other = Category.objects.create(name='Books')
+        self.assertEqual(fuzzy.fuzzy_ids('calculater', other.id), [])
+
+    def test_index_follows_title_edits(self):
+        self.calculator.title = 'Scientific calculator'
+        self.calculator.save()
+        grams = set(TitleTrigram.objects.filter(listing=self.calculator).values_list('trigram', flat=True))
+        self.assertEqual(grams, fuzzy.trigrams('Scientific calculator'))
+
+    def test_browse_falls_back_only_without_exact_matches(self):
+        response = self.client.get(reverse('listings:index'), {'q': 'calculater'})
+        self.assertTrue(response.context['fuzzy'])
+        self.assertEqual(list(response.context['listings']), [self.calculator])
+        self.assertContains(response, 'No exact matches')
+
+        response = self.client.get(reverse('listings:index'), {'q': 'calculator'})
+        self.assertFalse(response.context['fuzzy'])
+
+    def test_candidates_come_from_the_index(self):
+        qs = TitleTrigram.objects.filter(trigram__in=fuzzy.trigrams('mattres'), listing__is_sold=False)
+        sql, params = qs.values('listing_id').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[3] for row in cursor.fetchall()]
+        self.assertNotIn('SCAN listings_titletrigram', plan)
+
+    def test_rebuild_command_restores_trigrams(self):
+        TitleTrigram.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(fuzzy.fuzzy_ids('mattres'), [self.mattress.pk])
+
+
+class PrefixIndexTests(TestCase):
+
+    def test_completes_from_any_word_start(self):
+        index = PrefixIndex()
+        index.add('desk lamp', 'Desk lamp')
+        self.assertEqual([c.text for c in index.lookup('la')], ['Desk lamp'])
+        self.assertEqual([c.text for c in index.lookup('DESK L')], ['Desk lamp'])
+        self.assertEqual(index.lookup('lamps'), [])
+
+    def test_heaviest_first_and_limit(self):
+        index = PrefixIndex(limit=2)
+        index.add('desk', 'Desk')
+        index.lookup('d')  # warm the cached top list
+        for _ in range(3):
+            index.add('dresser', 'Dresser')
+        index.add('drum', 'Drum')
+        self.assertEqual([c.text for c in index.lookup('d')], ['Dresser', 'Desk'])
+
+    def test_removal_updates_cached_tops(self):
+        index = PrefixIndex()
+        index.add('desk', 'Desk')
+        index.add('dresser', 'Dresser')
+        index.lookup('d')
+        index.remove('desk')
+        self.assertEqual([c.text for c in index.lookup('d')], ['Dresser'])
+
+
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        suggestions.reset()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Lab Equipment')
+        self.lamp = Listing.objects.create(title='Desk lamp', price=10, category=self.category, seller=self.user)
+
+    def get(self, prefix):
+        return self.client.get(reverse('listings:autocomplete'), {'q': prefix}).json()
+
+    def test_titles_and_categories(self):
+        self.assertEqual(self.get('lab'), {
+            'titles': [], 'categories': [{'id': self.category.id, 'name': 'Lab Equipment'}],
+        })
+        self.assertEqual(self.get('lam')['titles'], ['Desk lamp'])
+
+    def test_no_queries_once_loaded(self):
+        self.get('d')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('desk')['titles'], ['Desk lamp'])
+
+    def test_follows_listing_signals(self):
+        self.get('d')
+        with self.captureOnCommitCallbacks(execute=True):
+            Listing.objects.create(title='Dresser', price=10, category=self.category, seller=self.user)
+            self.lamp.is_sold = True
+            self.lamp.save()
+        self.assertEqual(self.get('d')['titles'], ['Dresser'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Listing.objects.get(title='Dresser').delete()
+            Category.objects.create(name='Drinkware')
+        self.assertEqual(self.get('dr'), {'titles': [], 'categories': [
+            {'id': Category.objects.get(name='Drinkware').id, 'name': 'Drinkware'},
+        ]})
+
+    def test_reload_keeps_serving_old_titles(self):
+        self.get('d')
+        suggestions.loaded_at -= autocomplete.AUTOCOMPLETE_MAX_AGE + 1
+        load = autocomplete._Titles.load
+        meanwhile = {}
+
+        def load_meanwhile():
+            loaded = load()
+            # Another request while this one reloads, then a sale committing before the swap
+            with self.assertNumQueries(0):
+                meanwhile['titles'] = suggestions.lookup('desk')[0]
+            self.lamp.is_sold = True
+            suggestions.listing_changed(self.lamp)
+            return loaded
+
+        with mock.patch.object(autocomplete._Titles, 'load', side_effect=load_meanwhile):
+            self.assertEqual(self.get('desk')['titles'], [])
+        self.assertEqual(meanwhile['titles'], ['Desk lamp'])
+        self.assertEqual(self.get('desk')['titles'], [])
+
+
+@override_settings(LISTING_VIEW_FLUSH_THREAD=False)
+class RelatedListingTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(RELATED_LISTINGS_MODEL_PATH=Path(tmp.name) / 'model.npz')
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Misc')
+        self.items = {}
+        for title, description in [
+            ('Oak desk', 'Solid wooden desk with drawers'),
+            ('Standing desk', 'Electric height adjustable desk'),
+            ('Road bike', 'Aluminium frame bike, new tires'),
+            ('Mountain bike', 'Front suspension bike'),
+            ('Rice cooker', 'Makes perfect rice'),
+        ]:
+            self.items[title] = Listing.objects.create(
+                title=title, description=description, price=10, category=self.category, seller=self.user
+            )
+
+    def neighbours(self, title):
+        return list(
+            RelatedListing.objects.filter(listing=self.items[title]).order_by('-score')
+            .values_list('related__title', flat=True)
+        )
+
+    def test_build_finds_similar_listings(self):
+        call_command('build_related_listings', stdout=StringIO())
+        self.assertEqual(self.neighbours('Oak desk'), ['Standing desk'])
+        self.assertEqual(self.neighbours('Road bike'), ['Mountain bike'])
+        self.assertEqual(self.neighbours('Rice cooker'), [])
+
+    def test_chunking_gives_the_same_result(self):
+        related.build(chunk_size=2)
+        chunked = sorted(RelatedListing.objects.values_list('listing_id', 'related_id'))
+        related.build()
+        self.assertEqual(chunked, sorted(RelatedListing.objects.values_list('listing_id', 'related_id')))
+
+    def test_detail_reads_precomputed_neighbours(self):
+        related.build()
+        response = self.client.get(reverse('listings:detail', kwargs={'pk': self.items['Road bike'].pk}))
+        self.assertEqual(list(response.context['related_listings']), [self.items['Mountain bike']])
+
+    def test_new_listing_is_scored_incrementally(self):
+        related.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            bmx = Listing.objects.create(
+                title='BMX bike', description='Great bike for tricks', price=80, category=self.category, seller=self.user
+            )
+        self.items['BMX bike'] = bmx
+        # Nothing is scored while saving, only by the periodic update
+        self.assertEqual(self.neighbours('BMX bike'), [])
+        call_command('build_related_listings', '--changed', stdout=StringIO())
+        self.assertEqual(set(self.neighbours('BMX bike')), {'Road bike', 'Mountain bike'})
+        self.assertIn('BMX bike', self.neighbours('Road bike'))
+
+    def test_edit_moves_listing(self):
+        related.build()
+        desk = self.items['Standing desk']
+        desk.title = 'Kids bike'
+        desk.description = 'Small bike'
+        desk.save()
+        self.assertEqual(related.update(), 1)
+        self.assertNotIn('Kids bike', self.neighbours('Oak desk'))
+        self.assertIn('Road bike', self.neighbours('Standing desk'))
+
+    def test_update_only_scores_changed_text(self):
+        related.build()
+        Listing.objects.filter(pk=self.items['Oak desk'].pk).update(price=20, updated_at=timezone.now())
+        self.assertEqual(related.update(), 0)
+
+    def test_update_is_saved(self):
+        related.build()
+        lamp = Listing.objects.create(title='Desk lamp', price=5, category=self.category, seller=self.user)
+        self.items['Oak desk'].delete()
+        related.update()
+        model = related.load_model()
+        self.assertIn(lamp.pk, model.rows)
+        self.assertNotIn(self.items['Oak desk'].pk, model.rows)
+        self.assertEqual(related.update(), 0)
+
+    def test_update_builds_when_there_is_no_model(self):
+        self.assertEqual(related.update(), 5)
+        self.assertEqual(self.neighbours('Road bike'), ['Mountain bike'])
+
+    def test_rows_grow_without_copying_each_time(self):
+        model = related.Model.fit([(1, 'Desk', ''), (2, 'Chair', '')])
+        for pk in range(3, 40):
+            model.set_row(pk, model.vectorize('Desk', ''))
+        self.assertEqual(model.size, 39)
+        self.assertEqual(len(model.matrix), 64)
+        row = model.rows[5]
+        model.forget(5)
+        model.set_row(99, model.vectorize('Chair', ''))
+        self.assertEqual(model.rows[99], row)
+        self.assertEqual(model.size, 39)
+
+
+class ApiTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='seller', password='pass')
+        self.category = Category.objects.create(name='Furniture')
+        self.desk = Listing.objects.create(
+            title='Desk', description='Oak', price='40.50', category=self.category, seller=self.user
+        )
+        Listing.objects.create(title='Chair', price=15, category=self.category, seller=self.user)
+        Listing.objects.create(title='Sold desk', price=5, category=self.category, seller=self.user, is_sold=True)
+
+    def get(self, **params):
+        response = self.client.get(reverse('listings:api'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))['results']
+
+    def test_default_fields(self):
+        results = self.get()
+        self.assertEqual([r['title'] for r in results], ['Chair', 'Desk'])
+        self.assertEqual(set(results[0]), {'id', 'title', 'price', 'category', 'created_at'})
+
+    def test_field_projection_only_fetches_those_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            results = self.get(fields='title,price,seller', q='desk')
+        self.assertEqual(results, [{'title': 'Desk', 'price': '40.50', 'seller': 'seller'}])
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('"description"', sql.split(' FROM ')[0])
+
+    def test_category_filter(self):
+        other = Category.objects.create(name='Books')
+        self.assertEqual(self.get(category=other.id), [])
+
+    def test_chunks_join_into_valid_json(self):
+        with mock.patch('listings.views.API_CHUNK_SIZE', 1):
+            results = self.get(fields='id')
+        self.assertEqual(len(results), 2)
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('listings:api'), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['error'])
+
+
+@override_settings(LISTING_VIEW_FLUSH_THREAD=False)
 class DetailViewTests(TestCase):
     
     def setUp(self):
@@ -79,6 +688,312 @@ class DetailViewTests(TestCase):
         self.assertIn(related, response.context['related_listings'])
 
 
+@override_settings(LISTING_VIEW_FLUSH_THREAD=False)
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Bikes')
+        self.listing = Listing.objects.create(
+            title='Road bike', price=200, category=self.category, seller=self.user
+        )
+        self.index_url = reverse('listings:index')
+        self.detail_url = reverse('listings:detail', kwargs={'pk': self.listing.pk})
+
+    def test_browse_revalidates_without_queries(self):
+        first = self.client.get(self.index_url, {'category': self.category.pk})
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            again = self.client.get(
+                self.index_url, {'category': self.category.pk}, HTTP_IF_NONE_MATCH=first['ETag']
+            )
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+    def test_browse_etag_changes_with_listings_and_params(self):
+        etag = self.client.get(self.index_url)['ETag']
+        self.assertNotEqual(self.client.get(self.index_url, {'q': 'bike'})['ETag'], etag)
+
+        Listing.objects.create(title='Helmet', price=20, category=self.category, seller=self.user)
+        response = self.client.get(self.index_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_differs_per_viewer(self):
+        anonymous = self.client.get(self.index_url)['ETag']
+        self.client.login(username='user', password='pass')
+        response = self.client.get(self.index_url, HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_revalidates_until_edited(self):
+        first = self.client.get(self.detail_url)
+        self.assertTrue(first.has_header('Last-Modified'))
+
+        with self.assertNumQueries(1):
+            again = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        self.listing.title = 'Road bike, 56cm'
+        self.listing.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '56cm')
+
+    def test_detail_missing_listing_is_404(self):
+        response = self.client.get(reverse('listings:detail', kwargs={'pk': 9999}))
+        self.assertEqual(response.status_code, 404)
+
+
+def make_image(width, height, fmt='JPEG', name='photo.jpg'):
+    out = BytesIO()
+    Image.new('RGB', (width, height), (200, 80, 40)).save(out, format=fmt)
+    return SimpleUploadedFile(name, out.getvalue(), content_type=f'image/{fmt.lower()}')
+
+
+class ThumbnailTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=media.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Cameras')
+        self.listing = Listing.objects.create(
+            title='Film camera', price=90, category=self.category, seller=self.user,
+            image=make_image(800, 600),
+        )
+
+    def test_generate_writes_each_width_and_format(self):
+        widths = thumbnails.generate(self.listing)
+        self.assertEqual(widths, [160, 320, 640, 800])
+
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.image_variants, widths)
+        storage = self.listing.image.storage
+        for width in widths:
+            for fmt in thumbnails.FORMATS:
+                name = thumbnails.variant_name(self.listing.image.name, width, fmt)
+                with storage.open(name) as f:
+                    self.assertEqual(Image.open(f).width, width)
+
+    def test_tag_uses_variants_when_ready(self):
+        self.assertIn(self.listing.image.url, listing_image(self.listing))
+
+        thumbnails.generate(self.listing)
+        html = listing_image(self.listing, sizes='80px')
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('/160.webp 160w', html)
+        self.assertIn('/640.jpg"', html)
+        self.assertIn('sizes="80px"', html)
+
+    def test_upload_through_form_schedules_resize(self):
+        thumbnails.generate(self.listing)
+        self.client.login(username='user', password='pass')
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('listings:edit', kwargs={'pk': self.listing.pk}), {
+                    'title': 'Film camera', 'description': '', 'price': 90,
+                    'image': make_image(300, 200, 'PNG', 'new.png'),
+                })
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.image_variants, [])
+        schedule.assert_called_once_with(self.listing.pk)
+
+    def test_backfill_command(self):
+        out = StringIO()
+        call_command('build_thumbnails', workers=1, stdout=out)
+        self.assertIn('1 listings', out.getvalue())
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.image_variants, [160, 320, 640, 800])
+
+    def test_backfill_keeps_going_after_a_bad_image(self):
+        other = Listing.objects.create(
+            title='Tripod', price=20, category=self.category, seller=self.user, image=make_image(300, 200),
+        )
+        generate = thumbnails.generate
+
+        def bomb_first(listing, **kwargs):
+            if listing.pk == self.listing.pk:
+                raise Image.DecompressionBombError('too many pixels')
+            return generate(listing, **kwargs)
+
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(thumbnails, 'generate', side_effect=bomb_first):
+            call_command('build_thumbnails', workers=1, stdout=out, stderr=err)
+        self.assertIn('1 listings (0 skipped, 1 failed)', out.getvalue())
+        self.assertIn('DecompressionBombError', err.getvalue())
+        other.refresh_from_db()
+        self.assertEqual(other.image_variants, [160, 300])
+
+    def test_backfill_all_redoes_shared_images(self):
+        # Same bytes, so the same stored file (storage.py)
+        twin = Listing.objects.create(
+            title='Same camera', price=90, category=self.category, seller=self.user, image=make_image(800, 600),
+        )
+        self.assertEqual(twin.image.name, self.listing.image.name)
+        thumbnails.generate(self.listing)
+        thumbnails.generate(twin)
+        storage = self.listing.image.storage
+        thumbnails.delete_variants(storage, self.listing.image.name)
+
+        call_command('build_thumbnails', '--all', workers=1, stdout=StringIO())
+        self.assertTrue(storage.exists(thumbnails.variant_name(self.listing.image.name, 160, 'webp')))
+
+
+class ImageStorageTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        self.settings_override = override_settings(MEDIA_ROOT=media.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Cameras')
+        self.client.login(username='user', password='pass')
+
+    def stored_files(self):
+        return sorted(p.name for p in self.media.rglob('*') if p.is_file())
+
+    def create(self, title, image):
+        with mock.patch.object(thumbnails, 'schedule'), self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('listings:create'), {
+                'category': self.category.pk, 'title': title, 'description': '', 'price': 10, 'image': image,
+            })
+
+    def test_same_photo_is_stored_once(self):
+        self.create('Lens', make_image(40, 30))
+        self.create('Lens cap', make_image(40, 30, name='IMG_0001.JPG'))
+
+        first, second = Listing.objects.order_by('id')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^item_images/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_file_deleted_with_last_listing(self):
+        self.create('Lens', make_image(40, 30))
+        self.create('Lens cap', make_image(40, 30))
+        first, second = Listing.objects.order_by('id')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(len(self.stored_files()), 1)
+
+        # Replacing the image on the edit form releases the old one
+        with mock.patch.object(thumbnails, 'schedule'), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('listings:edit', kwargs={'pk': second.pk}), {
+                'title': 'Lens cap', 'description': '', 'price': 10, 'image': make_image(20, 20, 'PNG', 'cap.png'),
+            })
+        second.refresh_from_db()
+        self.assertEqual(self.stored_files(), [second.image.name.rsplit('/', 1)[1]])
+
+    def test_release_checks_under_the_write_lock(self):
+        self.create('Lens', make_image(40, 30))
+        name = Listing.objects.get().image.name
+        with CaptureQueriesContext(connection) as ctx:
+            storage_module.release(name)
+        sql = [query['sql'] for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql']]
+        # The lock UPDATE comes before the lookup, which uses the image index
+        self.assertTrue(sql[0].startswith('UPDATE'), sql)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql[1])
+            self.assertIn('listings_listing_image', ' '.join(row[3] for row in cursor.fetchall()))
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_upload_is_hashed_while_streaming(self):
+        upload = make_image(40, 30)
+        digest = hashlib.sha256(upload.read()).hexdigest()
+        upload.seek(0)
+        with mock.patch('listings.storage.file_digest', wraps=file_digest) as hashed:
+            self.create('Lens', upload)
+        self.assertIn(digest, Listing.objects.get().image.name)
+        self.assertTrue(all(getattr(call.args[0], 'sha256', None) for call in hashed.call_args_list))
+
+    def test_rejects_non_images_and_huge_images(self):
+        response = self.create('Lens', SimpleUploadedFile('lens.jpg', b'not really a jpeg'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Listing.objects.exists())
+
+        with mock.patch('listings.forms.MAX_IMAGE_PIXELS', 100):
+            response = self.create('Lens', make_image(40, 30))
+        self.assertContains(response, 'too large')
+        self.assertFalse(Listing.objects.exists())
+
+
+class ImageMetadataTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=media.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Lamps')
+
+    def test_dimensions_stored_on_upload(self):
+        self.client.login(username='user', password='pass')
+        with mock.patch.object(thumbnails, 'schedule'), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('listings:create'), {
+                'category': self.category.pk, 'title': 'Lamp', 'description': '', 'price': 10,
+                'image': make_image(120, 90, 'PNG', 'lamp.png'),
+            })
+        listing = Listing.objects.get()
+        self.assertEqual((listing.image_width, listing.image_height), (120, 90))
+
+        thumbnails.generate(listing)
+        listing.refresh_from_db()
+        self.assertEqual(listing.image_color, '#c85028')
+
+    def test_grid_renders_without_touching_files(self):
+        for i in range(50):
+            Listing.objects.create(
+                title=f'Lamp {i}', price=10, category=self.category, seller=self.user,
+                image=make_image(40, 30, name=f'lamp{i}.jpg'),
+            )
+        # Rows from before the dimension columns existed must not be measured on load either
+        Listing.objects.filter(title='Lamp 49').update(image_width=None, image_height=None)
+        patches = [
+            mock.patch.object(ContentAddressedStorage, name, side_effect=AssertionError(name))
+            for name in ('open', 'exists', 'size', 'path')
+        ] + [mock.patch('PIL.Image.open', side_effect=AssertionError('Image.open'))]
+        with contextlib.ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            response = self.client.get(reverse('listings:index'))
+        self.assertEqual(len(response.context['listings']), 24)
+        self.assertContains(response, 'width="40" height="30"', count=23)
+
+    def test_backfill_command(self):
+        listings = [
+            Listing.objects.create(
+                title=f'Lamp {i}', price=10, category=self.category, seller=self.user,
+                image=make_image(40 + i, 30, 'PNG', f'lamp{i}.png'),
+            )
+            for i in range(5)
+        ]
+        Listing.objects.update(image_width=None, image_height=None, image_color='')
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('backfill_image_metadata', batch_size=2, stdout=out)
+        self.assertIn('Filled 5 listings', out.getvalue())
+        # 3 full batches + the empty one, each a select plus one bulk update
+        self.assertEqual(sum(1 for q in queries if q['sql'].startswith('SELECT')), 4)
+
+        listing = Listing.objects.get(pk=listings[3].pk)
+        self.assertEqual((listing.image_width, listing.image_height, listing.image_color), (43, 30, '#c85028'))
+
+
 class CreateListingTests(TestCase):
     
     def setUp(self):
@@ -139,4 +1054,145 @@ class DeleteListingTests(TestCase):
         self.client.login(username='user', password='pass')
         self.client.get(reverse('listings:delete', kwargs={'pk': listing.pk}))
         
-        self.assertEqual(Listing.objects.count(), 0)
\ No newline at end of file
+        self.assertEqual(Listing.objects.count(), 0)
+
+
+@override_settings(LISTING_VIEW_FLUSH_THREAD=False)
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every listings_listing query the hot views make.
+    A bare table scan or a temp B-tree sort means one of the indexes in
+    Listing.Meta is missing or no longer matches the query.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.category = Category.objects.create(name='Furniture')
+        for i in range(30):
+            Listing.objects.create(
+                title=f'Desk {i}', price=10, category=self.category, seller=self.user, is_sold=i % 3 == 0
+            )
+        self.listing = Listing.objects.filter(is_sold=False).first()
+        self.client.login(username='user', password='pass')
+
+    def plans(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        plans = []
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'FROM "listings_listing"' not in sql:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plans.append((sql, [row[3] for row in cursor.fetchall()]))
+        self.assertTrue(plans, f'{url} ran no listing queries')
+        return plans
+
+    def assertIndexed(self, url, allow_sort=False):
+        for sql, plan in self.plans(url):
+            for step in plan:
+                self.assertNotEqual(step, 'SCAN listings_listing', f'table scan in {sql}\n{plan}')
+                if not allow_sort:
+                    self.assertNotIn('TEMP B-TREE', step, f'sort without index in {sql}\n{plan}')
+
+    def test_browse(self):
+        self.assertIndexed(reverse('listings:index'))
+
+    def test_browse_category(self):
+        self.assertIndexed(reverse('listings:index') + f'?category={self.category.id}')
+
+    @mock.patch('listings.views.LISTINGS_PER_PAGE', 5)
+    def test_browse_later_page(self):
+        response = self.client.get(reverse('listings:index') + f'?category={self.category.id}')
+        self.assertTrue(response.context['page'].has_next)
+        self.assertIn('cursor=', response.context['next_page_query'])
+        self.assertIndexed(reverse('listings:index') + '?' + response.context['next_page_query'])
+
+    def test_search(self):
+        # Relevance order has to be sorted, but only over the FTS matches.
+        self.assertIndexed(reverse('listings:index') + '?q=desk', allow_sort=True)
+
+    def test_detail_related_items(self):
+        self.assertIndexed(reverse('listings:detail', kwargs={'pk': self.listing.pk}))
+
+    def test_homepage(self):
+        self.assertIndexed(reverse('main:index'))
+
+    def test_dashboard(self):
+        self.assertIndexed(reverse('dashboard:index'))
+
+    def test_profile(self):
+        self.assertIndexed(reverse('account:profile'))
+
+
+@override_settings(LISTING_VIEW_FLUSH_THREAD=False)
+class ViewCounterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        counters._pending.clear()
+        self.addCleanup(counters._pending.clear)
+        # Only flush when a test asks for it
+        patcher = mock.patch("listings.counters.FLUSH_SECONDS", 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        category = Category.objects.create(name="Desks")
+        self.listing = Listing.objects.create(title="Desk", price=60, category=category, seller=self.seller)
+        self.other = Listing.objects.create(title="Chair", price=20, category=category, seller=self.seller)
+        self.url = reverse("listings:detail", kwargs={"pk": self.listing.pk})
+
+    def test_counts_in_memory_once_per_visitor(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse(any(q["sql"].startswith("UPDATE") for q in queries.captured_queries))
+        self.client.get(self.url)
+        Client(HTTP_USER_AGENT="another browser").get(self.url)
+        # The seller looking at their own listing doesn't count
+        self.client.login(username="seller", password="pass")
+        self.client.get(self.url)
+        self.assertEqual(counters.pending(self.listing.pk), 2)
+
+    def test_revalidation_counts_too(self):
+        etag = self.client.get(self.url)['ETag']
+        browser = Client(HTTP_USER_AGENT="another browser")
+        with CaptureQueriesContext(connection) as queries:
+            response = browser.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # The ETag's lookup of the listing is also where the seller comes from
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertEqual(counters.pending(self.listing.pk), 2)
+
+    def test_flush_writes_all_deltas_in_one_update(self):
+        counters._pending.update({self.listing.pk: 3, self.other.pk: 1})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(counters.flush(), 2)
+        self.assertEqual(len([q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]), 1)
+        self.assertEqual(counters.pending(self.listing.pk), 0)
+        self.listing.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.listing.view_count, self.other.view_count), (3, 1))
+
+    def test_flush_thread_follows_setting(self):
+        with mock.patch.object(counters, "_start_flusher") as start:
+            self.client.get(self.url)
+            start.assert_not_called()
+            with override_settings(LISTING_VIEW_FLUSH_THREAD=True):
+                Client(HTTP_USER_AGENT="another browser").get(self.url)
+            start.assert_called_once()
+
+    def test_flushes_when_due(self):
+        with mock.patch("listings.counters.FLUSH_SECONDS", 0):
+            self.client.get(self.url)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.view_count, 1)
+
+    def test_dashboard_includes_unflushed_views(self):
+        Listing.objects.filter(pk=self.listing.pk).update(view_count=5)
+        counters._pending[self.listing.pk] = 2
+        self.client.login(username="seller", password="pass")
+        response = self.client.get(reverse("dashboard:index"))
+        self.assertContains(response, "7 views")
@@ -0,0 +1,198 @@
+"""
+Resized WebP/JPEG variants of listing images.
+
+Uploads are stored as-is, which is far too big for the 80-400px tiles most pages
+show. For every image we write one file per (width, format) next to the original:
+
+    item_images/desk.jpg -> item_images/variants/desk.jpg/640.webp, .../640.jpg, ...
+
+and record the widths in Listing.image_variants, so templates can build a
+srcset without touching the filesystem (see templatetags/listing_images.py).
+Until the variants exist pages simply keep using the original.
+
+Resizing happens in a small thread pool after the upload has committed (Pillow
+releases the GIL while it works), so the request that saved the form does not
+wait for it. `build_thumbnails` backfills existing images.
+"""
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .cache import bump_generation
+from .models import Listing
+
+logger = logging.getLogger(__name__)
+
+# Widths we resize to. Images narrower than a width only get the widths below it
+# (plus their own width, so every image ends up with at least one variant).
+WIDTHS = (160, 320, 640, 1280)
+# Format -> (file extension, Pillow save options)
+FORMATS = {
+    "webp": ("webp", {"quality": 80, "method": 4}),
+    "jpeg": ("jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+WORKERS = getattr(settings, "THUMBNAIL_WORKERS", 2)
+# EXIF orientations that swap width and height (90/270 degree turns)
+ORIENTATION_TAG = 0x0112
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def variant_name(name, width, fmt):
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, "variants", filename, f"{width}.{FORMATS[fmt][0]}")
+
+
+def target_widths(original_width):
+    widths = [w for w in WIDTHS if w < original_width]
+    if len(widths) < len(WIDTHS):
+        widths.append(original_width)
+    return widths
+
+
+def _encode(image, fmt):
+    if fmt == "jpeg" and image.mode != "RGB":
+        # No alpha in JPEG: flatten onto white instead of letting transparency go black
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    elif fmt == "webp" and image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    out = io.BytesIO()
+    image.save(out, format=fmt.upper(), **FORMATS[fmt][1])
+    return out.getvalue()
+
+
+def generate(listing, force=False):
+    """
+    Write every variant for the listing's current image and record the widths.
+    Returns the widths written ([] if there is no usable image). `force` redoes
+    the files even if another listing with the same image already has them.
+    """
+    name = listing.image.name if listing.image else ""
+    if not name:
+        return []
+    storage = listing.image.storage
+
+    # Images are stored once per content (storage.py), so another listing may have done the work
+    if not force:
+        shared = (
+            Listing.objects.filter(image=name).exclude(pk=listing.pk).exclude(image_variants=[])
+            .values("image_variants", "image_width", "image_height", "image_color").first()
+        )
+        if shared:
+            return _record(listing, name, **shared)
+
+    try:
+        with storage.open(name, "rb") as f:
+            original = Image.open(f)
+            original.load()
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning("Could not read image %s for listing %s", name, listing.pk)
+        return []
+    original = ImageOps.exif_transpose(original)
+
+    widths = target_widths(original.width)
+    for width in widths:
+        resized = original.copy()
+        if width < original.width:
+            resized.thumbnail((width, original.height), Image.Resampling.LANCZOS)
+        for fmt in FORMATS:
+            storage.save_derived(variant_name(name, width, fmt), ContentFile(_encode(resized, fmt)))
+    # Size after EXIF rotation, which is what the variants (and browsers) show
+    return _record(
+        listing, name, widths, original.width, original.height, placeholder_color(original)
+    )
+
+
+def placeholder_color(image):
+    """
+    Average colour of an image as "#rrggbb", to paint its box until it loads.
+    """
+    rgba = image.convert("RGBA").resize((1, 1), Image.Resampling.BOX)
+    r, g, b, a = rgba.getpixel((0, 0))
+    # Blend transparency onto white, like the JPEG variants
+    r, g, b = (round(c * a / 255 + 255 * (1 - a / 255)) for c in (r, g, b))
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def image_metadata(storage, name):
+    """
+    (width, height, placeholder colour) of a stored image, or None if it can't be read.
+    Decodes JPEGs at a reduced scale, the colour doesn't need every pixel.
+    """
+    try:
+        with storage.open(name, "rb") as f:
+            image = Image.open(f)
+            width, height = image.size
+            if image.getexif().get(ORIENTATION_TAG) in ROTATED_ORIENTATIONS:
+                width, height = height, width
+            image.draft("RGB", (64, 64))
+            return width, height, placeholder_color(image)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        return None
+
+
+def _record(listing, name, image_variants, image_width, image_height, image_color):
+    # Only if the image wasn't replaced meanwhile. update() skips the signals, so
+    # bump the cached pages and the detail page's ETag (updated_at) by hand.
+    fields = {
+        "image_variants": image_variants,
+        "image_width": image_width,
+        "image_height": image_height,
+        "image_color": image_color,
+    }
+    updated = Listing.objects.filter(pk=listing.pk, image=name).update(updated_at=timezone.now(), **fields)
+    if updated:
+        for field, value in fields.items():
+            setattr(listing, field, value)
+        bump_generation()
+    return image_variants
+
+
+def delete_variants(storage, name):
+    directory = posixpath.dirname(variant_name(name, 0, "webp"))
+    if not storage.exists(directory):
+        return
+    for filename in storage.listdir(directory)[1]:
+        storage.delete(posixpath.join(directory, filename))
+    storage.delete(directory)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="thumbnails")
+        return _executor
+
+
+def _generate_by_pk(pk):
+    # Runs on a pool thread, which has its own database connection to look after
+    close_old_connections()
+    try:
+        listing = Listing.objects.filter(pk=pk).first()
+        if listing is not None:
+            return generate(listing)
+    except Exception:
+        logger.exception("Generating thumbnails for listing %s failed", pk)
+    finally:
+        close_old_connections()
+
+
+def schedule(pk):
+    """
+    Queue variant generation for a listing. Call it once the upload has committed.
+    """
+    return _pool().submit(_generate_by_pk, pk)
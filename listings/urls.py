@@ -6,6 +6,12 @@ app_name = 'listings'
 urlpatterns = [
     # Browse unsold items.
     path('', views.index, name='index'),
+    # Read-only JSON feed of unsold items (same filters as the browse page)
+    path('api/', views.api_index, name='api'),
+    # Search box suggestions
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    # Results cache hit rate of this server process (staff only)
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
     # Creta a new listing
     path('new/', views.create, name='create'),
     # Show a particular listing by id
@@ -1,48 +1,226 @@
 # listings/views.py
+import json
+
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
 
+from . import cache as listing_cache
+from . import counters, freshness, fuzzy, search
+from .autocomplete import suggestions
+from .facets import category_counts
 from .models import Category, Listing
 from .forms import NewListingForm, EditListingForm
+from .pagination import InvalidCursor, KeysetPage, paginate
+
+LISTINGS_PER_PAGE = 24
+
+# Public name -> column for the JSON API. Only these can be requested with ?fields=
+API_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "description": "description",
+    "price": "price",
+    "category": "category_id",
+    "category_slug": "category__slug",
+    "seller": "seller__username",
+    "image": "image",
+    "image_width": "image_width",
+    "image_height": "image_height",
+    "created_at": "created_at",
+}
+API_DEFAULT_FIELDS = ("id", "title", "price", "category", "created_at")
+# Rows fetched from the DB and items written out per chunk
+API_CHUNK_SIZE = 500
+
+
+def _page_query(request, cursor):
+    # Same querystring (q/query, category, ...) with a different cursor
+    params = request.GET.copy()
+    params["cursor"] = cursor
+    return params.urlencode()
+
+def _browse_page(query, category_id, cursor):
+    """
+    One page of unsold listings for a search/category/cursor combination, plus
+    whether it is a fuzzy fallback (the exact search found nothing).
+    The page's ordered ids are cached until the next listing change (see cache.py),
+    so a repeat only costs a primary key lookup.
+    """
+    key = listing_cache.results_key(query, category_id, cursor)
+    cached = cache.get(key)
+    listing_cache.record_lookup(hit=cached is not None)
+    if cached is not None:
+        ids, next_cursor, previous_cursor, is_fuzzy = cached
+        # is_sold filter again in case a sale slipped past the signals (QuerySet.update)
+        by_id = Listing.objects.filter(is_sold=False).in_bulk(ids)
+        return KeysetPage([by_id[pk] for pk in ids if pk in by_id], next_cursor, previous_cursor), is_fuzzy
+
+    # Only keep unsold items. id breaks ties between listings created at the same instant.
+    qs = Listing.objects.filter(is_sold=False).order_by("-created_at", "-id")
+
+    if category_id:
+        qs = qs.filter(category_id=category_id)
+
+    # Ranked full-text match, see listings/search.py
+    if query:
+        def get_page(cursor=None):
+            return search.search_page(qs, query, category_id, cursor, per_page=LISTINGS_PER_PAGE)
+    else:
+        def get_page(cursor=None):
+            return paginate(qs, cursor, per_page=LISTINGS_PER_PAGE)
+
+    try:
+        page = get_page(cursor)
+    except InvalidCursor:
+        page = get_page()
+
+    # Nothing matched exactly, try typo-tolerant title matches instead (single page only)
+    is_fuzzy = False
+    if query and not page.object_list and not page.has_previous:
+        ids = fuzzy.fuzzy_ids(query, category_id, limit=LISTINGS_PER_PAGE)
+        if ids:
+            by_id = Listing.objects.in_bulk(ids)
+            page = KeysetPage([by_id[pk] for pk in ids if pk in by_id])
+            is_fuzzy = True
 
+    cache.set(
+        key,
+        ([l.pk for l in page], page.next_cursor, page.previous_cursor, is_fuzzy),
+        listing_cache.RESULTS_TIMEOUT,
+    )
+    return page, is_fuzzy
+
+# Browsers must revalidate, but an unchanged page comes back as a bare 304 (see freshness.py)
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=freshness.listings_etag, last_modified_func=freshness.listings_last_modified)
 def index(request):
     """
     Browse available listings
     Accepts search via ?query=... or ?q=..., and optional ?category=<id>
+    Paginated with ?cursor=... (keyset on newest first, see pagination.py; searches
+    page through their ranked results, see search.search_page)
     """
 
     # We support both 'query' and 'q' to match templates from different parts of the site
     query = request.GET.get('query', '') or request.GET.get('q', '')
     category_id = request.GET.get('category', '')
 
-    # Only keep unsold items
-    qs = Listing.objects.filter(is_sold=False)
-
-    if category_id:
-        qs = qs.filter(category_id=category_id)
-
-    if query:
-        qs = qs.filter(Q(title__icontains=query) | Q(description__icontains=query))
+    page, is_fuzzy = _browse_page(query, category_id, request.GET.get("cursor"))
 
+    # Sidebar counts come from one cached GROUP BY, see facets.py
+    counts = category_counts(query)
+    categories = list(Category.objects.all())
+    for c in categories:
+        c.listing_count = counts.get(c.id, 0)
 
     # Some templates look for 'category_id', others for 'active_category', so we keep both for compatability. Can refine later.
-    categories = Category.objects.all()
     ctx = {
-        "listings": qs,
+        "listings": page.object_list,
+        "page": page,
+        "fuzzy": is_fuzzy,
+        "next_page_query": _page_query(request, page.next_cursor) if page.has_next else "",
+        "previous_page_query": _page_query(request, page.previous_cursor) if page.has_previous else "",
         "query": query,
+        "q": query,
         "categories": categories,
         "category_id": int(category_id) if category_id else 0,
         "active_category": int(category_id) if category_id else None,
     }
     return render(request, "listings/items.html", ctx)
 
+def _api_chunks(rows, names):
+    """
+    Writes {"results": [...]} a chunk at a time so exports never hold the whole catalog in memory.
+    """
+    encoder = DjangoJSONEncoder()
+    yield '{"results":['
+    chunk, separator = [], ""
+    for row in rows:
+        item = dict(zip(names, row))
+        if "image" in item:
+            item["image"] = Listing.image.field.storage.url(item["image"]) if item["image"] else None
+        chunk.append(json.dumps(item, default=encoder.default))
+        if len(chunk) >= API_CHUNK_SIZE:
+            yield separator + ",".join(chunk)
+            chunk, separator = [], ","
+    if chunk:
+        yield separator + ",".join(chunk)
+    yield "]}"
+
+@require_GET
+def api_index(request):
+    """
+    Read-only JSON listing feed with the same filters as index (?q= / ?query=, ?category=).
+    ?fields=id,title,price picks the fields; only those columns are fetched.
+    The response is streamed, so a full export runs in constant memory.
+    """
+    query = request.GET.get('query', '') or request.GET.get('q', '')
+    category_id = request.GET.get('category', '')
+
+    requested = request.GET.get("fields", "")
+    names = [name.strip() for name in requested.split(",") if name.strip()] or list(API_DEFAULT_FIELDS)
+    unknown = [name for name in names if name not in API_FIELDS]
+    if unknown:
+        return JsonResponse({
+            "error": f"Unknown field(s): {', '.join(unknown)}",
+            "fields": sorted(API_FIELDS),
+        }, status=400)
+    if category_id and not category_id.isdigit():
+        return JsonResponse({"error": "category must be a category id"}, status=400)
+
+    qs = Listing.objects.filter(is_sold=False).order_by("-created_at", "-id")
+    if category_id:
+        qs = qs.filter(category_id=category_id)
+    if query:
+        qs = search.search(qs, query)
+
+    rows = qs.values_list(*(API_FIELDS[name] for name in names)).iterator(chunk_size=API_CHUNK_SIZE)
+    return StreamingHttpResponse(_api_chunks(rows, names), content_type="application/json")
+
+@require_GET
+def autocomplete(request):
+    """
+    Title and category completions for the search box (?q=prefix).
+    Served from the in-process prefix index, no database query per keystroke.
+    """
+    titles, categories = suggestions.lookup(request.GET.get("q", ""))
+    return JsonResponse({
+        "titles": titles,
+        "categories": [{"id": pk, "name": name} for pk, name in categories],
+    })
+
+@staff_member_required
+@require_GET
+def cache_stats(request):
+    """
+    Hit/miss counters of the results cache as this server process sees them.
+    With the default per-process cache the listing_cache_stats command can't
+    read them, so this is where to look.
+    """
+    return JsonResponse(listing_cache.stats())
+
+# Counted before @condition, so revalidations that end in a 304 count too (counters.py)
+@counters.counts_views
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=freshness.detail_etag, last_modified_func=freshness.detail_last_modified)
 def detail(request, pk):
     """
-    Show a single listing plus a few related items from the same category.
+    Show a single listing plus a few related items.
+    Related items are precomputed by content similarity (related.py); until they
+    exist for this listing we fall back to the newest from the same category.
     """
     listing = get_object_or_404(Listing, pk=pk)
-    related = Listing.objects.filter(category=listing.category, is_sold=False).exclude(pk=pk)[:3]
+    related = list(
+        Listing.objects.filter(related_to__listing=listing, is_sold=False).order_by("-related_to__score")[:3]
+    )
+    if not related:
+        related = Listing.objects.filter(category=listing.category, is_sold=False).exclude(pk=pk)[:3]
     return render(request, "listings/detail.html", {
         "listing": listing,
         "related_listings": related,
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.views import static
+
+from main import media
+
+
+def _drain(response):
+    size = 0
+    for chunk in response.streaming_content if response.streaming else [response.content]:
+        size += len(chunk)
+    response.close()
+    return size
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare media throughput of the old static() helper and main.media.serve, in process. "
+        "Doesn't include the sendfile(2)/X-Accel-Redirect savings, which happen in the server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--size", type=int, default=2 * 1024 * 1024, help="Test file size in bytes.")
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        with tempfile.TemporaryDirectory() as root:
+            name = "benchmark.jpg"
+            with open(os.path.join(root, name), "wb") as f:
+                f.write(os.urandom(options["size"]))
+
+            with override_settings(MEDIA_ROOT=root, MEDIA_SENDFILE=None):
+                etag = media.serve(factory.get("/"), name)["ETag"]
+                cases = [
+                    ("static() full", lambda: static.serve(factory.get("/"), name, document_root=root)),
+                    ("media full", lambda: media.serve(factory.get("/"), name)),
+                    ("media range 64KB", lambda: media.serve(factory.get("/", HTTP_RANGE="bytes=0-65535"), name)),
+                    ("media revalidate", lambda: media.serve(factory.get("/", HTTP_IF_NONE_MATCH=etag), name)),
+                ]
+                for label, call in cases:
+                    self._run(label, call, options["requests"])
+
+    def _run(self, label, call, requests):
+        sent = 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            sent += _drain(call())
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{label:<20} {requests / elapsed:10.0f} req/s {sent / elapsed / 1024 / 1024:10.1f} MB/s"
+        )
@@ -0,0 +1,150 @@
+"""
+Serving MEDIA_ROOT (listing photos and their variants).
+
+Meant for production as well as development:
+
+* MEDIA_SENDFILE = "x-accel-redirect" (nginx) or "x-sendfile" (Apache/lighttpd)
+  hands the file to the front-end server, which streams it with sendfile(2).
+  Django only checks the path and sets the headers.
+* Otherwise the file goes out as a FileResponse, which WSGI servers that
+  provide wsgi.file_wrapper (gunicorn, uWSGI) also send with sendfile(2).
+
+Either way responses carry an ETag/Last-Modified, answer conditional requests
+with 304 and byte ranges with 206. Content-addressed files (storage.py in
+listings) never change under the same name, so they are cached as immutable.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+# A 64 hex digit name means the file is named after its content (and so is anything derived from it)
+IMMUTABLE_RE = re.compile(r"(^|/)[0-9a-f]{64}\.")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=86400"
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+
+def _etag(st):
+    # Same shape as nginx's: mtime and size, no need to read the file
+    return quote_etag(f"{st.st_mtime_ns:x}-{st.st_size:x}")
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single "bytes=" range, None to ignore the header
+    (missing, malformed or several ranges: the whole file is a valid answer),
+    or False if it can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+class RangeFile:
+    """
+    Reads `length` bytes of `f` from `start`. No fileno(), so servers don't try
+    to sendfile() the whole thing.
+    """
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.f = f
+        self.remaining = length
+
+    def __iter__(self):
+        while self.remaining > 0:
+            chunk = self.f.read(min(CHUNK_SIZE, self.remaining))
+            if not chunk:
+                break
+            self.remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.f.close()
+
+
+def _offload(response, path, full_path):
+    mode = getattr(settings, "MEDIA_SENDFILE", None)
+    if mode == "x-accel-redirect":
+        prefix = getattr(settings, "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + path.lstrip("/")
+    elif mode == "x-sendfile":
+        response["X-Sendfile"] = full_path
+    else:
+        return False
+    return True
+
+
+@require_safe
+def serve(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Not found")
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        raise Http404("Not found")
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404("Not found")
+
+    etag = _etag(st)
+    cache_control = IMMUTABLE_CACHE_CONTROL if IMMUTABLE_RE.search(path) else DEFAULT_CACHE_CONTROL
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if not_modified is not None:
+        not_modified["Cache-Control"] = cache_control
+        return not_modified
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+
+    # With an offload header the front-end server sends the body, ranges included
+    response = HttpResponse(content_type=content_type)
+    if not _offload(response, path, full_path):
+        byte_range = None
+        if_range = request.headers.get("If-Range")
+        if if_range is None or if_range == etag:
+            byte_range = parse_range(request.headers.get("Range"), st.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{st.st_size}"
+        elif byte_range is not None:
+            start, end = byte_range
+            response = FileResponse(RangeFile(open(full_path, "rb"), start, end - start + 1),
+                                    status=206, content_type=content_type)
+            response["Content-Length"] = end - start + 1
+            response["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+        else:
+            response = FileResponse(open(full_path, "rb"), content_type=content_type)
+        response["Accept-Ranges"] = "bytes"
+
+    if encoding:
+        response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(st.st_mtime)
+    response["Cache-Control"] = cache_control
+    return response
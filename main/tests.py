@@ -1,4 +1,7 @@
-from django.test import TestCase, Client
+import tempfile
+from pathlib import Path
+
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
 from listings.models import Listing, Category
@@ -41,6 +44,14 @@ class IndexViewTests(TestCase):
         response = self.client.get(self.url)
         self.assertContains(response, 'Sell an Item')
 
+    def test_not_modified_until_listings_change(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        category = Category.objects.create(name='Lighting')
+        Listing.objects.create(title='Lamp', description='', price=5, category=category, seller=self.user)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
 
 class LoginViewTests(TestCase):
     
@@ -110,4 +121,57 @@ class SignupViewTests(TestCase):
             'password1': 'securepass123',
             'password2': 'securepass123'
         })
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+class MediaServeTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=media.name, MEDIA_SENDFILE=None)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.name = 'item_images/ab/' + 'ab' * 32 + '.jpg'
+        self.data = bytes(range(256)) * 40
+        path = Path(media.name) / self.name
+        path.parent.mkdir(parents=True)
+        path.write_bytes(self.data)
+        self.url = reverse('media', kwargs={'path': self.name})
+
+    def test_full_file_with_cache_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+
+        # Stale If-Range: the whole (new) file instead
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_sendfile_offload(self):
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(response.content, b'')
+
+    def test_no_escaping_media_root(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/item_images/').status_code, 404)
@@ -1,7 +1,12 @@
 from django.shortcuts import render, redirect
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from listings import freshness
 from listings.models import Category, Listing
 from .forms import SignUpForm
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=freshness.listings_etag, last_modified_func=freshness.listings_last_modified)
 def index(request):
     """
     Homepage that shows a small selection of available listings and all categories.
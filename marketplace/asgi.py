@@ -2,6 +2,9 @@
 ASGI config for marketplace project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn marketplace.asgi:application``) so
+conversation streams (conversations.views.stream) can stay open and push new
+messages; under WSGI they fall back to the browser reconnecting every few seconds.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
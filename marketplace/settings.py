@@ -56,6 +56,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'conversations.context_processors.unread_messages',
             ]
         }
     }
@@ -70,6 +71,15 @@ DATABASES = {
     }
 }
 
+# Local memory cache is per process. Switch to a shared backend (Redis/Memcached)
+# before running more than one worker, the listing caches rely on it for invalidation.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'i-haul',
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -88,5 +98,38 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Hand media files to the front-end server instead of streaming them from Python:
+# None, 'x-accel-redirect' (nginx, with an internal location at MEDIA_ACCEL_REDIRECT_PREFIX) or 'x-sendfile'
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Vocabulary + vectors for related listings, written by `manage.py build_related_listings`
+# (nightly) and kept current by `manage.py build_related_listings --changed` (every few minutes)
+RELATED_LISTINGS_MODEL_PATH = BASE_DIR / 'var' / 'related_listings.npz'
+
+# Django's default handlers, plus a SHA-256 of each file computed as it streams in (listings/uploads.py)
+FILE_UPLOAD_HANDLERS = [
+    'listings.uploads.HashingMemoryFileUploadHandler',
+    'listings.uploads.HashingTemporaryFileUploadHandler',
+]
+
+# Where new-message notifications for live conversations go (conversations/pubsub.py).
+# The in-process default only reaches streams in the same process; use a shared backend with several ASGI workers.
+CONVERSATIONS_PUBSUB_BACKEND = 'conversations.pubsub.InProcessBroker'
+
+# Conversations idle for longer than this get their messages moved to compressed
+# archive blocks by `manage.py archive_conversations` (conversations/archive.py)
+CONVERSATIONS_ARCHIVE_AFTER_DAYS = 365
+
+# Listing view counts are buffered in memory and written this often (listings/counters.py);
+# repeat views by the same visitor within the dedupe window count once
+LISTING_VIEW_FLUSH_SECONDS = 30
+LISTING_VIEW_DEDUPE_SECONDS = 30 * 60
+# A thread per process does the writing (even with no traffic), plus once at exit.
+# Tests that render listing pages turn it off and flush by hand.
+LISTING_VIEW_FLUSH_THREAD = True
+
+# Threads per process resizing uploaded listing images (listings/thumbnails.py)
+THUMBNAIL_WORKERS = 2
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
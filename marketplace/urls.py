@@ -1,7 +1,7 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from main import media
 
 urlpatterns = [
     # Homepage
@@ -15,9 +15,7 @@ urlpatterns = [
     # Seller dashboard
     path('dashboard/', include('dashboard.urls')),
     # Django admin
-    path('admin/', admin.site.urls)
+    path('admin/', admin.site.urls),
+    # Uploaded photos. Set MEDIA_SENDFILE in production so the web server sends the bytes (main/media.py)
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), media.serve, name='media'),
 ]
-
-# Dev only media serving, will need to use server for production
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)